@@ -28,5 +28,10 @@ get_installed(prefix):
     Generator returns a sorted list of all installed packages.
     Each element is the filename of the egg which was used to install the
     package.
+
+remove_packages(eis):
+    Remove the installed packages of a list of EggInst objects at once,
+    which is faster than calling the remove() method of each object.
 """
-from egginst.main import EggInst, get_installed, name_version_fn
+from egginst.main import (EggInst, get_installed, name_version_fn,
+                          remove_packages)
@@ -37,3 +37,4 @@ def create_info(egg, extra_info=None):
         info.update(extra_info)
     with open(join(egg.meta_dir, 'info.json'), 'w') as fo:
         json.dump(info, fo, indent=2, sort_keys=True)
+    return info
@@ -0,0 +1,187 @@
+"""
+Runs the hook scripts of packages (post_egginst.py, pre_egguninst.py)
+without starting a new Python interpreter for each script.
+
+One worker process (of sys.executable) is started per target prefix, and
+kept running until this process exits.  For each script, the worker forks
+a child, in which the script is run as __main__ (with its own working
+directory, sys.argv and sys.path[0], exactly as it would be run by
+"python -E script --prefix PREFIX"), and reports the exit code of the
+child back.  The requests are read by the worker from a pipe, and the exit
+codes are written to a separate pipe, such that the scripts use the same
+stdin, stdout and stderr as before (e.g. scripts may still prompt the
+user).
+
+Where fork is not available (Windows), or when the worker cannot be used,
+each script is run in a new process.  A script is never run twice: when
+the worker exits after a script was sent to it, the script is considered
+to have failed.
+"""
+import os
+import sys
+import json
+import atexit
+from os.path import dirname
+from subprocess import Popen, call
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+WORKER_CODE = r"""
+import os, sys, json, runpy, traceback
+reqs = os.fdopen(int(sys.argv[1]))
+resp = os.fdopen(int(sys.argv[2]), 'w')
+while True:
+    line = reqs.readline()
+    if not line:
+        break
+    req = json.loads(line)
+    # sys.argv contains byte strings
+    path = req['path'].encode('utf-8')
+    args = [arg.encode('utf-8') for arg in req['args']]
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            reqs.close()
+            resp.close()
+            os.chdir(req['cwd'])
+            sys.argv = [path] + args
+            sys.path[0] = os.path.dirname(path)
+            runpy.run_path(path, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                sys.stderr.write('%s\n' % e.code)
+        except BaseException:
+            traceback.print_exc()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code & 0xff)
+    status = os.waitpid(pid, 0)[1]
+    resp.write('%d\n' % (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                         else 1))
+    resp.flush()
+"""
+
+
+def _cloexec(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFD,
+                fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+
+class HookRunner(object):
+
+    def __init__(self, executable=sys.executable):
+        req_r, req_w = os.pipe()
+        resp_r, resp_w = os.pipe()
+        # our ends of the pipes are not inherited by the worker (or any
+        # other process), such that it exits once we close them
+        _cloexec(req_w)
+        _cloexec(resp_r)
+        try:
+            self.proc = Popen([executable, '-E', '-c', WORKER_CODE,
+                               str(req_r), str(resp_w)])
+        except:
+            os.close(req_w)
+            os.close(resp_r)
+            raise
+        finally:
+            os.close(req_r)
+            os.close(resp_w)
+        self.reqs = os.fdopen(req_w, 'w')
+        self.resp = os.fdopen(resp_r)
+
+    def send(self, path, args, cwd):
+        """
+        send the request to run the script path (with args) in the
+        directory cwd to the worker
+        """
+        # such that the output of the script comes after ours
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.reqs.write(json.dumps(dict(path=path, args=args,
+                                        cwd=cwd)) + '\n')
+        self.reqs.flush()
+
+    def receive(self):
+        """
+        return the exit code of the script sent last, or None if the
+        worker exited
+        """
+        line = self.resp.readline()
+        if not line:
+            return None
+        return int(line)
+
+    def run(self, path, args, cwd):
+        """
+        run the script path (with args) in the directory cwd, and return
+        its exit code
+        """
+        self.send(path, args, cwd)
+        code = self.receive()
+        if code is None:
+            raise IOError("hook runner exited unexpectedly")
+        return code
+
+    def close(self):
+        self.reqs.close()
+        self.proc.wait()
+        self.resp.close()
+
+
+# maps prefixes to their worker
+_runners = {}
+
+
+def close_all():
+    for runner in _runners.values():
+        try:
+            runner.close()
+        except (IOError, OSError):
+            pass
+    _runners.clear()
+
+atexit.register(close_all)
+
+
+def _discard(prefix):
+    runner = _runners.pop(prefix, None)
+    if runner:
+        try:
+            runner.close()
+        except (IOError, OSError):
+            pass
+
+
+def run(path, prefix):
+    """
+    run the hook script path for prefix, and return its exit code
+    """
+    args = ['--prefix', prefix]
+    cwd = dirname(path)
+    if hasattr(os, 'fork') and fcntl is not None:
+        try:
+            if prefix not in _runners:
+                _runners[prefix] = HookRunner()
+            runner = _runners[prefix]
+            runner.send(path, args, cwd)
+        except (IOError, OSError, ValueError):
+            _discard(prefix)
+        else:
+            code = runner.receive()
+            if code is None:
+                # the script may have run, so it is not run again
+                print "Warning: hook runner exited while running:", path
+                _discard(prefix)
+                return 1
+            return code
+    return call([sys.executable, '-E', path] + args, cwd=cwd)
@@ -0,0 +1,121 @@
+"""
+Host-wide cache of unpacked eggs, from which files are hardlinked into
+prefixes (instead of being decompressed again for each prefix).
+
+Each egg is unpacked once into a directory of the cache, which mirrors the
+members (arcnames) of the egg.  Files which are modified per prefix after
+being installed, i.e. object files containing placeholders and scripts
+(whose #! line is fixed), are listed in the __cache__.json file of the
+directory, and are always copied into the prefix instead of being linked.
+Moreover, EggInst.may_link decides by destination, i.e. no file which
+ends up in the bin directory is linked.  Files which are made executable
+(e.g. shared libraries) get their final mode in the cache, such that they
+can be linked.
+A directory is unpacked under a temporary name and then renamed, such that
+several processes may populate the cache at the same time.
+"""
+import os
+import json
+import mmap
+import shutil
+import hashlib
+import zipfile
+from os.path import basename, dirname, isdir, join
+
+from utils import rm_rf
+import object_code
+
+
+# members below these directories end up in the bin directory of the
+# prefix, where scripts.fix_scripts may modify them
+SCRIPT_DIRS = ('EGG-INFO/scripts/', 'EGG-INFO/usr/bin/')
+
+# part of the names of the directories, such that directories unpacked
+# (with other modes) by older versions are not used
+CACHE_VERSION = 2
+
+
+def supported():
+    return hasattr(os, 'link')
+
+
+def cache_name(z, fn):
+    """
+    return the name of the directory, in the cache, for the egg fn (with
+    zip-file z), which depends on the names and CRCs of its members, such
+    that a rebuilt egg (with the same filename) is unpacked again
+    """
+    h = hashlib.md5('%d\n' % CACHE_VERSION)
+    for zinfo in z.infolist():
+        h.update('%s %d\n' % (zinfo.filename, zinfo.CRC))
+    if fn.endswith('.egg'):
+        fn = fn[:-4]
+    return '%s-%s' % (fn, h.hexdigest()[:10])
+
+
+def has_placeholders(path):
+    if object_code.get_object_type(path) is None:
+        return False
+    f = open(path, 'rb')
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return object_code.placehold_pat.search(mm) is not None
+    finally:
+        mm.close()
+        f.close()
+
+
+def unpack(z, dir_path, executable=None):
+    """
+    unpack the zip-file z into dir_path, and return the list of members
+    which have to be copied (instead of linked).  The members for which
+    executable(arcname) is True are made executable.
+    """
+    copy = []
+    for zinfo in z.infolist():
+        name = zinfo.filename
+        if name.endswith('/'):
+            continue
+        path = join(dir_path, *name.split('/'))
+        if not isdir(dirname(path)):
+            os.makedirs(dirname(path))
+        fi = z.open(zinfo)
+        fo = open(path, 'wb')
+        shutil.copyfileobj(fi, fo, 262144)
+        fo.close()
+        fi.close()
+        if executable and executable(name):
+            os.chmod(path, 0755)
+        if name.startswith(SCRIPT_DIRS) or has_placeholders(path):
+            copy.append(name)
+    with open(join(dir_path, '__cache__.json'), 'w') as fo:
+        json.dump(dict(copy=copy), fo, indent=2, sort_keys=True)
+    return copy
+
+
+def get_dir(cache_dir, zip_path, executable=None):
+    """
+    return the tuple(directory, set of members which have to be copied)
+    for the egg zip_path in the cache, unpacking the egg if necessary
+    (see unpack)
+    """
+    z = zipfile.ZipFile(zip_path)
+    try:
+        dir_path = join(cache_dir, cache_name(z, basename(zip_path)))
+        meta_path = join(dir_path, '__cache__.json')
+        if isdir(dir_path):
+            return dir_path, set(json.load(open(meta_path))['copy'])
+
+        tmp_path = '%s.tmp-%d' % (dir_path, os.getpid())
+        rm_rf(tmp_path)
+        copy = unpack(z, tmp_path, executable)
+    finally:
+        z.close()
+    try:
+        os.rename(tmp_path, dir_path)
+    except OSError:
+        # another process unpacked the same egg in the meantime
+        rm_rf(tmp_path)
+        if not isdir(dir_path):
+            raise
+    return dir_path, set(copy)
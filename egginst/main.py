@@ -11,13 +11,22 @@ import os
 import sys
 import re
 import json
+import zlib
 import zipfile
+import threading
 from logging import getLogger
-from os.path import abspath, basename, dirname, join, isdir, isfile
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os.path import (abspath, basename, dirname, getmtime, join, isdir,
+                     isfile)
 
 from utils import (on_win, bin_dir_name, rel_site_packages, human_bytes,
                    rm_empty_dir, rm_rf, get_executable)
 import scripts
+import linkcache
+import remover
+import manifest
+import prefixdb
 from console import setup_handlers
 
 
@@ -25,6 +34,26 @@ NS_PKG_PAT = re.compile(
     r'\s*__import__\([\'"]pkg_resources[\'"]\)\.declare_namespace'
     r'\(__name__\)\s*$')
 
+# an __init__.py larger than this cannot be a namespace package declaration
+# (which only matches NS_PKG_PAT), so there is no need to read it
+NS_PKG_MAX_SIZE = 4096
+
+# name of the (binary) manifest in the meta-data directory, see manifest.py
+MANIFEST_FN = 'egginst.manifest'
+
+# size of the buffer used for extracting members
+BUFFSIZE = 262144
+
+# byte-compiles the files whose paths are read from stdin
+COMPILE_CODE = """\
+import sys, py_compile
+for path in sys.stdin.read().splitlines():
+    try:
+        py_compile.compile(path, doraise=True)
+    except py_compile.PyCompileError as e:
+        sys.stderr.write('Warning: %s\\n' % e.msg)
+"""
+
 
 def name_version_fn(fn):
     """
@@ -70,17 +99,130 @@ class EggInst(object):
             self.egginfo_dir = join(self.prefix, 'EGG-INFO')
             self.meta_dir = join(self.egginfo_dir, self.cname)
 
+        # database of the installed packages, which is only maintained for
+        # packages (also hook packages) within the prefix
+        if not self.hook or self.pkgs_dir == join(self.prefix, 'pkgs'):
+            self.db = prefixdb.PrefixDB(self.prefix)
+        else:
+            self.db = None
+
         self.meta_json = join(self.meta_dir, 'egginst.json')
+        self.meta_manifest = join(self.meta_dir, MANIFEST_FN)
         self.files = []
+        # maps the arcnames of the installed members to [size, CRC]
+        self.arcinfo = {}
+        # paths of files which are already installed, and are not written
+        # again (see install_patch)
+        self.keep = set()
+        # path of the zip-file, from which members may be extracted in
+        # parallel (see write_members), and the number of threads used
+        self.zip_path = None
+        self.workers = None
+        # when set, files are hardlinked from this host-wide cache of
+        # unpacked eggs (see linkcache), instead of being extracted
+        self.link_cache = None
+        self.link_dir = None
+        self.link_copy = set()
+        self.hardlinks = []
+        # when True, the installed .py files are byte-compiled
+        self.compile = False
         self.verbose = verbose
 
 
-    def install(self, extra_info=None):
+    def install(self, extra_info=None, fileobj=None):
+        """
+        install the egg, which is read from the (seekable) file object
+        fileobj, if given, instead of the file located at self.path
+        """
+        self.z = zipfile.ZipFile(fileobj or self.path)
+        if fileobj is None:
+            self.zip_path = self.path
+        self._install(extra_info)
+
+    def install_patch(self, src_path, patch_path, extra_info=None):
+        """
+        upgrade the package, which is currently installed from the egg
+        src_path, by applying the .zdiff patch_path (from src_path to this
+        egg) to the installed package.  Only the files of changed members
+        are written, and the files which are no longer part of the package
+        are removed.
+        """
+        from enstaller.zdiff import PatchedZip
+
+        d = read_meta(self.meta_dir)
+        if self.hook or d is None or d['egg_name'] != basename(src_path):
+            raise Exception("%s is not installed, cannot patch: %r" %
+                            (basename(src_path), self.prefix))
+        self.z = PatchedZip(src_path, patch_path)
+        self._upgrade(d, self.z.unchanged(), extra_info)
+
+    def upgrade(self, extra_info=None, fileobj=None):
+        """
+        upgrade the currently installed version of the package to this egg
+        (which is read from fileobj, if given).  The members, whose size
+        and CRC (in the central directory of the egg) are the same as
+        recorded at the time the installed version was installed, are not
+        written again, and the files which are no longer part of the
+        package are removed.  When nothing was recorded, the installed
+        version is removed, and the egg is installed from scratch.
+        """
+        d = read_meta(self.meta_dir)
+        if self.hook or d is None or 'arcinfo' not in d:
+            if d is not None:
+                self.remove()
+                self.files = []
+            self.install(extra_info, fileobj)
+            return
+
+        self.z = zipfile.ZipFile(fileobj or self.path)
+        if fileobj is None:
+            self.zip_path = self.path
+        unchanged = []
+        for name, (size, crc) in d['arcinfo'].iteritems():
+            zinfo = self.z.NameToInfo.get(name)
+            if zinfo and zinfo.file_size == size and zinfo.CRC == crc:
+                unchanged.append(name)
+        self._upgrade(d, unchanged, extra_info)
+
+    def _upgrade(self, d, unchanged, extra_info):
+        """
+        install self.z over the installed version (whose meta-data is d),
+        keeping the installed files of the unchanged members
+        """
+        self.install_app(remove=True)
+        self.run('pre_egguninst.py')
+
+        old_files = set(abspath(join(self.prefix, f)) for f in d['files'])
+        self.keep = old_files.intersection(self.get_dst(name)
+                                           for name in unchanged)
+        # kept files which are links (to the link cache) remain links
+        self.hardlinks.extend(self.keep.intersection(
+                abspath(join(self.prefix, f))
+                for f in d.get('hardlinks', [])))
+        self._install(extra_info)
+
+        new_files = set(self.files)
+        # the byte-code of kept .py files is still valid
+        obsolete = (old_files - new_files -
+                    set([self.meta_json, self.meta_manifest]) -
+                    set(p + 'c' for p in self.keep if p.endswith('.py')))
+        paths = list(obsolete)
+        paths.extend(p + 'c' for p in obsolete
+                     if p.endswith('.py') and p + 'c' not in new_files)
+        remover.remove_files(paths, self.workers)
+        remover.prune_dirs(paths, self.prefix)
+
+    def _install(self, extra_info):
+        # connect before the prefix is modified, as the database would
+        # otherwise be considered out of date (and rebuilt)
+        if self.db:
+            self.db.connect()
         if not isdir(self.meta_dir):
             os.makedirs(self.meta_dir)
 
-        self.z = zipfile.ZipFile(self.path)
         self.arcnames = self.z.namelist()
+        self.arcset = set(self.arcnames)
+        self._namespace = {}
         self.extract()
 
         if on_win:
@@ -92,12 +234,15 @@ class EggInst(object):
                 links.verbose = object_code.verbose = True
             links.create(self)
             object_code.fix_files(self)
+        if self.compile:
+            self.byte_compile()
 
         if not self.hook:
             self.entry_points()
-        if 'EGG-INFO/spec/depend' in self.arcnames:
+        info = None
+        if 'EGG-INFO/spec/depend' in self.arcset:
             import eggmeta
-            eggmeta.create_info(self, extra_info)
+            info = eggmeta.create_info(self, extra_info)
         self.z.close()
 
         if not self.hook:
@@ -105,11 +250,15 @@ class EggInst(object):
             self.install_app()
         self.run('post_egginst.py')
         self.write_meta()
+        if self.db:
+            self.db.add(self.meta_dir, self.hook, self.fn, info,
+                        self.rel_files())
+            self.db.close()
 
         if self.hook:
             import registry
             registry.create_file(self)
-        if 'EGG-INFO/spec/app.json' in self.arcnames:
+        if 'EGG-INFO/spec/app.json' in self.arcset:
             import app_entry
             app_entry.create_entry(self)
         getLogger('progress.stop').info(None)
@@ -134,17 +283,34 @@ class EggInst(object):
     def rel_prefix(self, path):
         return abspath(path).replace(self.prefix, '.').replace('\\', '/')
 
+    def rel_files(self):
+        """
+        return the list of installed files (including the meta-data
+        files), relative to the prefix, as stored in the manifest
+        """
+        return [self.rel_prefix(p) if abspath(p).startswith(self.prefix)
+                else p
+                for p in self.files + [self.meta_json, self.meta_manifest]]
+
     def write_meta(self):
+        files = self.rel_files()
         d = dict(
             egg_name = self.fn,
             prefix = self.prefix,
             installed_size = self.installed_size,
-            files = [self.rel_prefix(p)
-                           if abspath(p).startswith(self.prefix) else p
-                     for p in self.files + [self.meta_json]]
         )
+        # egginst.json is only read by older versions (which do not know
+        # about the manifest, and require the file list to remove the
+        # package), so it is written compactly, and before the manifest
+        # (see read_meta)
         with open(self.meta_json, 'w') as f:
-            json.dump(d, f, indent=2, sort_keys=True)
+            json.dump(dict(d, files=files, manifest=MANIFEST_FN), f,
+                      separators=(',', ':'), sort_keys=True)
+        manifest.write(self.meta_manifest,
+            files = files,
+            hardlinks = [self.rel_prefix(p) for p in self.hardlinks],
+            arcinfo = self.arcinfo,
+            summary = d)
 
     def read_meta(self):
         d = read_meta(self.meta_dir)
@@ -153,9 +319,9 @@ class EggInst(object):
 
 
     def lines_from_arcname(self, arcname, ignore_empty=True):
-        if not arcname in self.arcnames:
+        if not arcname in self.arcset:
             return
-        for line in self.z.read(arcname).splitlines():
+        for line in self.z.open(arcname):
             line = line.strip()
             if ignore_empty and line == '':
                 continue
@@ -165,7 +331,6 @@ class EggInst(object):
 
 
     def extract(self):
-        n = 0
         size = sum(self.z.getinfo(name).file_size for name in self.arcnames)
         self.installed_size = size
         getLogger('progress.start').info(dict(
@@ -173,10 +338,95 @@ class EggInst(object):
                 disp_amount = human_bytes(size),
                 filename = self.fn,
                 action = 'installing'))
-        for name in self.arcnames:
-            n += self.z.getinfo(name).file_size
+
+        plan = self.plan()
+
+        # directories which did not exist before cannot contain any files
+        # which need to be removed before writing
+        new_dirs = set()
+        for dn in sorted(set(dirname(path) for arcname, path, ns_init, mode
+                             in plan)):
+            if not isdir(dn):
+                os.makedirs(dn)
+                new_dirs.add(dn)
+        members = [(arcname, path, ns_init, dirname(path) in new_dirs)
+                   for arcname, path, ns_init, mode in plan]
+
+        if self.link_cache and self.zip_path and linkcache.supported():
+            # the basename of a member is the basename of its destination
+            self.link_dir, self.link_copy = linkcache.get_dir(
+                self.link_cache, self.zip_path,
+                lambda arcname: self.is_executable(arcname, arcname))
+
+        # members which are not written count as done right away
+        n = size - sum(self.z.getinfo(arcname).file_size
+                       for arcname, path, ns_init, mode in plan)
+        for arcname, info in self.write_members(members):
+            self.arcinfo[arcname] = info
+            n += info[0]
             getLogger('progress.update').info(n)
-            self.write_arcname(name)
+
+        # the mode of linked files is already set in the link cache
+        hardlinks = set(self.hardlinks)
+        for arcname, path, ns_init, mode in plan:
+            if mode is not None and path not in hardlinks:
+                os.chmod(path, mode)
+
+    def plan(self):
+        """
+        Return the install plan, i.e. the list of tuples(arcname, path,
+        ns_init, mode) of the members which need to be written, where mode
+        is None for files which are not made executable.  The plan is
+        computed in a single pass over the central directory, and the
+        paths of all installed members (including those which are kept,
+        see _upgrade) are added to self.files.
+        """
+        plan = []
+        for arcname in self.arcnames:
+            res = self.arcname_dst(arcname)
+            if res is None:
+                continue
+            path, ns_init = res
+            self.files.append(path)
+            if path in self.keep and isfile(path):
+                zinfo = self.z.getinfo(arcname)
+                self.arcinfo[arcname] = [zinfo.file_size, zinfo.CRC]
+                continue
+            plan.append((arcname, path, ns_init,
+                         0755 if self.is_executable(arcname, path) else None))
+        return plan
+
+    def write_members(self, members):
+        """
+        write the members, and yield tuples(arcname, [size, CRC]) as they
+        are written.  Unless the egg is read from a file object (or not
+        from a zip-file at all), the members are written by a pool of
+        threads, each of which uses its own handle of the zip-file.
+        """
+        workers = self.workers or min(cpu_count(), 8)
+        if (self.zip_path is None or workers == 1 or
+                len(members) < 4 * workers):
+            for member in members:
+                yield self.write_member(self.z, *member)
+            return
+
+        local = threading.local()
+        handles = []
+        def write(member):
+            if not hasattr(local, 'z'):
+                local.z = zipfile.ZipFile(self.zip_path)
+                handles.append(local.z)
+            return self.write_member(local.z, *member)
+
+        pool = ThreadPool(workers)
+        try:
+            for res in pool.imap_unordered(write, members, 16):
+                yield res
+        finally:
+            pool.close()
+            pool.join()
+            for z in handles:
+                z.close()
 
 
     def get_dst(self, arcname):
@@ -198,36 +448,140 @@ class EggInst(object):
     py_pat = re.compile(r'^(.+)\.py(c|o)?$')
     so_pat = re.compile(r'^lib.+\.so')
     py_obj = '.pyd' if on_win else '.so'
-    def write_arcname(self, arcname):
+    def arcname_dst(self, arcname):
+        """
+        return the tuple(path, ns_init) for the member arcname, where
+        ns_init is True for the __init__.py of namespace packages (which
+        are written empty), or None if the member is not installed
+        """
         if arcname.endswith('/') or arcname.startswith('.unused'):
-            return
+            return None
         m = self.py_pat.match(arcname)
-        if m and (m.group(1) + self.py_obj) in self.arcnames:
+        if m and (m.group(1) + self.py_obj) in self.arcset:
             # .py, .pyc, .pyo next to .so are not written
-            return
+            return None
         path = self.get_dst(arcname)
-        dn, fn = os.path.split(path)
-        data = self.z.read(arcname)
+        fn = basename(path)
+        ns_init = False
         if fn in ['__init__.py', '__init__.pyc']:
             tmp = arcname.rstrip('c')
-            if tmp in self.arcnames and NS_PKG_PAT.match(self.z.read(tmp)):
-                if fn == '__init__.py':
-                    data = ''
+            if tmp in self.arcset and self.is_namespace(tmp):
                 if fn == '__init__.pyc':
-                    return
-        self.files.append(path)
-        if not isdir(dn):
-            os.makedirs(dn)
-        rm_rf(path)
+                    return None
+                ns_init = True
+        return path, ns_init
+
+    def is_namespace(self, arcname):
+        """
+        return True if the member arcname (an __init__.py) declares a
+        namespace package, only reading a bounded amount of data
+        """
+        if arcname in self._namespace:
+            return self._namespace[arcname]
+        res = False
+        if self.z.getinfo(arcname).file_size <= NS_PKG_MAX_SIZE:
+            fi = self.z.open(arcname)
+            data = fi.read(NS_PKG_MAX_SIZE + 1)
+            fi.close()
+            res = (len(data) <= NS_PKG_MAX_SIZE and
+                   bool(NS_PKG_PAT.match(data)))
+        self._namespace[arcname] = res
+        return res
+
+    def write_member(self, z, arcname, path, ns_init, fresh=False):
+        """
+        write the member arcname (of the zip-file z) to path (or an empty
+        file, for namespace packages), and return the tuple(arcname,
+        [size, CRC]).  The member is streamed through a fixed size buffer.
+        Unless fresh is True (the directory was just created), an existing
+        file (or directory) at path is removed first.
+        When a link cache is used, the file is hardlinked from the cache,
+        unless it may be modified per prefix (see may_link).
+        """
+        if self.link_dir and self.may_link(arcname, path, ns_init):
+            if not fresh:
+                rm_rf(path)
+                fresh = True
+            try:
+                os.link(join(self.link_dir, *arcname.split('/')), path)
+            except OSError: # e.g. the cache is on another file system
+                pass
+            else:
+                self.hardlinks.append(path)
+                zinfo = z.getinfo(arcname)
+                return arcname, [zinfo.file_size, zinfo.CRC]
+
+        fi = z.open(arcname)
+        if not fresh:
+            rm_rf(path)
         fo = open(path, 'wb')
-        fo.write(data)
+        size = crc = 0
+        while True:
+            chunk = fi.read(BUFFSIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+            if not ns_init:
+                fo.write(chunk)
         fo.close()
-        if (arcname.startswith(('EGG-INFO/usr/bin/', 'EGG-INFO/scripts/')) or
-                fn.endswith(('.dylib', '.pyd', '.so')) or
-                (arcname.startswith('EGG-INFO/usr/lib/') and
-                 self.so_pat.match(fn))):
-            os.chmod(path, 0755)
+        fi.close()
+        return arcname, [size, crc & 0xffffffff]
+
+    def may_link(self, arcname, path, ns_init):
+        """
+        return True if the member arcname may be hardlinked (from the link
+        cache) to path, i.e. the installed file is never modified in place:
+        files in the bin directory (whose #! line is fixed by
+        scripts.fix_scripts) and files with placeholders (which are listed
+        in self.link_copy) are copied.  Files which are made executable
+        already have their mode in the link cache.
+        """
+        return not (ns_init or arcname in self.link_copy or
+                    path.startswith(self.bin_dir + os.sep))
+
+    def is_executable(self, arcname, path):
+        fn = basename(path)
+        return (arcname.startswith(('EGG-INFO/usr/bin/', 'EGG-INFO/scripts/'))
+                or fn.endswith(('.dylib', '.pyd', '.so'))
+                or (arcname.startswith('EGG-INFO/usr/lib/') and
+                    self.so_pat.match(fn)))
+
+
+    def byte_compile(self):
+        """
+        byte-compile the installed .py files, using several processes of
+        the Python executable of the prefix (such that the byte-code
+        matches its version), and add the .pyc files to the installed files
+        """
+        files = set(self.files)
+        paths = []
+        for p in self.files:
+            if not (p.endswith('.py') and p.startswith(self.pyloc)):
+                continue
+            if p + 'c' in files:
+                continue
+            if p in self.keep and isfile(p + 'c'):
+                self.files.append(p + 'c')
+                continue
+            paths.append(p)
+        if not paths:
+            return
 
+        from subprocess import Popen, PIPE
+        workers = min(self.workers or min(cpu_count(), 8),
+                      (len(paths) - 1) // 64 + 1)
+        procs = [Popen([scripts.executable, '-E', '-c', COMPILE_CODE],
+                       stdin=PIPE) for i in xrange(workers)]
+        for i, p in enumerate(procs):
+            p.stdin.write('\n'.join(paths[i::workers]))
+            p.stdin.close()
+        for p in procs:
+            p.wait()
+
+        for p in paths:
+            if isfile(p + 'c'):
+                self.files.append(p + 'c')
 
     def install_app(self, remove=False):
         if self.noapp:
@@ -256,61 +610,110 @@ class EggInst(object):
         path = join(self.meta_dir, fn)
         if not isfile(path):
             return
-        from subprocess import call
-        call([sys.executable, '-E', path, '--prefix', self.prefix],
-             cwd=dirname(path))
-
-
-    def rm_dirs(self):
-        dir_paths = set()
-        len_prefix = len(self.prefix)
-        for path in set(dirname(p) for p in self.files):
-            while len(path) > len_prefix:
-                dir_paths.add(path)
-                path = dirname(path)
+        import hookrunner
+        return hookrunner.run(path, self.prefix)
 
-        for path in sorted(dir_paths, key=len, reverse=True):
-            rm_empty_dir(path)
 
-    def remove(self):
+    def remove_paths(self):
+        """
+        run the uninstall hooks of the installed package, and return the
+        list of its files which are to be removed (or None, when the
+        package is not installed)
+        """
         if not isdir(self.meta_dir):
             print "Error: Can't find meta data for:", self.cname
-            return
+            return None
+        if self.db:
+            self.db.connect()
 
         self.read_meta()
-        n = 0
-        getLogger('progress.start').info(dict(
-                amount = len(self.files), # number of files
-                disp_amount = human_bytes(self.installed_size),
-                filename = self.fn,
-                action = 'removing'))
         self.install_app(remove=True)
         self.run('pre_egguninst.py')
 
+        paths = []
         for p in self.files:
-            n += 1
-            getLogger('progress.update').info(n)
-
             if self.hook and not p.startswith(self.pkgs_dir):
                 continue
-
-            rm_rf(p)
+            paths.append(p)
             if p.endswith('.py'):
-                rm_rf(p + 'c')
-        self.rm_dirs()
+                paths.append(p + 'c')
+        return paths
+
+    def remove_meta(self):
         rm_rf(self.meta_dir)
         if self.hook:
             rm_empty_dir(self.pkg_dir)
         else:
             rm_empty_dir(self.egginfo_dir)
-        getLogger('progress.stop').info(None)
+        if self.db:
+            self.db.remove(self.meta_dir)
+            self.db.close()
+
+    def remove(self):
+        remove_packages([self])
 
 
-def read_meta(meta_dir):
+def remove_packages(eis):
+    """
+    remove the installed packages of the EggInst objects eis at once: the
+    uninstall hooks of all packages are run first, then the files of all
+    packages are removed (see remover.py), and finally the meta-data
+    """
+    todo = []
+    for ei in eis:
+        paths = ei.remove_paths()
+        if paths is not None:
+            todo.append((ei, paths))
+    if not todo:
+        return
+
+    all_paths = sorted(set(p for ei, paths in todo for p in paths))
+    getLogger('progress.start').info(dict(
+            amount = len(all_paths), # number of files
+            disp_amount = human_bytes(sum(ei.installed_size
+                                          for ei, paths in todo)),
+            filename = (todo[0][0].fn if len(todo) == 1 else
+                        '%d packages' % len(todo)),
+            action = 'removing'))
+    remover.remove_files(all_paths, todo[0][0].workers,
+                         getLogger('progress.update').info)
+
+    prefix_paths = {}
+    for ei, paths in todo:
+        prefix_paths.setdefault(ei.prefix, []).extend(paths)
+    for prefix, paths in prefix_paths.iteritems():
+        remover.prune_dirs(paths, prefix)
+
+    for ei, paths in todo:
+        ei.remove_meta()
+    getLogger('progress.stop').info(None)
+
+
+def read_meta(meta_dir, files=True):
+    """
+    return the meta-data (dictionary) of the package installed in
+    meta_dir, or None.  Unless files is False, the data of the manifest
+    (files, hardlinks, arcinfo) is included.  egginst.json is only read
+    for packages installed by older versions, which contain no manifest
+    (or when the package was reinstalled by an older version, i.e.
+    egginst.json is newer than the manifest).
+    """
     meta_json = join(meta_dir, 'egginst.json')
-    if isfile(meta_json):
-        return json.load(open(meta_json))
-    return None
+    meta_manifest = join(meta_dir, MANIFEST_FN)
+    try:
+        if getmtime(meta_manifest) >= getmtime(meta_json):
+            if files:
+                return manifest.read(meta_manifest)
+            return manifest.read_summary(meta_manifest)
+    except (OSError, ValueError):
+        pass
+    if not isfile(meta_json):
+        return None
+    d = json.load(open(meta_json))
+    d.pop('manifest', None)
+    if not files:
+        d.pop('files', None)
+    return d
 
 
 def get_installed(prefix=sys.prefix):
@@ -319,6 +722,14 @@ def get_installed(prefix=sys.prefix):
     Each element is the filename of the egg which was used to install the
     package.
     """
+    db = prefixdb.PrefixDB(prefix)
+    if db.connect() is not None:
+        egg_names = db.egg_names()
+        db.close()
+        for egg_name in egg_names:
+            yield egg_name
+        return
+
     egg_info_dir = join(prefix, 'EGG-INFO')
     if not isdir(egg_info_dir):
         return
@@ -326,7 +737,7 @@ def get_installed(prefix=sys.prefix):
     for fn in sorted(os.listdir(egg_info_dir)):
         if not pat.match(fn):
             continue
-        d = read_meta(join(egg_info_dir, fn))
+        d = read_meta(join(egg_info_dir, fn), files=False)
         if d:
             yield d['egg_name']
 
@@ -346,6 +757,24 @@ def main():
     p = OptionParser(usage="usage: %prog [options] [EGGS ...]",
                      description=__doc__)
 
+    p.add_option("--compile",
+                 action="store_true",
+                 help="byte-compile the installed .py files")
+
+    p.add_option('-j', "--jobs",
+                 action="store",
+                 type="int",
+                 help="number of threads used to extract (and remove) "
+                      "files, and processes used to byte-compile files",
+                 metavar='N')
+
+    p.add_option("--link-cache",
+                 action="store",
+                 help="hardlink files from (and unpack eggs into) this "
+                      "host-wide cache directory, instead of extracting "
+                      "them into the prefix",
+                 metavar='PATH')
+
     p.add_option('-l', "--list",
                  action="store_true",
                  help="list all installed packages")
@@ -392,12 +821,19 @@ def main():
         print_installed(prefix)
         return
 
+    eis = []
     for path in args:
         ei = EggInst(path, prefix, opts.hook, opts.pkgs_dir,
                      verbose=opts.verbose, noapp=opts.noapp)
-        if opts.remove:
-            ei.remove()
-        else: # default is always install
+        ei.workers = opts.jobs
+        ei.compile = opts.compile
+        ei.link_cache = opts.link_cache and abspath(opts.link_cache)
+        eis.append(ei)
+
+    if opts.remove:
+        remove_packages(eis)
+    else: # default is always install
+        for ei in eis:
             ei.install()
 
 
@@ -0,0 +1,173 @@
+"""
+Compact binary manifest of an installed package, i.e. its summary (as in
+egginst.json, e.g. the egg name), the list of its installed files (and
+which of them are hardlinks into the link cache), and the size and CRC of
+each member of the egg it was installed from.
+
+Both path lists are sorted and prefix-compressed: each path is stored as
+the length of the prefix it shares with the previous path, followed by the
+remaining suffix.  All numbers are stored as arrays of fixed size integers,
+such that the manifest is read using a few struct.unpack calls, and only
+one (cheap) string operation per path.  The layout is:
+
+    MAGIC
+    summary section:  length (uint32), summary (JSON)
+    files section:    paths, flags (uint8 each, HARDLINK bit)
+    arcinfo section:  paths, sizes (uint64 each), CRCs (uint32 each)
+
+where paths is: count (uint32), shared prefix lengths (uint16 each),
+length of the suffixes (uint32), suffixes (UTF-8, separated by NUL).
+The summary comes first, such that it can be read without the (possibly
+large) rest of the manifest.
+
+The modes of the files are not stored, as egginst does not take them from
+the egg: whether an installed file is made executable only depends on its
+archive name and path (see EggInst.is_executable), which are the same for
+the files kept when upgrading.
+"""
+import json
+import struct
+from itertools import compress, imap, izip
+
+
+MAGIC = 'EGGMANIFEST2\n'
+
+# flags of the files
+HARDLINK = 1
+
+
+def _decode(s):
+    if isinstance(s, str):
+        return s.decode('utf-8')
+    return s
+
+
+def pack_paths(paths):
+    """
+    return the packed (prefix-compressed) representation of the sorted
+    list of paths
+    """
+    shared = []
+    suffixes = []
+    prev = u''
+    for path in paths:
+        path = _decode(path)
+        # binary search for the length of the shared prefix
+        lo, hi = 0, min(len(prev), len(path), 65535)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if prev[:mid] == path[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        shared.append(lo)
+        suffixes.append(path[lo:])
+        prev = path
+    blob = u'\0'.join(suffixes).encode('utf-8')
+    return ''.join([struct.pack('<I', len(paths)),
+                    struct.pack('<%dH' % len(paths), *shared),
+                    struct.pack('<I', len(blob)),
+                    blob])
+
+
+def unpack_paths(data, pos):
+    """
+    return the tuple(list of paths, new position) from the data packed by
+    pack_paths at position pos
+    """
+    n, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    shared = struct.unpack_from('<%dH' % n, data, pos)
+    pos += 2 * n
+    size, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    suffixes = data[pos:pos + size].decode('utf-8').split(u'\0')
+    pos += size
+    paths = []
+    prev = u''
+    for k, suffix in izip(shared, suffixes):
+        prev = prev[:k] + suffix
+        paths.append(prev)
+    return paths, pos
+
+
+def dumps(files, hardlinks, arcinfo, summary={}):
+    """
+    return the manifest for the list of files, the list of files which
+    are hardlinks, the dictionary arcinfo (mapping arcnames to
+    [size, CRC]) and the summary dictionary
+    """
+    files = sorted(set(files))
+    hardlinks = set(hardlinks)
+    arcnames = sorted(arcinfo)
+    summary = json.dumps(summary, separators=(',', ':'), sort_keys=True)
+    return ''.join([
+            MAGIC,
+            struct.pack('<I', len(summary)),
+            summary,
+            pack_paths(files),
+            struct.pack('<%dB' % len(files),
+                        *[HARDLINK if f in hardlinks else 0 for f in files]),
+            pack_paths(arcnames),
+            struct.pack('<%dQ' % len(arcnames),
+                        *[arcinfo[name][0] for name in arcnames]),
+            struct.pack('<%dI' % len(arcnames),
+                        *[arcinfo[name][1] & 0xffffffff
+                          for name in arcnames])])
+
+
+def _check(data):
+    if not data.startswith(MAGIC):
+        raise ValueError("not an egginst manifest")
+
+
+def loads(data):
+    """
+    return the dictionary with the keys of the summary, 'files',
+    'hardlinks' and 'arcinfo' (like in egginst.json) from the manifest data
+    """
+    _check(data)
+    pos = len(MAGIC)
+    size, = struct.unpack_from('<I', data, pos)
+    pos += 4
+    d = json.loads(data[pos:pos + size])
+    pos += size
+    files, pos = unpack_paths(data, pos)
+    flags = struct.unpack_from('<%dB' % len(files), data, pos)
+    pos += len(files)
+    arcnames, pos = unpack_paths(data, pos)
+    n = len(arcnames)
+    sizes = struct.unpack_from('<%dQ' % n, data, pos)
+    pos += 8 * n
+    crcs = struct.unpack_from('<%dI' % n, data, pos)
+    d.update(
+        files = files,
+        hardlinks = list(compress(files, (flag & HARDLINK
+                                          for flag in flags))),
+        arcinfo = dict(izip(arcnames, imap(list, izip(sizes, crcs)))),
+    )
+    return d
+
+
+def write(path, files, hardlinks, arcinfo, summary={}):
+    with open(path, 'wb') as fo:
+        fo.write(dumps(files, hardlinks, arcinfo, summary))
+
+
+def read_summary(path):
+    """
+    return the summary dictionary of the manifest path, without reading
+    the rest of the manifest
+    """
+    with open(path, 'rb') as fi:
+        data = fi.read(len(MAGIC) + 4)
+        _check(data)
+        if len(data) < len(MAGIC) + 4:
+            raise ValueError("truncated egginst manifest")
+        size, = struct.unpack_from('<I', data, len(MAGIC))
+        return json.loads(fi.read(size))
+
+
+def read(path):
+    with open(path, 'rb') as fi:
+        return loads(fi.read())
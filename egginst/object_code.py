@@ -2,6 +2,7 @@
 
 import sys
 import re
+import mmap
 from os.path import abspath, join, islink, isfile, exists
 
 
@@ -53,47 +54,65 @@ def find_lib(fn):
 
 
 placehold_pat = re.compile(5 * '/PLACEHOLD' + '([^\0\\s]*)\0')
-def fix_object_code(path):
+def fix_object_code(path, offsets=None):
+    """
+    Replace the placeholders in the object file path.  The file is mapped
+    into memory (instead of being read), and only the placeholders are
+    written.  When the offsets of the placeholders are known (from the
+    EGG-INFO/inst/placeholders.txt manifest), the file is not scanned.
+    """
     tp = get_object_type(path)
     if tp is None:
         return
 
     f = open(path, 'r+b')
-    data = f.read()
-    matches = list(placehold_pat.finditer(data))
-    if not matches:
+    mm = mmap.mmap(f.fileno(), 0)
+    try:
+        if offsets is None:
+            matches = list(placehold_pat.finditer(mm))
+        else:
+            matches = [m for m in (placehold_pat.match(mm, offset)
+                                   for offset in offsets) if m]
+        if matches:
+            if verbose:
+                print "Fixing placeholders in:", path
+            for m in matches:
+                mm[m.start():m.end()] = replacement(m, tp)
+            mm.flush()
+    finally:
+        mm.close()
         f.close()
-        return
 
-    if verbose:
-        print "Fixing placeholders in:", path
-    for m in matches:
-        rest = m.group(1)
-        while rest.startswith('/PLACEHOLD'):
-            rest = rest[10:]
-
-        if tp.startswith('MachO-') and rest.startswith('/'):
-            # deprecated: because we now use rpath on OSX as well
-            r = find_lib(rest[1:])
-        else:
-            assert rest == '' or rest.startswith(':')
-            rpaths = list(_targets)
-            # extend the list with rpath which were already in the binary,
-            # if any
-            rpaths.extend(p for p in rest.split(':') if p)
-            r = ':'.join(rpaths)
-
-        if alt_replace_func is not None:
-            r = alt_replace_func(r)
-
-        padding = len(m.group(0)) - len(r)
-        if padding < 1: # we need at least one null-character
-            raise Exception("placeholder %r too short" % m.group(0))
-        r += padding * '\0'
-        assert m.start() + len(r) == m.end()
-        f.seek(m.start())
-        f.write(r)
-    f.close()
+
+def replacement(m, tp):
+    """
+    return the replacement (of the same length) for the placeholder match
+    m, in an object file of type tp
+    """
+    rest = m.group(1)
+    while rest.startswith('/PLACEHOLD'):
+        rest = rest[10:]
+
+    if tp.startswith('MachO-') and rest.startswith('/'):
+        # deprecated: because we now use rpath on OSX as well
+        r = find_lib(rest[1:])
+    else:
+        assert rest == '' or rest.startswith(':')
+        rpaths = list(_targets)
+        # extend the list with rpath which were already in the binary,
+        # if any
+        rpaths.extend(p for p in rest.split(':') if p)
+        r = ':'.join(rpaths)
+
+    if alt_replace_func is not None:
+        r = alt_replace_func(r)
+
+    padding = len(m.group(0)) - len(r)
+    if padding < 1: # we need at least one null-character
+        raise Exception("placeholder %r too short" % m.group(0))
+    r += padding * '\0'
+    assert m.start() + len(r) == m.end()
+    return r
 
 
 def fix_files(egg):
@@ -117,5 +136,55 @@ def fix_files(egg):
         for tgt in _targets:
             print '    %r' % tgt
 
-    for p in egg.files:
-        fix_object_code(p)
+    offsets = read_placeholders(egg)
+    if offsets is None:
+        jobs = [(p, None) for p in egg.files]
+    else:
+        files = set(egg.files)
+        jobs = [(p, offs) for p, offs in offsets.iteritems() if p in files]
+    # kept files were already fixed, and linked files (from the link
+    # cache) contain no placeholders
+    skip = egg.keep.union(egg.hardlinks)
+    # the files are fixed serially, as scanning (using re) holds the GIL,
+    # such that threads would not help
+    for p, offs in jobs:
+        if p not in skip:
+            fix_object_code(p, offs)
+
+
+def read_placeholders(egg):
+    """
+    Return the dictionary mapping the paths of the installed object files,
+    which contain placeholders, to the list of offsets of the placeholders,
+    as listed in the (optional) EGG-INFO/inst/placeholders.txt manifest of
+    the egg, or None if the egg has no such manifest.
+    """
+    if 'EGG-INFO/inst/placeholders.txt' not in egg.arcset:
+        return None
+    res = {}
+    for line in egg.lines_from_arcname('EGG-INFO/inst/placeholders.txt'):
+        fields = line.split()
+        res[egg.get_dst(fields[0])] = [int(x) for x in fields[1:]]
+    return res
+
+
+def placeholders_manifest(z):
+    """
+    Return the content of the EGG-INFO/inst/placeholders.txt manifest for
+    the (egg) zip-file z, which lists each member which contains
+    placeholders, followed by the offsets of the placeholders.  This is
+    meant to be used when the egg is built.
+    """
+    lines = []
+    for zinfo in z.infolist():
+        if zinfo.filename.endswith(NO_OBJ):
+            continue
+        fi = z.open(zinfo)
+        head = fi.read(4)
+        if MAGIC.get(head) is None:
+            continue
+        data = head + fi.read()
+        offsets = [m.start() for m in placehold_pat.finditer(data)]
+        if offsets:
+            lines.append(' '.join([zinfo.filename] + map(str, offsets)))
+    return ''.join(line + '\n' for line in lines)
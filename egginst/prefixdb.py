@@ -0,0 +1,270 @@
+"""
+Database (SQLite) of the packages installed into a prefix.
+
+The meta-data files of the installed packages (info.json, egginst.json
+and the manifest) remain the source of truth.  The database only caches
+them, such that listing or querying the installed packages does not
+require reading one file per package.  It is updated (in a transaction) by
+EggInst whenever a package is installed or removed.  A signature of the
+meta-data files (the list of meta-data directories, and the modification
+time and size of the meta-data files in each of them) is recorded along
+with each update, and the database is rebuilt from the meta-data files
+whenever it differs, e.g. after packages were installed (or rewritten in
+place) by an older version.  As modification times may be coarse (or the
+clock skewed), a change may not alter the signature when it happens
+shortly after the signature was recorded.  Therefore, the database is
+also rebuilt when the newest meta-data file is not older than the
+recorded signature by a safety margin, unless the signature was recorded
+by this process (such that installing many packages in one process does
+not rebuild the database each time).  When the
+database cannot be used at all (e.g. the prefix is not writable), the
+functions using it fall back to reading the meta-data files.
+"""
+import os
+import json
+import time
+import hashlib
+from os.path import abspath, isdir, isfile, join, relpath
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+DB_FN = 'enpkg.db'
+
+SCHEMA_VERSION = 1
+
+# meta-data files (of each package) whose changes invalidate the database
+META_FILES = ('egginst.json', 'egginst.manifest', 'info.json')
+
+# safety margin (in seconds) for modification times, see above
+RECENT = 2.0
+
+# signatures which were recorded by this process, as tuples(prefix,
+# signature)
+_recorded = set()
+
+SCHEMA = """
+DROP TABLE IF EXISTS packages;
+DROP TABLE IF EXISTS files;
+DROP TABLE IF EXISTS state;
+CREATE TABLE packages (
+    dir TEXT PRIMARY KEY,  -- meta-data directory, relative to the prefix
+    hook INTEGER NOT NULL,
+    name TEXT,
+    key TEXT,
+    egg_name TEXT,
+    info TEXT              -- content of info.json
+);
+CREATE INDEX packages_name ON packages (name);
+CREATE INDEX packages_key ON packages (key);
+CREATE TABLE files (
+    path TEXT NOT NULL,    -- as in egginst.json, e.g. ./bin/foo
+    dir TEXT NOT NULL
+);
+CREATE INDEX files_path ON files (path);
+CREATE INDEX files_dir ON files (dir);
+CREATE TABLE state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+PRAGMA user_version = %d;
+""" % SCHEMA_VERSION
+
+
+def read_info(meta_dir):
+    path = join(meta_dir, 'info.json')
+    if isfile(path):
+        return json.load(open(path))
+    return None
+
+
+class PrefixDB(object):
+
+    def __init__(self, prefix):
+        self.prefix = abspath(prefix)
+        self.path = join(self.prefix, DB_FN)
+        self.egginfo_dir = join(self.prefix, 'EGG-INFO')
+        self.pkgs_dir = join(self.prefix, 'pkgs')
+        self._conn = None
+
+    def rel_dir(self, meta_dir):
+        return relpath(meta_dir, self.prefix).replace('\\', '/')
+
+    def abs_dir(self, dir):
+        return join(self.prefix, *dir.split('/'))
+
+    def signature(self):
+        """
+        return the tuple(signature of the meta-data files, modification
+        time of the newest meta-data file)
+        """
+        h = hashlib.md5()
+        newest = 0
+        for meta_dir, hook in self.meta_dirs():
+            h.update('%s\n' % self.rel_dir(meta_dir))
+            for fn in META_FILES:
+                try:
+                    st = os.stat(join(meta_dir, fn))
+                except OSError:
+                    continue
+                h.update('%s %r %d\n' % (fn, st.st_mtime, st.st_size))
+                newest = max(newest, st.st_mtime)
+        return h.hexdigest(), newest
+
+    def is_current(self, conn):
+        """
+        return True when the database (connection conn) is up to date
+        """
+        row = conn.execute("SELECT value FROM state "
+                           "WHERE key = 'signature'").fetchone()
+        if row is None:
+            return False
+        stored, recorded = row[0].split()
+        sig, newest = self.signature()
+        if stored != sig:
+            return False
+        return ((self.prefix, sig) in _recorded or
+                newest < float(recorded) - RECENT)
+
+    def connect(self):
+        """
+        return the connection to the database, which is rebuilt when it is
+        out of date, or None when the database cannot be used
+        """
+        if self._conn is not None:
+            return self._conn
+        if sqlite3 is None or not isdir(self.prefix):
+            return None
+        conn = None
+        try:
+            conn = sqlite3.connect(self.path, timeout=30)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                conn.executescript(SCHEMA)
+            if not self.is_current(conn):
+                with conn:
+                    self.rebuild(conn)
+        except (sqlite3.Error, OSError, IOError, ValueError):
+            if conn is not None:
+                conn.close()
+            return None
+        self._conn = conn
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def meta_dirs(self):
+        """
+        yield tuples(meta-data directory, hook) of the installed packages
+        """
+        for dir_path, hook in [(self.egginfo_dir, False),
+                               (self.pkgs_dir, True)]:
+            if not isdir(dir_path):
+                continue
+            for fn in sorted(os.listdir(dir_path)):
+                if hook:
+                    meta_dir = join(dir_path, fn, 'EGG-INFO')
+                else:
+                    meta_dir = join(dir_path, fn)
+                if isdir(meta_dir):
+                    yield meta_dir, hook
+
+    def rebuild(self, conn):
+        from main import read_meta
+
+        conn.execute("DELETE FROM packages")
+        conn.execute("DELETE FROM files")
+        for meta_dir, hook in self.meta_dirs():
+            d = read_meta(meta_dir)
+            info = read_info(meta_dir)
+            if d is None and info is None:
+                continue
+            self._add(conn, meta_dir, hook, d and d['egg_name'], info,
+                      d['files'] if d else [])
+        self._set_signature(conn)
+
+    def _add(self, conn, meta_dir, hook, egg_name, info, files):
+        dir = self.rel_dir(meta_dir)
+        conn.execute("DELETE FROM packages WHERE dir = ?", (dir,))
+        conn.execute("DELETE FROM files WHERE dir = ?", (dir,))
+        conn.execute("INSERT INTO packages VALUES (?, ?, ?, ?, ?, ?)",
+                     (dir, int(hook),
+                      info and info.get('name'), info and info.get('key'),
+                      egg_name, info and json.dumps(info)))
+        conn.executemany("INSERT INTO files VALUES (?, ?)",
+                         ((f, dir) for f in files))
+
+    def _set_signature(self, conn):
+        sig, newest = self.signature()
+        conn.execute("INSERT OR REPLACE INTO state VALUES ('signature', ?)",
+                     ('%s %r' % (sig, time.time()),))
+        _recorded.add((self.prefix, sig))
+
+    def add(self, meta_dir, hook, egg_name, info, files):
+        """
+        add (or replace) the package installed in meta_dir, whose list of
+        files is relative to the prefix (as in egginst.json)
+        """
+        conn = self.connect()
+        if conn is None:
+            return
+        with conn:
+            self._add(conn, meta_dir, hook, egg_name, info, files)
+            self._set_signature(conn)
+
+    def remove(self, meta_dir):
+        conn = self.connect()
+        if conn is None:
+            return
+        dir = self.rel_dir(meta_dir)
+        with conn:
+            conn.execute("DELETE FROM packages WHERE dir = ?", (dir,))
+            conn.execute("DELETE FROM files WHERE dir = ?", (dir,))
+            self._set_signature(conn)
+
+    def query(self, hook, name=None, key=None):
+        """
+        return the list of info dictionaries (as in info.json) of the
+        installed packages (with the given name or key)
+        """
+        sql = "SELECT dir, info FROM packages " \
+              "WHERE hook = ? AND info IS NOT NULL"
+        args = [int(hook)]
+        if name is not None:
+            sql += " AND name = ?"
+            args.append(name)
+        if key is not None:
+            sql += " AND key = ?"
+            args.append(key)
+        sql += " ORDER BY lower(dir)"
+        res = []
+        for dir, info in self.connect().execute(sql, args):
+            info = json.loads(info)
+            info['installed'] = True
+            info['meta_dir'] = self.abs_dir(dir)
+            res.append(info)
+        return res
+
+    def egg_names(self):
+        """
+        return the sorted list of the filenames of the eggs used to
+        install the packages (not using the hook feature)
+        """
+        return [row[0] for row in self.connect().execute(
+                "SELECT egg_name FROM packages "
+                "WHERE hook = 0 AND egg_name IS NOT NULL ORDER BY dir")]
+
+    def owners(self, path):
+        """
+        return the list of filenames of the eggs, which installed path
+        """
+        path = './' + relpath(abspath(path), self.prefix).replace('\\', '/')
+        return [row[0] for row in self.connect().execute(
+                "SELECT packages.egg_name FROM files JOIN packages "
+                "ON files.dir = packages.dir WHERE files.path = ?", (path,))]
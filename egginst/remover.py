@@ -0,0 +1,129 @@
+"""
+Removal of the installed files of many packages at once.
+
+Instead of calling rm_rf for each file (which makes up to three stat calls
+before unlinking), each file is unlinked right away, and only lstat'ed when
+unlinking fails.  The files are unlinked by a pool of threads, and the
+directories which became empty are pruned afterwards, using a trie of the
+directories of all removed files, such that each directory is visited only
+once, and the parents of directories which are not empty are not tried.
+"""
+import os
+import stat
+import errno
+import shutil
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from os.path import dirname, join, normpath
+
+from utils import on_win
+
+
+# number of files unlinked by a thread at once
+CHUNK_SIZE = 256
+
+
+def unlink(path):
+    """
+    remove the file (or directory) path, which does not have to exist.
+    On Windows, files which cannot be removed (e.g. DLLs which are in use)
+    are not an error, and the error is returned instead.
+    """
+    try:
+        os.unlink(path)
+        return
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return
+        err = e
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return
+    if stat.S_ISDIR(st.st_mode):
+        shutil.rmtree(path)
+    elif on_win:
+        return err
+    else:
+        raise err
+
+
+def _unlink_chunk(paths):
+    failed = []
+    for path in paths:
+        err = unlink(path)
+        if err:
+            failed.append((path, err))
+    return len(paths), failed
+
+
+def remove_files(paths, workers=None, callback=None):
+    """
+    remove the files (or directories) paths, which do not have to exist,
+    using a pool of threads.  callback(n), if given, is called with the
+    number of paths removed so far.  Return the list of tuples(path,
+    error) of the files which could not be removed (on Windows), for which
+    a warning is printed.
+    """
+    chunks = [paths[i:i + CHUNK_SIZE]
+              for i in xrange(0, len(paths), CHUNK_SIZE)]
+    workers = min(workers or min(cpu_count(), 8), len(chunks))
+    if workers <= 1:
+        results = (_unlink_chunk(chunk) for chunk in chunks)
+    else:
+        pool = ThreadPool(workers)
+        results = pool.imap_unordered(_unlink_chunk, chunks)
+    n = 0
+    failed = []
+    try:
+        for k, chunk_failed in results:
+            n += k
+            failed.extend(chunk_failed)
+            if callback:
+                callback(n)
+    finally:
+        if workers > 1:
+            pool.close()
+            pool.join()
+    for path, err in sorted(failed):
+        print "Warning: could not remove %r: %s" % (path, err)
+    return failed
+
+
+def dir_trie(paths, root):
+    """
+    return the trie (nested dictionaries) of the directories (below root)
+    which contain the paths
+    """
+    trie = {}
+    root = normpath(root)
+    for path in set(dirname(normpath(p)) for p in paths):
+        if not path.startswith(root + os.sep):
+            continue
+        node = trie
+        for part in path[len(root) + 1:].split(os.sep):
+            node = node.setdefault(part, {})
+    return trie
+
+
+def _prune(trie, path):
+    # returns True, when all directories in trie were removed
+    res = True
+    for name, sub in trie.iteritems():
+        p = join(path, name)
+        if _prune(sub, p):
+            try:
+                os.rmdir(p)
+                continue
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    continue
+        res = False
+    return res
+
+
+def prune_dirs(paths, root):
+    """
+    remove the empty directories (below root) which contained the paths
+    """
+    _prune(dir_trie(paths, root), normpath(root))
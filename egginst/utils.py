@@ -51,7 +51,21 @@ def rm_rf(path, verbose=False):
         shutil.rmtree(path)
 
 
+# maps prefixes to their (resolved) Python executable
+_executables = {}
+
+
 def get_executable(prefix):
+    """
+    Return the Python executable of prefix, which is only resolved (by
+    running it) once per prefix.
+    """
+    if prefix not in _executables:
+        _executables[prefix] = _get_executable(prefix)
+    return _executables[prefix]
+
+
+def _get_executable(prefix):
     if on_win:
         path = join(prefix, 'python.exe')
         if isfile(path):
@@ -0,0 +1,328 @@
+"""
+A caching HTTP server for (remote) indexed egg repositories.
+
+The server sits in front of a single remote repository URL (as it would
+be listed in IndexedRepos), and serves index.json, eggs and patches/ from
+a disk cache.  Clients simply list the URL of this server in their
+IndexedRepos, so that each egg is only downloaded once from the remote
+repository, no matter how many clients request it.
+
+  * index.json is refetched from the remote repository once it is older
+    than the time-to-live
+  * concurrent requests for the same file result in a single download
+    (single-flight), all other requests wait for it to finish
+  * the least recently used files are evicted from the cache when its
+    size exceeds the maximal size
+"""
+import os
+import re
+import sys
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+from os.path import basename, getmtime, getsize, isdir, isfile, join
+
+from store.indexed import RemoteHTTPIndexedStore
+from fetch import stream_to_file
+
+
+key_pat = re.compile(r'/(patches/)?([\w.+-]+\.(egg|zdiff))$')
+range_pat = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class SingleFlight(object):
+    """
+    Makes sure that, for a given key, only one function call is in flight
+    at any time.  Callers which request the same key while a call is in
+    flight wait for it to finish (instead of making the call themselves).
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def do(self, key, func):
+        with self._lock:
+            event = self._pending.get(key)
+            leader = event is None
+            if leader:
+                event = self._pending[key] = threading.Event()
+        if not leader:
+            event.wait()
+            return
+        try:
+            func()
+        finally:
+            with self._lock:
+                del self._pending[key]
+            event.set()
+
+
+class RepoCache(object):
+
+    def __init__(self, url, cache_dir, max_size=None, ttl=300,
+                 userpass=None, verbose=False):
+        self.remote = RemoteHTTPIndexedStore(url)
+        self.userpass = userpass
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttl = ttl
+        self.verbose = verbose
+
+        self.flight = SingleFlight()
+        self._evict_lock = threading.Lock()
+        if not isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.remote.connect(self.userpass)
+
+    def path(self, key):
+        return join(self.cache_dir, key)
+
+    def _download(self, fi, path, info=None):
+        # download into a unique temporary directory (which is skipped when
+        # evicting), such that no other (server) process using the same
+        # cache directory writes to the same file
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, suffix='.part')
+        try:
+            tmp_path = join(tmp_dir, basename(path))
+            if info is None:
+                with open(tmp_path, 'wb') as fo:
+                    shutil.copyfileobj(fi, fo)
+                fi.close()
+            else:
+                stream_to_file(fi, tmp_path, info)
+            # rename does not replace existing files on Windows
+            if sys.platform == 'win32' and isfile(path):
+                os.unlink(path)
+            os.rename(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def _fetch_index(self):
+        path = self.path('index.json')
+        if isfile(path) and getmtime(path) + self.ttl > time.time():
+            return
+        if self.verbose:
+            print "Fetching: index.json"
+        self._download(self.remote.get_data('index.json'), path)
+        # refresh the index of the remote store (which is used to verify
+        # the MD5 of downloaded files) from the same data
+        with open(path, 'rb') as fp:
+            self.remote.load_index(fp)
+
+    def _fetch(self, key):
+        path = self.path(key)
+        if isfile(path):
+            return
+        if self.verbose:
+            print "Fetching:", key
+        stream, info = self.remote.get(key)
+        self._download(stream, path, info)
+        self.evict()
+
+    def get(self, key):
+        """
+        return an open file object of the cached file for key (fetching it
+        into the cache, if necessary), or None if the key is not in the
+        remote index.  As the file is opened while holding the eviction
+        lock, it remains readable even when it is evicted afterwards.
+        """
+        if key != 'index.json' and not self.remote.exists(key):
+            return None
+        path = self.path(key)
+        # the file may be evicted (by another request) after it has been
+        # fetched and before it is opened, in which case it is refetched
+        for i in xrange(3):
+            if key == 'index.json':
+                self.flight.do(key, self._fetch_index)
+            else:
+                self.flight.do(key, lambda: self._fetch(key))
+            with self._evict_lock:
+                try:
+                    fi = open(path, 'rb')
+                except IOError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                # used to determine the least recently used files
+                os.utime(path, None)
+                return fi
+        return None
+
+    def evict(self):
+        """
+        remove the least recently used files from the cache, until its
+        size is below the maximal size
+        """
+        if not self.max_size:
+            return
+        with self._evict_lock:
+            files = []
+            for fn in os.listdir(self.cache_dir):
+                if fn == 'index.json' or fn.endswith('.part'):
+                    continue
+                path = self.path(fn)
+                try:
+                    files.append((getmtime(path), getsize(path), path))
+                except OSError: # removed by another process
+                    continue
+            total = sum(size for mtime, size, path in files)
+            for mtime, size, path in sorted(files):
+                if total <= self.max_size:
+                    break
+                if self.verbose:
+                    print "Evicting:", path
+                try:
+                    os.unlink(path)
+                except OSError:
+                    # removed by another process, or still open (Windows)
+                    continue
+                total -= size
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    server_version = 'enstaller-cache'
+
+    def send_file(self, body):
+        path = self.path.split('?')[0]
+        if path == '/index.json':
+            key = 'index.json'
+        else:
+            m = key_pat.match(path)
+            if m is None:
+                self.send_error(404)
+                return
+            key = m.group(2)
+            if bool(m.group(1)) != key.endswith('.zdiff'):
+                self.send_error(404)
+                return
+        try:
+            fi = self.server.cache.get(key)
+        except Exception as e:
+            self.send_error(502, str(e))
+            return
+        if fi is None:
+            self.send_error(404)
+            return
+        try:
+            self._send_data(fi, body)
+        finally:
+            fi.close()
+
+    def _send_data(self, fi, body):
+        size = os.fstat(fi.fileno()).st_size
+        m = range_pat.match(self.headers.get('Range', ''))
+        if m and int(m.group(1)) < size:
+            # single byte range requests (used by enpkg --no-cache)
+            start = int(m.group(1))
+            stop = min(int(m.group(2) or size - 1) + 1, size)
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, stop - 1, size))
+        else:
+            start, stop = 0, size
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if body:
+            fi.seek(start)
+            n = stop - start
+            while n > 0:
+                chunk = fi.read(min(n, 65536))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                n -= len(chunk)
+
+    def do_GET(self):
+        self.send_file(True)
+
+    def do_HEAD(self):
+        self.send_file(False)
+
+    def log_message(self, format, *args):
+        if self.server.cache.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class CacheServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, address, cache):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.cache = cache
+
+
+def main():
+    from optparse import OptionParser
+
+    p = OptionParser(
+        usage="usage: %prog [options] URL",
+        description="serve (and cache) the indexed egg repository URL, "
+                    "such that clients can use http://HOST:PORT/ in their "
+                    "IndexedRepos instead of URL")
+
+    p.add_option("--auth",
+                 action="store",
+                 help="username:password (for the remote repository)")
+    p.add_option("--cache-dir",
+                 action="store",
+                 default=join(os.getcwd(), 'cache'),
+                 help="cache directory, defaults to %default",
+                 metavar='PATH')
+    p.add_option("--host",
+                 action="store",
+                 default='',
+                 help="host (interface) to bind to, defaults to all")
+    p.add_option("--max-size",
+                 action="store",
+                 type="int",
+                 help="maximal size of the cache (in MB)",
+                 metavar='MB')
+    p.add_option("--port",
+                 action="store",
+                 type="int",
+                 default=8080,
+                 help="port to listen on, defaults to %default")
+    p.add_option("--ttl",
+                 action="store",
+                 type="int",
+                 default=300,
+                 help="time (in seconds) after which index.json is "
+                      "refetched, defaults to %default")
+    p.add_option('-v', "--verbose", action="store_true")
+
+    opts, args = p.parse_args()
+
+    if len(args) != 1:
+        p.error('exactly one argument (the repo URL) expected, try -h')
+
+    url = args[0]
+    if not url.startswith(('http://', 'https://')):
+        p.error('HTTP repository URL expected, got: %r' % url)
+
+    cache = RepoCache(url, opts.cache_dir,
+                      max_size=opts.max_size and 1048576 * opts.max_size,
+                      ttl=opts.ttl,
+                      userpass=(tuple(opts.auth.split(':', 1))
+                                if opts.auth else None),
+                      verbose=opts.verbose)
+    server = CacheServer((opts.host, opts.port), cache)
+    print "Serving %s on port %d" % (url, opts.port)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
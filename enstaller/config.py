@@ -42,6 +42,8 @@ default = dict(
     prefix=sys.prefix,
     proxy=None,
     noapp=False,
+    max_rate=None,
+    host_max_rate=None,
     local=join(sys.prefix, 'LOCAL-REPO'),
     EPD_auth=None,
     EPD_userpass=None,
@@ -121,6 +123,13 @@ IndexedRepos = [
 # Note that the enpkg --proxy option will overwrite this setting.
 %(proxy_line)s
 
+# The download rate (in KB/sec) of enpkg can be limited here.  While
+# 'max_rate' applies to each enpkg process, 'host_max_rate' is shared by all
+# enpkg processes running on this host at the same time.  The enpkg
+# --max-rate and --host-max-rate options overwrite these settings.
+#max_rate = 1024
+#host_max_rate = 4096
+
 # Uncommenting the next line will disable application menu item install.
 # This only effects the few packages which install menu items,
 # which as IPython.
@@ -301,7 +310,8 @@ def print_config():
     print "config file:", get_path()
     print
     print "settings:"
-    for k in 'info_url', 'prefix', 'local', 'noapp', 'proxy':
+    for k in ('info_url', 'prefix', 'local', 'noapp', 'proxy',
+              'max_rate', 'host_max_rate'):
         print "    %s = %r" % (k, get(k))
     print "    IndexedRepos:"
     for repo in get('IndexedRepos'):
@@ -7,6 +7,7 @@ from os.path import getmtime, isfile, join
 from egginst.eggmeta import info_from_z
 
 from utils import info_file
+from md5cache import MD5Cache
 
 
 egg_pat = re.compile(r'([\w.]+)-([\w.]+)-(\d+)\.egg$')
@@ -24,7 +25,12 @@ def info_from_egg(path):
         return info_from_z(z)
 
 
-def update_index(dir_path, force=False, verbose=False):
+def update_index(dir_path, force=False, verbose=False, verify=False):
+    """
+    (Re-)create the index.json file of eggs in dir_path.  Eggs which did
+    not change are not rehashed, unless verify is True.
+    """
+    md5cache = MD5Cache(dir_path, verify)
     index_path = join(dir_path, 'index.json')
     if force or not isfile(index_path):
         index = {}
@@ -40,7 +46,7 @@ def update_index(dir_path, force=False, verbose=False):
         if info and getmtime(path) == info['mtime']:
             new_index[fn] = info
             continue
-        info = info_file(path)
+        info = info_file(path, md5cache)
         info.update(info_from_egg(path))
         new_index[fn] = info
 
@@ -53,6 +59,7 @@ def update_index(dir_path, force=False, verbose=False):
 
     with open(index_path, 'w') as f:
         json.dump(new_index, f, indent=2, sort_keys=True)
+    md5cache.save()
 
 
 if __name__ == '__main__':
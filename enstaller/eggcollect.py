@@ -5,6 +5,7 @@ from os.path import isdir, isfile, join
 from abc import ABCMeta, abstractmethod
 
 import egginst
+from egginst.prefixdb import PrefixDB
 
 from egg_meta import split_eggname
 
@@ -47,10 +48,19 @@ class EggCollection(AbstractEggCollection):
         self.hook = hook
 
         self.verbose = False
+        # host-wide cache of unpacked eggs, see egginst.linkcache
+        self.link_cache = None
+        # when True, the installed .py files are byte-compiled
+        self.compile = False
 
         self.pkgs_dir = join(self.prefix, 'pkgs')
+        # database of the installed packages, see egginst.prefixdb.  The
+        # connection is kept open (such that the database is only validated
+        # once), until this collection modifies the prefix.
+        self.db = PrefixDB(self.prefix)
 
     def find(self, egg):
+        # the meta-data directory is known, so the database is not needed
         n, v, b = split_eggname(egg)
         if self.hook:
             return info_from_metadir(join(self.pkgs_dir,
@@ -64,6 +74,14 @@ class EggCollection(AbstractEggCollection):
 
     def query(self, **kwargs):
         name = kwargs.get('name')
+        if self.db.connect() is not None:
+            infos = self.db.query(self.hook, name=name,
+                                  key=kwargs.get('key'))
+            for info in infos:
+                if all(info.get(k) == v for k, v in kwargs.iteritems()):
+                    yield info['key'], info
+            return
+
         if self.hook:
             if not isdir(self.pkgs_dir):
                 return
@@ -86,17 +104,37 @@ class EggCollection(AbstractEggCollection):
                                 for k, v in kwargs.iteritems()):
                     yield info['key'], info
 
-    def install(self, egg, dir_path, extra_info=None):
-        ei = egginst.EggInst(join(dir_path, egg),
+    def _egginst(self, path):
+        ei = egginst.EggInst(path,
                              prefix=self.prefix, hook=self.hook,
                              pkgs_dir=self.pkgs_dir, verbose=self.verbose)
-        ei.install(extra_info)
+        ei.link_cache = self.link_cache
+        ei.compile = self.compile
+        return ei
+
+    def install(self, egg, dir_path, extra_info=None, fileobj=None):
+        # the database is revalidated by the next query
+        self.db.close()
+        ei = self._egginst(join(dir_path, egg))
+        ei.install(extra_info, fileobj)
+
+    def upgrade(self, egg, dir_path, extra_info=None, fileobj=None):
+        self.db.close()
+        ei = self._egginst(join(dir_path, egg))
+        ei.upgrade(extra_info, fileobj)
+
+    def install_patch(self, egg, dir_path, src_egg, patch_path,
+                      extra_info=None):
+        self.db.close()
+        ei = self._egginst(join(dir_path, egg))
+        ei.install_patch(join(dir_path, src_egg), patch_path, extra_info)
 
     def remove(self, egg):
-        ei = egginst.EggInst(egg,
-                             prefix=self.prefix, hook=self.hook,
-                             pkgs_dir=self.pkgs_dir, verbose=self.verbose)
-        ei.remove()
+        self.remove_eggs([egg])
+
+    def remove_eggs(self, eggs):
+        self.db.close()
+        egginst.remove_packages([self._egginst(egg) for egg in eggs])
 
 
 class JoinedEggCollection(AbstractEggCollection):
@@ -117,8 +155,19 @@ class JoinedEggCollection(AbstractEggCollection):
             index.update(collection.query(**kwargs))
         return index.iteritems()
 
-    def install(self, egg, dir_path, extra_info=None):
-        self.collections[0].install(egg, dir_path, extra_info)
+    def install(self, egg, dir_path, extra_info=None, fileobj=None):
+        self.collections[0].install(egg, dir_path, extra_info, fileobj)
+
+    def upgrade(self, egg, dir_path, extra_info=None, fileobj=None):
+        self.collections[0].upgrade(egg, dir_path, extra_info, fileobj)
+
+    def install_patch(self, egg, dir_path, src_egg, patch_path,
+                      extra_info=None):
+        self.collections[0].install_patch(egg, dir_path, src_egg,
+                                          patch_path, extra_info)
 
     def remove(self, egg):
         self.collections[0].remove(egg)
+
+    def remove_eggs(self, eggs):
+        self.collections[0].remove_eggs(eggs)
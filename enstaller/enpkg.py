@@ -1,5 +1,5 @@
 import sys
-from os.path import isdir, join
+from os.path import isdir, isfile, join
 
 from store.indexed import LocalIndexedStore, RemoteHTTPIndexedStore
 from store.joined import JoinedStore
@@ -8,7 +8,7 @@ from eggcollect import EggCollection, JoinedEggCollection
 
 from utils import comparable_version
 from resolve import Req, Resolve
-from fetch import FetchAPI
+from fetch import FetchAPI, MD5Mismatch
 from egg_meta import is_valid_eggname, split_eggname
 
 
@@ -49,6 +49,19 @@ class Enpkg(object):
         self.prefixes = prefixes
         self.hook = hook
         self.verbose = verbose
+        # optional limiter object, which is used to throttle downloads
+        self.limiter = None
+        # when True, eggs are installed directly from the remote store,
+        # without being fetched into the local directory
+        self.no_cache = False
+        # when True, upgrades are done by applying patches directly to the
+        # installed packages (when possible), see install_patches
+        self.delta = False
+        # host-wide cache of unpacked eggs, from which files are hardlinked
+        # into the prefix (see egginst.linkcache)
+        self.link_cache = None
+        # when True, the installed modules are byte-compiled (in parallel)
+        self.compile = False
 
         self.ec = JoinedEggCollection([EggCollection(prefix, self.hook)
                                        for prefix in self.prefixes])
@@ -106,29 +119,97 @@ class Enpkg(object):
             else:
                 eggs = rm(eggs)
 
+        patches = {}
+        if self.delta and not (self.hook or self.no_cache or force or
+                               forceall):
+            patches = self.fetch_patches(eggs)
+
         # fetch eggs
-        for egg in eggs:
-            self.fetch(egg, force or forceall)
+        if not self.no_cache:
+            for egg in eggs:
+                if egg not in patches:
+                    self.fetch(egg, force or forceall)
 
+        upgrades = set()
         if not self.hook:
-            # remove packages with the same name (from first egg collection
-            # only, in reverse install order)
+            # packages with the same name (from first egg collection only)
+            # are upgraded in place, unless the install is forced, in which
+            # case they are removed (all at once)
+            remove = []
             for egg in reversed(eggs):
-                try:
-                    self.remove(Req(name_egg(egg)))
-                except EnpkgError:
-                    pass
+                if egg in patches:
+                    continue
+                index = dict(self.ec.collections[0].query(
+                        name=name_egg(egg)))
+                if not index:
+                    continue
+                if force or forceall:
+                    remove.extend(index)
+                else:
+                    upgrades.add(egg)
+            self.ec.remove_eggs(remove)
 
         # install eggs
+        self.ec.collections[0].link_cache = self.link_cache
+        self.ec.collections[0].compile = self.compile
         for egg in eggs:
             extra_info = {}
             repo = self.remote.where_from(egg)
             if repo:
                 extra_info['repo_dispname'] = repo.info()['dispname']
-            self.ec.install(egg, self.local_dir, extra_info)
+            install = (self.ec.upgrade if egg in upgrades else
+                       self.ec.install)
+            if egg in patches:
+                src_egg, patch_path = patches[egg]
+                self.ec.install_patch(egg, self.local_dir, src_egg,
+                                      patch_path, extra_info)
+            elif self.no_cache:
+                fi = self.remote.open_seekable(egg, limiter=self.limiter)
+                try:
+                    install(egg, self.local_dir, extra_info, fi)
+                finally:
+                    fi.close()
+            else:
+                install(egg, self.local_dir, extra_info)
         return len(eggs)
 
+    def fetch_patches(self, eggs):
+        """
+        return a dictionary mapping the eggs, which upgrade an installed
+        package for which a patch is available, to tuples(installed egg,
+        path to the fetched patch).  The installed egg has to be present
+        in the local directory, and the new egg is not created at all.
+        """
+        self._connect()
+        f = FetchAPI(self.remote, self.local_dir)
+        f.verbose = self.verbose
+        f.limiter = self.limiter
+        res = {}
+        for egg in eggs:
+            if isfile(join(self.local_dir, egg)):
+                continue
+            index = dict(self.ec.collections[0].query(name=name_egg(egg)))
+            if len(index) != 1:
+                continue
+            src_egg = index.keys()[0]
+            if not isfile(join(self.local_dir, src_egg)):
+                continue
+            patch_path = f.fetch_patch(egg, src_egg)
+            if patch_path:
+                res[egg] = src_egg, patch_path
+        return res
+
     def remove(self, req):
+        self.remove_many([req])
+
+    def remove_many(self, reqs):
+        """
+        remove the installed packages for the requirements reqs at once.
+        Nothing is removed, when one of the packages is not installed.
+        """
+        self.ec.remove_eggs([self._installed_egg(req) for req in reqs])
+
+    def _installed_egg(self, req):
         assert req.name
         index = dict(self.ec.collections[0].query(**req.as_dict()))
         if len(index) == 0:
@@ -140,8 +221,7 @@ class Enpkg(object):
                         for d in index.itervalues()]
             raise EnpkgError("Package %s installed more than once: %s" %
                               (req.name, ', '.join(versions)))
-        egg = index.keys()[0]
-        self.ec.remove(egg)
+        return index.keys()[0]
 
     # == methods which relate to both (remote store / local installation ==
 
@@ -154,4 +234,47 @@ class Enpkg(object):
         self._connect()
         f = FetchAPI(self.remote, self.local_dir)
         f.verbose = self.verbose
+        f.limiter = self.limiter
         f.fetch_egg(egg, force)
+
+    def available_updates(self):
+        """
+        return a list of tuples(installed egg, newest available egg) for
+        all installed packages which have a newer version (or build) in the
+        remote store
+        """
+        vb = lambda info: (comparable_version(info['version']),
+                           info['build'])
+        res = []
+        for egg, info in self.query_installed():
+            newest = egg, info
+            try:
+                for key, rinfo in self.query_remote(name=info['name']):
+                    if vb(rinfo) > vb(newest[1]):
+                        newest = key, rinfo
+            except TypeError:
+                # versions which are not comparable
+                continue
+            if newest[0] != egg:
+                res.append((egg, newest[0]))
+        return res
+
+    def prefetch(self):
+        """
+        fetch the eggs (or patches, if possible) for all available updates
+        into the local directory, without installing them, and return
+        the list of eggs which are now available locally.  An egg which
+        cannot be fetched (e.g. because of a network error or an MD5
+        mismatch) is reported, and skipped.
+        """
+        eggs = []
+        for egg, new_egg in self.available_updates():
+            if self.verbose:
+                print "Prefetching: %s -> %s" % (egg, new_egg)
+            try:
+                self.fetch(new_egg)
+            except (KeyError, IOError, OSError, MD5Mismatch) as e:
+                print "Warning: could not prefetch %s: %s" % (new_egg, e)
+                continue
+            eggs.append(new_egg)
+        return eggs
@@ -4,17 +4,20 @@ from logging import getLogger
 from os.path import basename, isdir, isfile, join
 
 from egginst.utils import human_bytes
-from utils import md5_file
+from md5cache import MD5Cache
+from ratelimit import create_limiter
+from lockfile import LockFile
 
 
 class MD5Mismatch(Exception):
     pass
 
 
-def stream_to_file(fi, path, info={}):
+def stream_to_file(fi, path, info={}, limiter=None):
     """
     Read data from the filehandle and write a the file.
-    Optionally check the MD5.
+    Optionally check the MD5.  When a limiter (see ratelimit module) is
+    given, the download is throttled accordingly.
     """
     size = info['size']
     md5 = info.get('md5')
@@ -42,6 +45,8 @@ def stream_to_file(fi, path, info={}):
                 h.update(chunk)
             n += len(chunk)
             getLogger('progress.update').info(n)
+            if limiter:
+                limiter.consume(len(chunk))
     fi.close()
     getLogger('progress.stop').info(None)
 
@@ -56,13 +61,25 @@ class FetchAPI(object):
         self.remote = remote
         self.local_dir = local_dir
         self.verbose = False
+        # optional limiter object, which is used to throttle downloads
+        self.limiter = None
+        # when True, existing files are always rehashed, i.e. the MD5 cache
+        # is not trusted
+        self.verify = False
 
     def path(self, fn):
         return join(self.local_dir, fn)
 
     def fetch(self, key):
         stream, info = self.remote.get(key)
-        stream_to_file(stream, self.path(key), info)
+        path = self.path(key)
+        stream_to_file(stream, path, info, self.limiter)
+        if info.get('md5'):
+            # the MD5 of the data was verified while streaming, so there is
+            # no need to ever hash the file again (as long as it's unchanged)
+            md5cache = MD5Cache(self.local_dir)
+            md5cache.set(path, info['md5'])
+            md5cache.save()
 
     def patch_egg(self, egg):
         """
@@ -85,6 +102,8 @@ class FetchAPI(object):
                           name=egg.split('-')[0].lower(),
                           dst=egg):
             assert info['dst'] == egg
+            if info.get('zdiff_version', 1) > zdiff.VERSION:
+                continue
             src_path = self.path(info['src'])
             #print '%8d %s %s' % (info['size'], patch_fn, isfile(src_path))
             if isfile(src_path):
@@ -95,17 +114,54 @@ class FetchAPI(object):
         size, patch_fn, info = min(possible)
 
         self.fetch(patch_fn)
-        zdiff.patch(self.path(info['src']), self.path(egg),
+        path = self.path(egg)
+        zdiff.patch(self.path(info['src']), path + '.part',
                     self.path(patch_fn))
+        os.rename(path + '.part', path)
         return True
 
+    def fetch_patch(self, egg, src_egg):
+        """
+        Fetch the patch from src_egg to egg, and return its path, or None
+        when there is no such patch (which can be applied).
+        """
+        try:
+            import enstaller.zdiff as zdiff
+        except ImportError:
+            return None
+
+        for patch_fn, info in self.remote.query(
+                          type='patch',
+                          name=egg.split('-')[0].lower(),
+                          dst=egg,
+                          src=src_egg):
+            if info.get('zdiff_version', 1) > zdiff.VERSION:
+                continue
+            self.fetch(patch_fn)
+            return self.path(patch_fn)
+        return None
+
     def fetch_egg(self, egg, force=False):
         """
         fetch an egg, i.e. copy or download the distribution into local dir
         force: force download or copy if MD5 mismatches
+
+        When another process is already fetching the same egg, wait for it
+        to finish, and then use its result (subject to the same checks).
         """
         if not isdir(self.local_dir):
             os.makedirs(self.local_dir)
+        lock = LockFile(self.path(egg) + '.lock')
+        if not lock.acquire(blocking=False):
+            if self.verbose:
+                print "Waiting for other process to fetch %r" % egg
+            lock.acquire()
+        try:
+            self._fetch_egg(egg, force)
+        finally:
+            lock.release()
+
+    def _fetch_egg(self, egg, force):
         info = self.remote.get_metadata(egg)
         path = self.path(egg)
 
@@ -113,7 +169,10 @@ class FetchAPI(object):
         # merely see if the file exists
         if isfile(path):
             if force:
-                if md5_file(path) == info.get('md5'):
+                md5cache = MD5Cache(self.local_dir, self.verify)
+                md5 = md5cache.get(path)
+                md5cache.save()
+                if md5 == info.get('md5'):
                     if self.verbose:
                         print "Not refetching, %r MD5 match" % path
                     return
@@ -146,7 +205,15 @@ def main():
                  metavar='PATH')
     p.add_option("--force",
                  action="store_true")
+    p.add_option("--max-rate",
+                 action="store",
+                 type="int",
+                 help="limit the download rate (in KB/sec)",
+                 metavar='KBPS')
     p.add_option('-v', "--verbose", action="store_true")
+    p.add_option("--verify",
+                 action="store_true",
+                 help="rehash existing files, instead of using cached MD5s")
 
     opts, args = p.parse_args()
 
@@ -163,6 +230,9 @@ def main():
 
     f = FetchAPI(store, opts.dst)
     f.verbose = opts.verbose
+    f.verify = opts.verify
+    if opts.max_rate:
+        f.limiter = create_limiter(1024 * opts.max_rate)
     for fn in args[1:]:
         if not is_valid_eggname(fn):
             sys.exit('Error: invalid egg name: %r' % fn)
@@ -17,7 +17,8 @@ def is_diff(cont):
 
 class History(object):
     def __init__(self, prefix=None):
-        self.path = join(prefix or sys.prefix, 'enpkg.hist')
+        self.prefix = prefix or sys.prefix
+        self.path = join(self.prefix, 'enpkg.hist')
 
     def __enter__(self):
         self.init()
@@ -37,7 +38,7 @@ class History(object):
             return
         fo = open(self.path, 'w')
         fo.write(time.strftime("==> %s <==\n" % TIME_FMT))
-        for eggname in egginst.get_installed():
+        for eggname in egginst.get_installed(self.prefix):
             fo.write('%s\n' % eggname)
         fo.close()
 
@@ -113,7 +114,7 @@ class History(object):
         """
         self.init()
         last = self.get_state()
-        curr = set(egginst.get_installed())
+        curr = set(egginst.get_installed(self.prefix))
         if last == curr:
             return
         fo = open(self.path, 'a')
@@ -6,7 +6,8 @@ from os.path import basename, isfile, isdir, join
 
 from enstaller.store.indexed import LocalIndexedStore, RemoteHTTPIndexedStore
 
-from enstaller.utils import comparable_version, md5_file
+from enstaller.utils import comparable_version
+from enstaller.md5cache import md5_file
 from enstaller.fetch import stream_to_file
 import metadata
 import dist_naming
@@ -320,20 +321,25 @@ class Chain(object):
             return list(versions)
 
 
-    def fetch_dist(self, dist, fetch_dir, force=False, dry_run=False):
+    def fetch_dist(self, dist, fetch_dir, force=False, dry_run=False,
+                   verify=False):
         """
         Get a distribution, i.e. copy or download the distribution into
         fetch_dir.
 
         force:
             force download or copy if MD5 mismatches
+
+        verify:
+            rehash the existing file, instead of using its cached MD5
         """
         info = self.index[dist]
         repo, fn = dist_naming.split_dist(dist)
         path = join(fetch_dir, fn)
         # if force is used, make sure the md5 is the expected, otherwise
         # only see if the file exists
-        if isfile(path) and (not force or md5_file(path) == info.get('md5')):
+        if isfile(path) and (not force or
+                             md5_file(path, verify) == info.get('md5')):
             if self.verbose:
                 print "Not forcing refetch, %r already matches MD5" % path
             return
@@ -0,0 +1,202 @@
+"""
+Simple cross-process lock, based on a lock file.
+
+Where fcntl is available, the lock file is locked using flock, which the
+OS releases when the owner exits, such that locks never become stale.
+Otherwise (Windows), the lock is the atomic creation of the lock file.
+The lock file contains the process id and host name of the owner (and a
+random token), and is considered stale (and is reclaimed) when its owner
+is a process on this host which no longer exists, or (for owners on other
+hosts, e.g. when the directory is on a network file system) when the lock
+file is older than a given timeout.
+"""
+import os
+import sys
+import time
+import errno
+import socket
+from os.path import getmtime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def pid_exists(pid):
+    if sys.platform == 'win32':
+        # we cannot tell, so the lock only becomes stale by timeout
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class LockFile(object):
+
+    use_flock = fcntl is not None
+
+    def __init__(self, path, stale_timeout=3600, poll_interval=0.5):
+        self.path = path
+        self.stale_timeout = stale_timeout
+        self.poll_interval = poll_interval
+        self.owner = '%d %s %s' % (os.getpid(), socket.gethostname(),
+                                   os.urandom(4).encode('hex'))
+        self.locked = False
+        # the locked file descriptor, when using flock
+        self._fd = None
+
+    def _try_flock(self, blocking):
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX |
+                            (0 if blocking else fcntl.LOCK_NB))
+            except IOError as e:
+                os.close(fd)
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return False
+                raise
+            # the previous owner may have removed the lock file (when
+            # releasing the lock) after we opened it
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                st = None
+            fst = os.fstat(fd)
+            if st and (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+                os.ftruncate(fd, 0)
+                os.write(fd, self.owner)
+                self._fd = fd
+                return True
+            os.close(fd)
+
+    def _try_create(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        os.write(fd, self.owner)
+        os.close(fd)
+        return True
+
+    def _read(self, path):
+        """
+        return the tuple(owner, mtime) of the lock file path, or None if
+        it does not exist (anymore)
+        """
+        try:
+            return open(path).read(), getmtime(path)
+        except (IOError, OSError):
+            return None
+
+    def _is_stale(self, owner, mtime):
+        try:
+            pid, host = owner.split()[:2]
+            pid = int(pid)
+        except ValueError:
+            # the owner did not write its id yet (or crashed doing so)
+            return time.time() - mtime > self.poll_interval * 10
+        if host == socket.gethostname() and not pid_exists(pid):
+            return True
+        return time.time() - mtime > self.stale_timeout
+
+    def is_stale(self):
+        if self.use_flock:
+            # stale when nobody holds the lock
+            try:
+                fd = os.open(self.path, os.O_RDONLY)
+            except OSError:
+                return False
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError:
+                return False
+            finally:
+                os.close(fd)
+            return True
+        state = self._read(self.path)
+        if state is None: # lock was just released
+            return False
+        return self._is_stale(*state)
+
+    def _reclaim(self, state):
+        """
+        remove the stale lock file, which had the given state.  The file
+        is first renamed (atomically) to a unique name, and only removed
+        when it is still the stale lock, i.e. it was not reclaimed and
+        replaced by a fresh lock of another process in the meantime (in
+        which case it is put back).  This is not safe against a third
+        process creating a fresh lock while the file is renamed, which is
+        why flock is used where available.
+        """
+        tmp_path = '%s.stale-%d-%s' % (self.path, os.getpid(),
+                                       os.urandom(4).encode('hex'))
+        try:
+            os.rename(self.path, tmp_path)
+        except OSError: # somebody else reclaimed it already
+            return
+        if self._read(tmp_path) == state:
+            os.unlink(tmp_path)
+        elif hasattr(os, 'link'):
+            try:
+                # unlike rename, link never replaces an existing lock
+                os.link(tmp_path, self.path)
+            except OSError:
+                pass
+            os.unlink(tmp_path)
+        else:
+            try:
+                # fails when the lock exists (Windows)
+                os.rename(tmp_path, self.path)
+            except OSError:
+                os.unlink(tmp_path)
+
+    def acquire(self, blocking=True):
+        """
+        acquire the lock, and return True when the lock was acquired.
+        Unless blocking is False, wait until the lock is released (or
+        becomes stale) by its current owner.
+        """
+        if self.use_flock:
+            self.locked = self._try_flock(blocking)
+            return self.locked
+        while True:
+            if self._try_create():
+                self.locked = True
+                return True
+            state = self._read(self.path)
+            if state is None: # lock was just released
+                continue
+            if self._is_stale(*state):
+                self._reclaim(state)
+                continue
+            if not blocking:
+                return False
+            time.sleep(self.poll_interval)
+
+    def release(self):
+        if not self.locked:
+            return
+        if self._fd is not None:
+            # removed while still holding the lock, see _try_flock
+            os.unlink(self.path)
+            os.close(self._fd)
+            self._fd = None
+        else:
+            state = self._read(self.path)
+            # unless the lock was reclaimed (as stale) by another process
+            if state and state[0] == self.owner:
+                os.unlink(self.path)
+        self.locked = False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
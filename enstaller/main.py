@@ -11,7 +11,7 @@ import site
 import string
 import textwrap
 from argparse import ArgumentParser
-from os.path import isfile, join
+from os.path import abspath, isfile, join
 
 import egginst
 from egginst.utils import bin_dir_name, rel_site_packages
@@ -20,6 +20,7 @@ from enstaller import __version__
 import config
 from history import History
 from proxy.api import setup_proxy
+from ratelimit import create_limiter
 from utils import comparable_version, abs_expanduser
 
 from eggcollect import EggCollection
@@ -103,15 +104,17 @@ def imports_option(enpkg, pat=None):
     print FMT % ('Name', 'Version', 'Location')
     print 60 * "="
 
-    names = set(info['name'] for _, info in enpkg.query_installed())
-    for name in sorted(names, key=string.lower):
+    # query each collection only once, the packages in the first
+    # collections take precedence
+    index = {}
+    for c in reversed(enpkg.ec.collections):
+        loc = 'sys' if c.prefix == sys.prefix else 'user'
+        for _, info in c.query():
+            index[info['name']] = info, loc
+    for name in sorted(index, key=string.lower):
         if pat and not pat.search(name):
             continue
-        for c in reversed(enpkg.ec.collections):
-            index = dict(c.query(name=name))
-            if index:
-                info = index.values()[0]
-                loc = 'sys' if c.prefix == sys.prefix else 'user'
+        info, loc = index[name]
         print FMT % (name, '%(version)s-%(build)d' % info, loc)
 
 
@@ -158,13 +161,41 @@ def whats_new(enst):
         print "no new version of any installed package is available"
 
 
-def remove_req(enpkg, req):
+def prefetch(enpkg):
+    """
+    Fetch the updates of all installed packages into the local repository,
+    such that a later install does not have to download anything.
+    As this is meant to run in the background (e.g. from cron), the
+    process priority is lowered first.
     """
-    Tries remove a package from prefix given a requirement object.
-    This function is only used for the --remove option.
+    if hasattr(os, 'nice'):
+        os.nice(19)
+    eggs = enpkg.prefetch()
+    if enpkg.verbose:
+        print "Prefetched %d egg(s) into: %r" % (len(eggs), enpkg.local_dir)
+
+
+def get_limiter(args):
+    """
+    Return the download limiter, according to the command line options
+    (which overwrite the settings in the config file).
+    """
+    rates = []
+    for opt, key in (args.max_rate, 'max_rate'), (args.host_max_rate,
+                                                   'host_max_rate'):
+        rate = opt or config.get(key)
+        rates.append(1024 * rate if rate else None)
+    return create_limiter(*rates)
+
+
+def remove_reqs(enpkg, reqs):
+    """
+    Tries remove the packages from prefix given a list of requirement
+    objects (all at once).  This function is only used for the --remove
+    option.
     """
     try:
-        enpkg.remove(req)
+        enpkg.remove_many(reqs)
     except EnpkgError as e:
         print e.message
         return
@@ -261,6 +292,8 @@ def main():
                    help='package(s) to work on')
     p.add_argument("--add-url", metavar='URL',
                    help="add a repository URL to the configuration file")
+    p.add_argument("--compile", action="store_true",
+                   help="byte-compile the installed Python modules")
     p.add_argument("--config", action="store_true",
                    help="display the configuration and exit")
     p.add_argument('-f', "--force", action="store_true",
@@ -275,6 +308,10 @@ def main():
                    help="show which packages can be imported")
     p.add_argument('-i', "--info", action="store_true",
                    help="show information about a package")
+    p.add_argument("--link-cache", metavar='PATH',
+                   help="hardlink files from (and unpack eggs into) this "
+                        "host-wide cache directory, instead of extracting "
+                        "them into the prefix")
     p.add_argument("--log", action="store_true", help="print revision log")
     p.add_argument('-l', "--list", action="store_true",
                    help="list the packages currently installed on the system")
@@ -282,9 +319,26 @@ def main():
                help="show what would have been downloaded/removed/installed")
     p.add_argument('-N', "--no-deps", action="store_true",
                    help="neither download nor install dependencies")
+    p.add_argument("--no-cache", action="store_true",
+                   help="install eggs directly from the repository, without "
+                        "storing them in the local repository (LOCAL-REPO)")
+    p.add_argument("--delta", action="store_true",
+                   help="upgrade installed packages by applying patches "
+                        "directly to the installed files (when possible), "
+                        "without creating the new eggs")
     p.add_argument("--env", action="store_true",
                    help="based on the configuration, display how to set the "
                         "some environment variables")
+    p.add_argument("--host-max-rate", metavar='KBPS', type=int,
+                   help="limit the download rate of all enpkg processes on "
+                        "this host (together) to KBPS kilobytes per second")
+    p.add_argument("--max-rate", metavar='KBPS', type=int,
+                   help="limit the download rate to KBPS kilobytes per "
+                        "second")
+    p.add_argument("--prefetch", action="store_true",
+                   help="download available updates of installed packages "
+                        "into the local repository (at low priority), "
+                        "without installing them")
     p.add_argument("--prefix", metavar='PATH',
                    help="install prefix (disregarding of any settings in "
                         "the config file)")
@@ -313,7 +367,8 @@ def main():
     args = p.parse_args()
 
     if len(args.cnames) > 0 and (args.config or args.env or args.userpass or
-                                 args.revert or args.log or args.whats_new):
+                                 args.revert or args.log or args.whats_new or
+                                 args.prefetch):
         p.error("Option takes no arguments")
 
     if args.user:
@@ -386,6 +441,11 @@ def main():
         enpkg = Enpkg(config.get('IndexedRepos'), config.get_auth(),
                       prefixes=prefixes, hook=args.hook,
                       verbose=args.verbose)
+        enpkg.limiter = get_limiter(args)
+        enpkg.no_cache = args.no_cache
+        enpkg.delta = args.delta
+        enpkg.link_cache = args.link_cache and abspath(args.link_cache)
+        enpkg.compile = args.compile
 
     if args.imports:                              # --imports
         assert not args.hook
@@ -414,6 +474,10 @@ def main():
         whats_new(enst)
         return
 
+    if args.prefetch:                             # --prefetch
+        prefetch(enpkg)
+        return
+
     if len(args.cnames) == 0:
         p.error("Requirement(s) missing")
     elif len(args.cnames) == 2:
@@ -438,10 +502,10 @@ def main():
     print "prefix:", prefix
 
     with History(prefix):
-        for req in reqs:
-            if args.remove:                           # --remove
-                remove_req(enpkg, req)
-            else:
+        if args.remove:                               # --remove
+            remove_reqs(enpkg, reqs)
+        else:
+            for req in reqs:
                 install_req(enpkg, req, args)
 
 
@@ -0,0 +1,126 @@
+"""
+A persistent cache of the MD5 sums of files in a directory (e.g. the
+LOCAL-REPO or a repository of eggs), such that files which did not change
+since they were last hashed are not rehashed.
+
+The cache is stored in the file '.md5cache.json' in the directory itself.
+Each entry is keyed by the filename, and is only considered valid when the
+size, mtime and inode of the file are still the same as when the MD5 sum
+was computed.
+
+As the cache of a directory may be used by several processes at once (e.g.
+the workers creating patches), only the entries obtained by this process
+are saved: they are merged into the cache file under a lock, and the new
+cache file is written to a unique temporary file which is then renamed.
+"""
+import os
+import sys
+import json
+import tempfile
+from os.path import basename, dirname, isfile, join
+
+from utils import md5_file as _md5_file
+from lockfile import LockFile
+
+
+CACHE_FN = '.md5cache.json'
+
+
+def stat_key(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime, st.st_ino]
+
+
+class MD5Cache(object):
+
+    def __init__(self, dir_path, verify=False):
+        self.path = join(dir_path, CACHE_FN)
+        self.verify = verify
+        self.modified = False
+        self._index = None
+        # entries obtained by this object, which are not saved yet
+        self._new = {}
+
+    def _load(self):
+        if isfile(self.path):
+            try:
+                return json.load(open(self.path))
+            except ValueError: # corrupt cache file, start over
+                pass
+        return {}
+
+    def _read(self):
+        if self._index is None:
+            self._index = self._load()
+
+    def get(self, path):
+        """
+        return the MD5 sum of the file located at `path`, which is taken
+        from the cache when the file did not change.  When the cache was
+        created with verify=True, the file is always rehashed (and the
+        cache updated).
+        """
+        self._read()
+        fn = basename(path)
+        key = stat_key(path)
+        entry = self._index.get(fn)
+        if not self.verify and entry and entry['key'] == key:
+            return entry['md5']
+        md5 = _md5_file(path)
+        self._index[fn] = self._new[fn] = dict(key=key, md5=md5)
+        self.modified = True
+        return md5
+
+    def set(self, path, md5):
+        """
+        record the (known) MD5 sum of the file located at `path`, e.g.
+        after the file has been downloaded and verified
+        """
+        self._read()
+        fn = basename(path)
+        self._index[fn] = self._new[fn] = dict(key=stat_key(path), md5=md5)
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        dir_path = dirname(self.path)
+        try:
+            with LockFile(self.path + '.lock', stale_timeout=60,
+                          poll_interval=0.05):
+                index = self._load()
+                index.update(self._new)
+                # remove entries of files which no longer exist
+                for fn in index.keys():
+                    if not isfile(join(dir_path, fn)):
+                        del index[fn]
+                fd, tmp_path = tempfile.mkstemp(dir=dir_path,
+                                                prefix=CACHE_FN + '.')
+                try:
+                    with os.fdopen(fd, 'w') as fo:
+                        json.dump(index, fo, indent=2, sort_keys=True)
+                    # rename does not replace existing files on Windows
+                    if sys.platform == 'win32' and isfile(self.path):
+                        os.unlink(self.path)
+                    os.rename(tmp_path, self.path)
+                except:
+                    os.unlink(tmp_path)
+                    raise
+        except (IOError, OSError):
+            # the cache is merely an optimization, so failing to write it
+            # (e.g. in a read-only repository) is not an error
+            return
+        self._index = index
+        self._new = {}
+        self.modified = False
+
+
+def md5_file(path, verify=False):
+    """
+    Returns the md5sum of the file (located at `path`), using (and
+    updating) the cache in the directory of the file.
+    """
+    cache = MD5Cache(dirname(path), verify)
+    md5 = cache.get(path)
+    cache.save()
+    return md5
@@ -2,9 +2,12 @@ import os
 import re
 import json
 import string
+from logging import getLogger
+from multiprocessing import Pool, cpu_count
 from os.path import abspath, getsize, getmtime, isdir, isfile, join
 
 from utils import comparable_version, info_file
+from md5cache import MD5Cache
 from egg_meta import is_valid_eggname, split_eggname
 try:
     import zdiff
@@ -12,6 +15,12 @@ except ImportError:
     zdiff = None
 
 
+# the keys of the index entries of patches, as the index is downloaded by
+# all clients, the other keys of the patch info (see zdiff.diff), e.g. the
+# sizes of the members, are not copied into it
+INDEX_KEYS = ('size', 'mtime', 'md5', 'name', 'src', 'dst', 'zdiff_version')
+
+
 fn_pat = re.compile(r'([\w.]+)-([\w.]+)-(\d+)--([\w.]+)-(\d+)\.zdiff$')
 def split(fn):
     m = fn_pat.match(fn)
@@ -20,54 +29,208 @@ def split(fn):
     return m.expand(r'\1-\2-\3.egg'), m.expand(r'\1-\4-\5.egg')
 
 
-def update_patches(eggs_dir, patches_dir, verbose=False):
-
-    def calculate_all_patches():
-        egg_names = [fn for fn in os.listdir(eggs_dir)
-                     if is_valid_eggname(fn)]
-        names = set(split_eggname(egg_name)[0]
-                    for egg_name in egg_names)
-        for name in sorted(names, key=string.lower):
-            versions = []
-            for egg_name in egg_names:
-                n, v, b = split_eggname(egg_name)
-                if n != name:
-                    continue
-                versions.append((v, b))
-            versions.sort(key=(lambda vb: (comparable_version(vb[0]), vb[1])))
-            versions = ['%s-%d' % vb for vb in versions]
-            lv = len(versions)
-            #print name, lv, versions
-            for i in xrange(0, lv):
-                for j in xrange(i + 1, lv):
-                    yield '%s-%s--%s.zdiff' % (name, versions[i], versions[j])
+def create_patch(eggs_dir, patches_dir, patch_fn, version=1):
+    src_fn, dst_fn = split(patch_fn)
+    src_path = join(eggs_dir, src_fn)
+    dst_path = join(eggs_dir, dst_fn)
+    assert isfile(src_path) and isfile(dst_path)
+    patch_path = join(patches_dir, patch_fn)
+    zdiff.diff(src_path, dst_path, patch_path + '.part', version)
+    os.rename(patch_path + '.part', patch_path)
+    return patch_fn
+
+
+def _create_patch(args):
+    # helper for calling create_patch using a process pool
+    return create_patch(*args)
+
+
+def patch_cost(eggs_dir, patch_fn):
+    """
+    return the (estimated) cost of creating a patch, which is simply the
+    total size of both eggs
+    """
+    return sum(getsize(join(eggs_dir, fn)) for fn in split(patch_fn))
+
+
+class PatchPolicy(object):
+    """
+    Determines for which pairs of versions (of a package) patches are
+    created, and which of the created patches are kept.
+
+    pairs is a list of the following selection policies (the union of the
+    selected pairs is created):
+      * 'all': all pairs of versions, i.e. O(n^2) patches
+      * 'adjacent': each version to the next version
+      * 'latest': each of the k versions before the newest to the newest
+      * 'ladder': each version from the versions 1, 2, 4, 8, ... before
+        it, i.e. O(n log n) patches
+
+    A created patch is kept when the expected bandwidth saving (of all
+    downloads) outweighs the cost of storing the patch, and the CPU cost of
+    applying the patch on the client (which is proportional to the size
+    of the egg, and expressed as a fraction of the egg size).
+    Patches for eggs smaller than min_size are never created.
+    The defaults correspond to the original fixed thresholds, i.e. a patch
+    is kept when it is less than half the size of the egg.
+    """
+    selections = ('all', 'adjacent', 'latest', 'ladder')
+
+    def __init__(self, pairs=['all'], k=3, min_size=131072,
+                 downloads=1.0, cpu_factor=0.5, storage_factor=0.0):
+        for sel in pairs:
+            if sel not in self.selections:
+                raise ValueError("unknown patch selection: %r" % sel)
+        self.pairs = pairs
+        self.k = k
+        self.min_size = min_size
+        self.downloads = downloads
+        self.cpu_factor = cpu_factor
+        self.storage_factor = storage_factor
+
+    def select(self, n):
+        """
+        return the set of index pairs (i, j), such that a patch from the
+        i-th to the j-th version (of the n sorted versions) is created
+        """
+        res = set()
+        for sel in self.pairs:
+            if sel == 'all':
+                res.update((i, j) for i in xrange(n)
+                                  for j in xrange(i + 1, n))
+            elif sel == 'adjacent':
+                res.update((i, i + 1) for i in xrange(n - 1))
+            elif sel == 'latest':
+                res.update((i, n - 1) for i in xrange(max(0, n - 1 - self.k),
+                                                      n - 1))
+            elif sel == 'ladder':
+                for j in xrange(1, n):
+                    step = 1
+                    while j - step >= 0:
+                        res.add((j - step, j))
+                        step *= 2
+        return sorted(res)
+
+    def keep(self, dst_size, patch_size):
+        """
+        return True if a patch of patch_size bytes (for an egg of dst_size
+        bytes) is worth keeping
+        """
+        if dst_size < self.min_size:
+            return False
+        saving = self.downloads * (dst_size - patch_size -
+                                   self.cpu_factor * dst_size)
+        return saving > self.storage_factor * patch_size
+
+
+def egg_mtimes(eggs_dir, patch_fn):
+    return [getmtime(join(eggs_dir, fn)) for fn in split(patch_fn)]
+
+
+def read_rejected(patches_dir):
+    """
+    return the dictionary mapping the rejected patches to the mtimes of
+    their eggs (at the time they were rejected)
+    """
+    path = join(patches_dir, 'rejected.json')
+    if isfile(path):
+        return json.load(open(path))
+    return {}
+
+
+def calculate_all_patches(eggs_dir, policy):
+    """
+    yield the filenames of all patches (for the eggs in eggs_dir) which are
+    selected by the policy
+    """
+    egg_names = [fn for fn in os.listdir(eggs_dir)
+                 if is_valid_eggname(fn)]
+    names = set(split_eggname(egg_name)[0]
+                for egg_name in egg_names)
+    for name in sorted(names, key=string.lower):
+        versions = []
+        for egg_name in egg_names:
+            n, v, b = split_eggname(egg_name)
+            if n != name:
+                continue
+            versions.append((v, b))
+        versions.sort(key=(lambda vb: (comparable_version(vb[0]), vb[1])))
+        versions = ['%s-%d' % vb for vb in versions]
+        #print name, len(versions), versions
+        for i, j in policy.select(len(versions)):
+            dst_path = join(eggs_dir, '%s-%s.egg' % (name, versions[j]))
+            if getsize(dst_path) < policy.min_size:
+                continue
+            yield '%s-%s--%s.zdiff' % (name, versions[i], versions[j])
+
+
+def update_patches(eggs_dir, patches_dir, verbose=False, workers=None,
+                   policy=None, version=1):
+    """
+    Create all missing (or outdated) patches, using a pool of `workers`
+    processes (defaults to the number of CPUs), and remove old patches.
+    Patches of another zdiff version than `version` are outdated.
+    """
+    if policy is None:
+        policy = PatchPolicy()
+
+    rejected = read_rejected(patches_dir)
 
     def up_to_date(patch_fn):
         patch_path = join(patches_dir, patch_fn)
         if not isfile(patch_path):
-            return False
+            # a patch which was rejected (by the cost model) is not created
+            # again, unless one of the eggs changed
+            return rejected.get(patch_fn) == egg_mtimes(eggs_dir, patch_fn)
         info = zdiff.info(patch_path)
+        if info.get('zdiff_version', 1) != version:
+            return False
         for t in 'dst', 'src':
             if getmtime(join(eggs_dir, info[t])) != info[t + '_mtime']:
                 return False
         return True
 
-    def create(patch_fn):
-        src_fn, dst_fn = split(patch_fn)
-        src_path = join(eggs_dir, src_fn)
-        dst_path = join(eggs_dir, dst_fn)
-        assert isfile(src_path) and isfile(dst_path)
-        if verbose:
-            print 'creating', patch_fn
-        patch_path = join(patches_dir, patch_fn)
-        zdiff.diff(src_path, dst_path, patch_path + '.part')
-        os.rename(patch_path + '.part', patch_path)
-
     all_patches = set()
-    for patch_fn in calculate_all_patches():
+    missing = []
+    for patch_fn in calculate_all_patches(eggs_dir, policy):
         all_patches.add(patch_fn)
         if not up_to_date(patch_fn):
-            create(patch_fn)
+            missing.append(patch_fn)
+
+    # the most expensive patches are created first, such that the workers
+    # are not waiting for a single large patch at the end
+    missing.sort(key=lambda fn: patch_cost(eggs_dir, fn), reverse=True)
+    args = [(eggs_dir, patches_dir, fn, version) for fn in missing]
+
+    if workers is None:
+        workers = cpu_count()
+    pool = None
+    try:
+        if workers > 1 and len(missing) > 1:
+            pool = Pool(workers)
+            results = pool.imap_unordered(_create_patch, args)
+        else:
+            results = (_create_patch(a) for a in args)
+
+        getLogger('progress.start').info(dict(
+                amount = len(missing),
+                disp_amount = str(len(missing)),
+                filename = 'patches',
+                action = 'creating'))
+        for n, patch_fn in enumerate(results, 1):
+            if verbose:
+                print 'created (%d/%d): %s' % (n, len(missing), patch_fn)
+            getLogger('progress.update').info(n)
+        getLogger('progress.stop').info(None)
+    finally:
+        if pool:
+            # on error, the remaining workers are stopped right away
+            pool.terminate()
+            pool.join()
+        # remove the partial outputs of failed (or stopped) workers
+        for fn in os.listdir(patches_dir):
+            if fn.endswith('.zdiff.part'):
+                os.unlink(join(patches_dir, fn))
 
     # remove old patches
     for patch_fn in os.listdir(patches_dir):
@@ -75,7 +238,17 @@ def update_patches(eggs_dir, patches_dir, verbose=False):
             os.unlink(join(patches_dir, patch_fn))
 
 
-def update_index(eggs_dir, patches_dir, force=False):
+def update_index(eggs_dir, patches_dir, force=False, verify=False,
+                 policy=None):
+    """
+    (Re-)create the index.json file of the patches.  Patches which are not
+    worth keeping (according to the policy) are removed, and recorded as
+    rejected, such that they are not created again.
+    """
+    if policy is None:
+        policy = PatchPolicy()
+    rejected = read_rejected(patches_dir)
+    md5cache = MD5Cache(patches_dir, verify)
     index_path = join(patches_dir, 'index.json')
     if force or not isfile(index_path):
         index = {}
@@ -89,25 +262,33 @@ def update_index(eggs_dir, patches_dir, force=False):
         src_fn, dst_fn = split(patch_fn)
         dst_path = join(eggs_dir, dst_fn)
         dst_size = getsize(dst_path)
-        if dst_size < 131072:
-            continue
         patch_path = join(patches_dir, patch_fn)
-        if dst_size < getsize(patch_path) * 2:
+        if not policy.keep(dst_size, getsize(patch_path)):
+            rejected[patch_fn] = egg_mtimes(eggs_dir, patch_fn)
+            os.unlink(patch_path)
             continue
         info = index.get(patch_fn)
-        if info and getmtime(patch_path) == info['mtime']:
-            new_index[patch_fn] = info
-            continue
-        info = info_file(patch_path)
-        info.update(zdiff.info(patch_path))
-        info['name'] = patch_fn.split('-')[0].lower()
-        new_index[patch_fn] = info
+        if not (info and getmtime(patch_path) == info['mtime']):
+            info = info_file(patch_path, md5cache)
+            info.update(zdiff.info(patch_path))
+            info['name'] = patch_fn.split('-')[0].lower()
+        new_index[patch_fn] = dict((k, info[k]) for k in INDEX_KEYS
+                                   if k in info)
 
     with open(index_path, 'w') as f:
         json.dump(new_index, f, indent=2, sort_keys=True)
+    md5cache.save()
+
+    # forget about rejected patches whose eggs no longer exist
+    for patch_fn in rejected.keys():
+        if not all(isfile(join(eggs_dir, fn)) for fn in split(patch_fn)):
+            del rejected[patch_fn]
+    with open(join(patches_dir, 'rejected.json'), 'w') as f:
+        json.dump(rejected, f, indent=2, sort_keys=True)
 
 
-def update(eggs_dir, force=False, verbose=False):
+def update(eggs_dir, force=False, verbose=False, workers=None, policy=None,
+           version=1):
     if zdiff is None:
         print "Warning: could not import bsdiff4, cannot create patches"
         return
@@ -117,13 +298,13 @@ def update(eggs_dir, force=False, verbose=False):
         os.mkdir(patches_dir)
 
     if force:
-        index_files = ['index.json']
+        index_files = ['index.json', 'rejected.json']
         for fn in os.listdir(patches_dir):
             if fn.endswith('.zdiff') or fn in index_files:
                 os.unlink(join(patches_dir, fn))
 
-    update_patches(eggs_dir, patches_dir, verbose)
-    update_index(eggs_dir, patches_dir)
+    update_patches(eggs_dir, patches_dir, verbose, workers, policy, version)
+    update_index(eggs_dir, patches_dir, policy=policy)
 
 
 def main():
@@ -135,10 +316,69 @@ def main():
                     "DIRECTORY defaults to CWD")
 
     p.add_option('-f', "--force", action="store_true")
+    p.add_option('-j', "--jobs",
+                 action="store",
+                 type="int",
+                 help="number of processes used to create patches, "
+                      "defaults to the number of CPUs",
+                 metavar='N')
+    p.add_option("--policy",
+                 action="store",
+                 default='all',
+                 help="comma separated list of pair selections, out of: "
+                      "%s, defaults to %%default" %
+                      ', '.join(PatchPolicy.selections),
+                 metavar='POLICY')
+    p.add_option('-k',
+                 action="store",
+                 type="int",
+                 default=3,
+                 help="number of versions patched to the newest version, "
+                      "for the 'latest' policy, defaults to %default")
+    p.add_option("--min-size",
+                 action="store",
+                 type="int",
+                 default=131072,
+                 help="minimal egg size (in bytes) for which patches are "
+                      "created, defaults to %default")
+    p.add_option("--downloads",
+                 action="store",
+                 type="float",
+                 default=1.0,
+                 help="expected number of downloads of a patch, "
+                      "defaults to %default")
+    p.add_option("--cpu-factor",
+                 action="store",
+                 type="float",
+                 default=0.5,
+                 help="cost of applying a patch, as a fraction of the egg "
+                      "size, defaults to %default")
+    p.add_option("--storage-factor",
+                 action="store",
+                 type="float",
+                 default=0.0,
+                 help="cost of storing a patch, as a multiple of its size, "
+                      "defaults to %default")
     p.add_option('-v', "--verbose", action="store_true")
+    p.add_option("--zdiff-version",
+                 action="store",
+                 type="choice",
+                 choices=['1', '2'],
+                 default='1',
+                 help="version of the patch format, version 2 patches are "
+                      "faster to apply, but cannot be applied by older "
+                      "clients, defaults to %default",
+                 metavar='N')
 
     opts, args = p.parse_args()
 
+    try:
+        policy = PatchPolicy(opts.policy.split(','), opts.k, opts.min_size,
+                             opts.downloads, opts.cpu_factor,
+                             opts.storage_factor)
+    except ValueError as e:
+        p.error(str(e))
+
     if len(args) == 0:
         dir_path = os.getcwd()
     elif len(args) == 1:
@@ -146,7 +386,12 @@ def main():
     else:
         p.error("too many arguments")
 
-    update(dir_path, opts.force, opts.verbose)
+    if not opts.verbose:
+        from egginst.console import setup_handlers
+        setup_handlers()
+
+    update(dir_path, opts.force, opts.verbose, opts.jobs, policy,
+           int(opts.zdiff_version))
 
 
 if __name__ == '__main__':
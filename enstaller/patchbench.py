@@ -0,0 +1,221 @@
+"""
+Benchmark of the .zdiff patches for an egg repository.
+
+For each pair of versions (selected by a patch policy, see patch.py),
+the patch is created for each zdiff format version, and applied with and
+without raw copying of unchanged members.  The report contains, for each
+pair, the sizes of the eggs and the patches, as well as the time and peak
+memory used for creating and applying the patches.  Each measurement is
+done in a separate child process, such that the peak memory is not
+affected by previous measurements.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import tempfile
+from multiprocessing import Pool
+from os.path import abspath, getsize, join
+
+from enstaller import zdiff
+from enstaller.patch import PatchPolicy, calculate_all_patches, split
+from enstaller.utils import md5_file
+
+
+def peak_memory():
+    """
+    return the peak resident set size (in bytes) of this process
+    """
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss
+    return 1024 * maxrss
+
+
+def _measure(args):
+    # runs in the child process, returns tuple(time, memory)
+    func, fargs, kwargs = args
+    mem0 = peak_memory()
+    t0 = time.time()
+    getattr(zdiff, func)(*fargs, **kwargs)
+    return time.time() - t0, max(0, peak_memory() - mem0)
+
+
+def measure(func, *args, **kwargs):
+    """
+    call zdiff.<func>(*args, **kwargs) in a child process, and return a
+    dictionary with the time (in seconds) and the peak memory (the
+    increase of the peak resident set size of the child, in bytes)
+    """
+    pool = Pool(1)
+    try:
+        t, mem = pool.apply(_measure, [(func, args, kwargs)])
+    finally:
+        pool.close()
+        pool.join()
+    return dict(time=t, memory=mem)
+
+
+def bench_patch(eggs_dir, patch_fn, tmp_dir, versions=(1, 2), workers=None):
+    """
+    benchmark the patch patch_fn, and return the report (dictionary)
+    """
+    src_fn, dst_fn = split(patch_fn)
+    src_path = join(eggs_dir, src_fn)
+    dst_path = join(eggs_dir, dst_fn)
+    res = dict(patch=patch_fn,
+               src_size=getsize(src_path),
+               dst_size=getsize(dst_path),
+               versions={})
+    # the MD5 sums are computed here, such that they are not part of the
+    # measured diff time, and no MD5 cache is written into eggs_dir
+    md5s = {src_path: md5_file(src_path), dst_path: md5_file(dst_path)}
+    for version in versions:
+        patch_path = join(tmp_dir, '%d-%s' % (version, patch_fn))
+        out_path = join(tmp_dir, dst_fn)
+        r = dict(diff=measure('diff', src_path, dst_path, patch_path,
+                              version=version, md5s=md5s))
+        r['patch_size'] = getsize(patch_path)
+        r['ratio'] = float(r['patch_size']) / res['dst_size']
+        for raw_copy in True, False:
+            r['raw_copy' if raw_copy else 'recompress'] = measure(
+                'patch', src_path, out_path, patch_path,
+                raw_copy=raw_copy, workers=workers)
+        os.unlink(patch_path)
+        os.unlink(out_path)
+        res['versions'][str(version)] = r
+    return res
+
+
+def summarize(results):
+    """
+    return the totals (for each zdiff version) of the results
+    """
+    summary = {}
+    dst_size = sum(r['dst_size'] for r in results)
+    for r in results:
+        for version, vr in r['versions'].iteritems():
+            s = summary.setdefault(version, dict(
+                    dst_size=dst_size, patch_size=0, diff_time=0.0,
+                    raw_copy_time=0.0, recompress_time=0.0, max_memory=0))
+            s['patch_size'] += vr['patch_size']
+            s['diff_time'] += vr['diff']['time']
+            s['raw_copy_time'] += vr['raw_copy']['time']
+            s['recompress_time'] += vr['recompress']['time']
+            s['max_memory'] = max(s['max_memory'], vr['diff']['memory'],
+                                  vr['raw_copy']['memory'],
+                                  vr['recompress']['memory'])
+    for s in summary.itervalues():
+        s['ratio'] = float(s['patch_size']) / (s['dst_size'] or 1)
+    return summary
+
+
+def bench(eggs_dir, policy=None, versions=(1, 2), workers=None,
+          verbose=False):
+    """
+    benchmark all patches (selected by the policy) for the eggs in
+    eggs_dir, and return the report (dictionary)
+    """
+    if policy is None:
+        policy = PatchPolicy()
+    results = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        for patch_fn in calculate_all_patches(eggs_dir, policy):
+            r = bench_patch(eggs_dir, patch_fn, tmp_dir, versions, workers)
+            if verbose:
+                for version in sorted(r['versions']):
+                    vr = r['versions'][version]
+                    print '%-50s v%s %6.1f%% %8.2fs %8.2fs %8.2fs' % (
+                        patch_fn, version, 100.0 * vr['ratio'],
+                        vr['diff']['time'], vr['raw_copy']['time'],
+                        vr['recompress']['time'])
+            results.append(r)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return dict(eggs_dir=eggs_dir,
+                policy=policy.pairs,
+                results=results,
+                summary=summarize(results))
+
+
+def main():
+    from optparse import OptionParser
+
+    p = OptionParser(
+        usage="usage: %prog [options] [DIRECTORY]",
+        description="benchmark the egg patches for an egg repository, "
+                    "and write a JSON report.  DIRECTORY defaults to CWD")
+
+    p.add_option('-j', "--jobs",
+                 action="store",
+                 type="int",
+                 help="number of threads used to apply patches, "
+                      "defaults to the number of CPUs",
+                 metavar='N')
+    p.add_option("--policy",
+                 action="store",
+                 default='adjacent',
+                 help="comma separated list of pair selections, out of: "
+                      "%s, defaults to %%default" %
+                      ', '.join(PatchPolicy.selections),
+                 metavar='POLICY')
+    p.add_option('-k',
+                 action="store",
+                 type="int",
+                 default=3,
+                 help="number of versions patched to the newest version, "
+                      "for the 'latest' policy, defaults to %default")
+    p.add_option("--min-size",
+                 action="store",
+                 type="int",
+                 default=0,
+                 help="minimal egg size (in bytes) for which patches are "
+                      "benchmarked, defaults to %default")
+    p.add_option('-o', "--output",
+                 action="store",
+                 default='patchbench.json',
+                 help="path of the JSON report, defaults to %default",
+                 metavar='PATH')
+    p.add_option('-v', "--verbose", action="store_true")
+    p.add_option("--zdiff-versions",
+                 action="store",
+                 default='1,2',
+                 help="comma separated list of zdiff format versions, "
+                      "defaults to %default",
+                 metavar='LIST')
+
+    opts, args = p.parse_args()
+
+    try:
+        policy = PatchPolicy(opts.policy.split(','), opts.k, opts.min_size)
+        versions = [int(v) for v in opts.zdiff_versions.split(',')]
+    except ValueError as e:
+        p.error(str(e))
+
+    if len(args) == 0:
+        dir_path = os.getcwd()
+    elif len(args) == 1:
+        dir_path = abspath(args[0])
+    else:
+        p.error("too many arguments")
+
+    report = bench(dir_path, policy, versions, opts.jobs, opts.verbose)
+    with open(opts.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for version, s in sorted(report['summary'].iteritems()):
+        print 'zdiff version %s: %6.1f%% of the egg sizes, ' \
+              'diff %.2fs, patch %.2fs (raw copy) %.2fs (recompress), ' \
+              'peak memory %d KB' % (
+            version, 100.0 * s['ratio'], s['diff_time'],
+            s['raw_copy_time'], s['recompress_time'],
+            s['max_memory'] // 1024)
+
+
+if __name__ == '__main__':
+    main()
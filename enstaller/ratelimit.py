@@ -0,0 +1,157 @@
+"""
+Token bucket rate limiting for downloads.
+
+A TokenBucket limits the rate (in bytes per second) within one process,
+and may be shared by several threads.  A SharedTokenBucket keeps its state
+in a file (protected by a lock), such that all enpkg processes of the user
+on the host which use the same file share a single budget.  Each process
+takes tokens from the shared file in small quanta, so processes which
+download at the same time get a fair share of the budget.  When the shared
+file cannot be used (e.g. it is a symbolic link, or owned by another user),
+the rate is limited per process instead.
+"""
+import os
+import time
+import errno
+import tempfile
+import threading
+from os.path import join
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+if fcntl is None:
+    default_shared_path = None
+else:
+    default_shared_path = join(tempfile.gettempdir(),
+                               'enstaller-bandwidth-%d' % os.getuid())
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        # the capacity of the bucket, defaults to one second worth of data
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, tokens, last):
+        now = time.time()
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        return tokens, now
+
+    def _take(self, n):
+        """
+        try to take (up to) n tokens from the bucket, and return a tuple
+        (number of tokens taken, seconds to wait before trying again)
+        """
+        with self._lock:
+            self._tokens, self._last = self._refill(self._tokens, self._last)
+            take = min(n, self._tokens)
+            if take < min(n, self.burst):
+                return 0, (min(n, self.burst) - self._tokens) / self.rate
+            self._tokens -= take
+            return take, 0
+
+    def consume(self, n):
+        """
+        block until n tokens (bytes) have been taken from the bucket
+        """
+        while n > 0:
+            take, wait = self._take(n)
+            n -= take
+            if wait:
+                time.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+
+    # the maximal number of tokens taken from the shared file at once
+    quantum = 65536
+
+    def __init__(self, rate, path=default_shared_path):
+        TokenBucket.__init__(self, rate)
+        self.path = path
+        self.quantum = int(min(self.quantum, max(1, self.rate / 10)))
+        # tokens which this process already took from the shared file
+        self._tokens = 0
+        # the per-process bucket, once the shared file cannot be used
+        self._fallback = None
+
+    def _take_shared(self, n):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT |
+                     getattr(os, 'O_NOFOLLOW', 0), 0600)
+        try:
+            if os.fstat(fd).st_uid != os.getuid():
+                raise OSError(errno.EPERM, "not owned by the user",
+                              self.path)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                tokens, last = map(float, os.read(fd, 64).split())
+            except ValueError: # empty or corrupt file, start with a full bucket
+                tokens, last = self.burst, time.time()
+            tokens, last = self._refill(tokens, last)
+            take = min(n, tokens)
+            os.lseek(fd, 0, 0)
+            os.ftruncate(fd, 0)
+            os.write(fd, '%f %f' % (tokens - take, last))
+            return take, (n - take) / self.rate
+        finally:
+            os.close(fd)
+
+    def _take(self, n):
+        if self._fallback:
+            return self._fallback._take(n)
+        with self._lock:
+            if self._tokens < n:
+                try:
+                    take, wait = self._take_shared(max(n - self._tokens,
+                                                       self.quantum))
+                except OSError as e:
+                    print ("Warning: cannot use %s (%s), limiting the rate "
+                           "per process" % (self.path, e))
+                    self._fallback = TokenBucket(self.rate)
+                    return 0, 0
+                self._tokens += take
+                if self._tokens < n and wait:
+                    return 0, wait
+            take = min(n, self._tokens)
+            self._tokens -= take
+            return take, 0
+
+
+class JoinedLimiter(object):
+
+    def __init__(self, limiters):
+        self.limiters = limiters
+
+    def consume(self, n):
+        for limiter in self.limiters:
+            limiter.consume(n)
+
+
+def create_limiter(max_rate=None, host_max_rate=None):
+    """
+    Return a limiter object (which has a consume method) for the given
+    rates (in bytes per second), or None if no rate is given.
+    The host_max_rate is shared among all processes on the host, which is
+    not supported on Windows where it is applied per process instead.
+    """
+    limiters = []
+    if max_rate:
+        limiters.append(TokenBucket(max_rate))
+    if host_max_rate:
+        if fcntl is None:
+            limiters.append(TokenBucket(host_max_rate))
+        else:
+            limiters.append(SharedTokenBucket(host_max_rate))
+    if len(limiters) == 0:
+        return None
+    if len(limiters) == 1:
+        return limiters[0]
+    return JoinedLimiter(limiters)
@@ -26,6 +26,9 @@ class AbstractStore(object):
     def get_data(self, key):
         raise NotImplementedError
 
+    def open_seekable(self, key, limiter=None):
+        raise NotImplementedError
+
     @abstractmethod
     def get_metadata(self, key, select=None):
         raise NotImplementedError
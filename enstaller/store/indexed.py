@@ -1,10 +1,15 @@
 import json
+import hashlib
 import urlparse
 import urllib2
 from collections import defaultdict
 from os.path import join
+from tempfile import SpooledTemporaryFile
+
+from enstaller.fetch import MD5Mismatch
 
 from base import AbstractStore
+from rangefile import RangeFile, RangeNotSupported
 
 
 class IndexedStore(AbstractStore):
@@ -15,9 +20,15 @@ class IndexedStore(AbstractStore):
         fp = self.get_data('index.json')
         if fp is None:
             raise Exception("Could not connect")
-        self._index = json.load(fp)
+        self.load_index(fp)
         fp.close()
 
+    def load_index(self, fp):
+        """
+        (re-)load the index of the store from the file object fp
+        """
+        self._index = json.load(fp)
+
         # maps names to keys
         self._groups = defaultdict(list)
         for key, info in self._index.iteritems():
@@ -73,6 +84,9 @@ class LocalIndexedStore(IndexedStore):
         except IOError as e:
             raise KeyError(str(e))
 
+    def open_seekable(self, key, limiter=None):
+        return self.get_data(key)
+
 
 class RemoteHTTPIndexedStore(IndexedStore):
 
@@ -86,7 +100,7 @@ class RemoteHTTPIndexedStore(IndexedStore):
         dispname = dispname.replace('/eggs/', ' ').strip('/')
         return dict(dispname=dispname)
 
-    def get_data(self, key):
+    def _request(self, key):
         url = self._location(key)
         scheme, netloc, path, params, query, frag = urlparse.urlparse(url)
         auth, host = urllib2.splituser(netloc)
@@ -104,7 +118,67 @@ class RemoteHTTPIndexedStore(IndexedStore):
         else:
             request = urllib2.Request(url)
         request.add_header('User-Agent', 'enstaller')
+        return request
+
+    def get_data(self, key):
+        request = self._request(key)
         try:
             return urllib2.urlopen(request)
         except urllib2.HTTPError as e:
-            raise KeyError("%s: %s" % (e, url))
+            raise KeyError("%s: %s" % (e, self._location(key)))
+
+    def _open_range(self, key, start, stop, limiter=None):
+        request = self._request(key)
+        request.add_header('Range', 'bytes=%d-%d' % (start, stop - 1))
+        try:
+            fi = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            raise KeyError("%s: %s" % (e, self._location(key)))
+        if fi.getcode() != 206:
+            # the server ignored the Range header and sends all the data
+            e = RangeNotSupported(self._location(key))
+            e.fi = fi
+            raise e
+        if limiter:
+            limiter.consume(stop - start)
+        return fi
+
+    def open_seekable(self, key, spool_size=16777216, limiter=None):
+        """
+        return a seekable (read-only) file object for the data of key,
+        which reads the data using HTTP Range requests.  If the server does
+        not support Range requests, the data is downloaded into a spooled
+        temporary file (which is kept in memory up to spool_size bytes),
+        and its MD5 is checked.  (When reading Range requests, the data is
+        never read as a whole, so only the CRCs of the members are checked
+        by the zipfile module.)  When a limiter (see ratelimit module) is
+        given, the download is throttled accordingly.
+        """
+        info = self.get_metadata(key)
+        size = info['size']
+        f = RangeFile(lambda start, stop: self._open_range(key, start, stop,
+                                                           limiter),
+                      size, name=key)
+        try:
+            # probe by reading the end of the data (where the central
+            # directory of zip-files is located)
+            f.seek(-min(size, 65536), 2)
+            f.read()
+        except RangeNotSupported as e:
+            f = SpooledTemporaryFile(spool_size)
+            h = hashlib.md5()
+            while True:
+                chunk = e.fi.read(65536)
+                if not chunk:
+                    break
+                f.write(chunk)
+                h.update(chunk)
+                if limiter:
+                    limiter.consume(len(chunk))
+            e.fi.close()
+            if info.get('md5') and h.hexdigest() != info['md5']:
+                f.close()
+                raise MD5Mismatch("Error: received data MD5 sums mismatch "
+                                  "for %s" % key)
+        f.seek(0)
+        return f
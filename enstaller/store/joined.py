@@ -31,6 +31,12 @@ class JoinedStore(AbstractStore):
                 return repo.get_data(key)
         raise KeyError
 
+    def open_seekable(self, key, limiter=None):
+        for repo in self.repos:
+            if repo.exists(key):
+                return repo.open_seekable(key, limiter=limiter)
+        raise KeyError
+
     def get_metadata(self, key):
         for repo in self.repos:
             if repo.exists(key):
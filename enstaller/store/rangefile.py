@@ -0,0 +1,83 @@
+"""
+A read-only, seekable file object for data which is accessed through
+HTTP Range requests.  This allows the zipfile module to read the central
+directory and the members of a remote egg, without downloading the egg
+into a local file first.  Only a bounded number of blocks is kept in
+memory.
+"""
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class RangeFile(object):
+
+    def __init__(self, open_range, size, name=None,
+                 block_size=1048576, max_blocks=8):
+        """
+        open_range(start, stop) has to return a file object for the data
+        in the byte range [start, stop), or raise RangeNotSupported
+        """
+        self.open_range = open_range
+        self.size = size
+        self.name = name
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.closed = False
+        self._pos = 0
+        self._blocks = {}
+        # indices of the blocks, least recently used first
+        self._lru = []
+
+    def _get_block(self, i):
+        if i in self._blocks:
+            # move the block to the end (most recently used)
+            self._lru.remove(i)
+            data = self._blocks[i]
+        else:
+            start = i * self.block_size
+            stop = min(start + self.block_size, self.size)
+            fi = self.open_range(start, stop)
+            data = fi.read()
+            fi.close()
+            if len(data) != stop - start:
+                raise IOError("expected %d bytes, got %d" %
+                              (stop - start, len(data)))
+            if len(self._blocks) >= self.max_blocks:
+                del self._blocks[self._lru.pop(0)]
+        self._blocks[i] = data
+        self._lru.append(i)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            self._pos = self.size + offset
+        else:
+            raise ValueError("invalid whence: %r" % whence)
+        if self._pos < 0:
+            raise IOError("negative seek position")
+
+    def tell(self):
+        return self._pos
+
+    def read(self, n=-1):
+        if n < 0 or self._pos + n > self.size:
+            n = max(0, self.size - self._pos)
+        res = []
+        while n > 0:
+            i, offset = divmod(self._pos, self.block_size)
+            chunk = self._get_block(i)[offset:offset + n]
+            res.append(chunk)
+            self._pos += len(chunk)
+            n -= len(chunk)
+        return ''.join(res)
+
+    def close(self):
+        self._blocks.clear()
+        del self._lru[:]
+        self.closed = True
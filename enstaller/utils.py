@@ -61,9 +61,13 @@ def md5_file(path):
     return h.hexdigest()
 
 
-def info_file(path):
+def info_file(path, md5cache=None):
+    """
+    Returns a dictionary with size, mtime and md5 of the file.  When an
+    MD5Cache object is given, the md5 is obtained through the cache.
+    """
     return dict(
         size=getsize(path),
         mtime=getmtime(path),
-        md5=md5_file(path),
+        md5=md5cache.get(path) if md5cache else md5_file(path),
     )
@@ -7,20 +7,222 @@ with one of the following:
   * BSDIFF4: the following data is a binary diff between SRC and DST
   * BZ: the new data of DST (bz2 compressed), SRC is ignored
   * RM: DST does not exist (it needs removed from SRC)
+  * BLKDIFF: block-wise binary diff between SRC and DST, used for members
+             larger than BLOCK_THRESHOLD, such that the memory used for
+             creating and applying the diff is bounded (see diff_blocks)
 
+Version 2 of the format (the zdiff_version in __zdiff_info__.json) adds
+the following, which are much faster to decode than BZ:
+  * ZL: the new data of DST (zlib compressed), SRC is ignored
+  * DF: <CRC> <size> (unsigned 32-bit and 64-bit little-endian integers)
+        followed by
+        the raw deflate stream of the new data of DST, which is copied into
+        the DST zip-file as is (without being decompressed at all)
+
+Files without zdiff_version are version 1.
+
+The uncompressed sizes of the changed members of DST are recorded in
+dst_sizes (in __zdiff_info__.json), such that it is known which members
+need to be patched using bounded memory, without decompressing them.
+Files created by older versions do not have dst_sizes, in which case all
+BZ, ZL and DF members are patched using bounded memory.
 """
 import bz2
 import json
+import time
+import zlib
+import struct
 import zipfile
+from cStringIO import StringIO
+from tempfile import TemporaryFile
 from logging import getLogger
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
 from os.path import basename, getmtime, getsize
 
-from utils import md5_file
+from md5cache import md5_file
 
 import bsdiff4
 
 
-def diff(src_path, dst_path, patch_path):
+# members larger than this (in bytes) are diffed block-wise
+BLOCK_THRESHOLD = 67108864
+BLOCK_SIZE = 4194304
+
+# the newest version of the .zdiff format which can be applied
+VERSION = 2
+
+
+def maybe_smaller_bz2(yinfo, diff_size):
+    """
+    return False if the bz2 compressed data of the member yinfo can (most
+    likely) not be smaller than diff_size, such that compressing the data
+    is not necessary.  bz2 is rarely better than half the size of the
+    deflate data (which we know from the zip-file).
+    """
+    if yinfo.compress_type != zipfile.ZIP_DEFLATED:
+        return True
+    return diff_size > yinfo.compress_size / 2
+
+
+def copy_chunks(fi, fo, n=-1, buffsize=1048576):
+    """
+    copy (up to n bytes, or everything) from file object fi to fo, and
+    return the CRC of the copied data
+    """
+    crc = 0
+    while n:
+        chunk = fi.read(buffsize if n < 0 else min(n, buffsize))
+        if not chunk:
+            break
+        fo.write(chunk)
+        crc = zlib.crc32(chunk, crc)
+        n -= len(chunk)
+    return crc & 0xffffffff
+
+
+def extract_tmp(z, name):
+    """
+    extract the member name of the zip-file z into a temporary file, which
+    is returned (seeked to the beginning)
+    """
+    f = TemporaryFile()
+    copy_chunks(z.open(name), f)
+    f.seek(0)
+    return f
+
+
+def diff_blocks(xf, xsize, yf, ysize, out, block_size=None):
+    """
+    Write the block-wise diff between the data in the file objects xf and
+    yf (of sizes xsize and ysize) to the file object out.  Each block of
+    the DST data is diffed against a window of the SRC data, which is
+    located around the corresponding (relative) position in SRC, and is
+    twice the size of the block.  The format is:
+
+      'BLKDIFF' <block size> <DST size>
+      (<window start> <window size> <patch size> <bsdiff4 patch>)*
+
+    where all numbers are unsigned 64-bit little-endian integers.
+    """
+    if block_size is None:
+        block_size = BLOCK_SIZE
+    out.write('BLKDIFF' + struct.pack('<QQ', block_size, ysize))
+    for pos in xrange(0, ysize, block_size):
+        yf.seek(pos)
+        ydata = yf.read(block_size)
+        center = pos * xsize // ysize
+        start = max(0, center - block_size // 2)
+        stop = min(xsize, center + block_size + block_size // 2)
+        xf.seek(start)
+        xdata = xf.read(stop - start)
+        pdata = bsdiff4.diff(xdata, ydata)
+        out.write(struct.pack('<QQQ', start, len(xdata), len(pdata)))
+        out.write(pdata)
+
+
+def patch_blocks(xf, zf):
+    """
+    Apply the block-wise diff, which is read from the file object zf, to
+    the data in the file object xf, and yield the blocks of DST data.
+    """
+    assert zf.read(7) == 'BLKDIFF'
+    block_size, ysize = struct.unpack('<QQ', zf.read(16))
+    pos = 0
+    while pos < ysize:
+        start, xlen, plen = struct.unpack('<QQQ', zf.read(24))
+        xf.seek(start)
+        ydata = bsdiff4.patch(xf.read(xlen), zf.read(plen))
+        pos += len(ydata)
+        yield ydata
+
+
+def write_stored(z, name, f):
+    """
+    write the data of the (temporary) file f as member name into the
+    (uncompressed) zip-file z, without reading all the data into memory
+    """
+    size = f.tell()
+    f.seek(0)
+    crc = 0
+    for chunk in iter(lambda: f.read(1048576), ''):
+        crc = zlib.crc32(chunk, crc)
+    crc &= 0xffffffff
+    f.seek(0)
+    zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    zinfo.external_attr = 0600 << 16
+    zinfo.compress_type = zipfile.ZIP_STORED
+    zinfo.file_size = zinfo.compress_size = size
+    zinfo.CRC = crc
+    write_raw(z, zinfo, f)
+
+
+def is_raw_deflated(zinfo):
+    return (zinfo.compress_type == zipfile.ZIP_DEFLATED and
+            not zinfo.flag_bits & 0x01)
+
+
+def replacement(y, name, ydata, version):
+    """
+    return the patch data which replaces the member name by its data
+    ydata in the zip-file y (DST), for the given version of the format
+    """
+    if version == 1:
+        return bz2.compress(ydata) # startswith BZ
+    yinfo = y.getinfo(name)
+    if is_raw_deflated(yinfo):
+        return ('DF' + struct.pack('<IQ', yinfo.CRC, yinfo.file_size) +
+                seek_raw(y, name).read(yinfo.compress_size))
+    return 'ZL' + zlib.compress(ydata)
+
+
+def diff_large(x, y, z, name, version):
+    """
+    diff the (large) member name, of which at least one version exceeds
+    BLOCK_THRESHOLD, using bounded memory
+    """
+    if name not in y.NameToInfo:
+        z.writestr(name, 'RM')
+        return
+    yinfo = y.getinfo(name)
+    f = TemporaryFile()
+    if name in x.NameToInfo:
+        xf = extract_tmp(x, name)
+        yf = extract_tmp(y, name)
+        diff_blocks(xf, x.getinfo(name).file_size, yf, yinfo.file_size, f)
+        xf.close()
+        yf.close()
+    elif version > 1 and is_raw_deflated(yinfo):
+        f.write('DF' + struct.pack('<IQ', yinfo.CRC, yinfo.file_size))
+        copy_chunks(seek_raw(y, name), f, yinfo.compress_size)
+    else:
+        if version == 1:
+            comp = bz2.BZ2Compressor() # startswith BZ
+        else:
+            f.write('ZL')
+            comp = zlib.compressobj()
+        yf = y.open(name)
+        while True:
+            chunk = yf.read(1048576)
+            if not chunk:
+                break
+            f.write(comp.compress(chunk))
+        f.write(comp.flush())
+    write_stored(z, name, f)
+    f.close()
+
+
+def diff(src_path, dst_path, patch_path, version=1, md5s=None):
+    """
+    Create the .zdiff patch_path, which patches the zip-file src_path into
+    the zip-file dst_path, and return the number of changed members.
+    The version of the format defaults to 1, which can be applied by all
+    clients, whereas version 2 requires clients which know about it.
+    The optional dictionary md5s maps paths to their (known) MD5 sums,
+    other MD5 sums are taken from the cache in the directory of the eggs.
+    """
+    if version not in (1, 2):
+        raise ValueError("invalid zdiff version: %r" % version)
     x = zipfile.ZipFile(src_path)
     y = zipfile.ZipFile(dst_path)
     z = zipfile.ZipFile(patch_path, 'w', zipfile.ZIP_STORED)
@@ -29,38 +231,59 @@ def diff(src_path, dst_path, patch_path):
     ynames = set(y.namelist())
 
     count = 0
+    # uncompressed sizes of the changed (not removed) members of DST
+    sizes = {}
     for name in xnames | ynames:
+        if name in xnames and name in ynames:
+            # members with the same CRC and size (in the central directory)
+            # are considered unchanged, without decompressing them
+            xinfo, yinfo = x.getinfo(name), y.getinfo(name)
+            if (xinfo.CRC == yinfo.CRC and
+                    xinfo.file_size == yinfo.file_size):
+                continue
+
+        if max(zinfo.file_size for zinfo in (x.NameToInfo.get(name),
+                                             y.NameToInfo.get(name))
+               if zinfo) > BLOCK_THRESHOLD:
+            diff_large(x, y, z, name, version)
+            if name in ynames:
+                sizes[name] = y.getinfo(name).file_size
+            count += 1
+            continue
+
         xdata = x.read(name) if name in xnames else None
         ydata = y.read(name) if name in ynames else None
         if xdata == ydata:
             continue
 
-        if ydata is not None:
-            bz2_data = bz2.compress(ydata) # startswith BZ
-
         if xdata is not None and ydata is not None:
-            diff_data = bsdiff4.diff(xdata, ydata)
-            if len(diff_data) < len(bz2_data):
-                zdata = diff_data # startswith BSDIFF4
+            diff_data = bsdiff4.diff(xdata, ydata) # startswith BSDIFF4
+            if version > 1 or maybe_smaller_bz2(y.getinfo(name),
+                                                len(diff_data)):
+                zdata = min(diff_data, replacement(y, name, ydata, version),
+                            key=len)
             else:
-                zdata = bz2_data
+                zdata = diff_data
         elif xdata is not None and ydata is None:
             zdata = 'RM'
         elif ydata is not None and xdata is None:
-            zdata = bz2_data
+            zdata = replacement(y, name, ydata, version)
         else:
             raise Exception("Hmm, didn't expect to get here.")
 
         #print zdata[:2], name
         z.writestr(name, zdata)
+        if ydata is not None:
+            sizes[name] = len(ydata)
         count += 1
 
-    info = {}
+    info = {'zdiff_version': version, 'dst_sizes': sizes}
     for path, pre in (src_path, 'src'), (dst_path, 'dst'):
         info.update({pre: basename(path),
                      pre + '_size': getsize(path),
                      pre + '_mtime': getmtime(path),
-                     pre + '_md5': md5_file(path)})
+                     pre + '_md5': (md5s or {}).get(path) or
+                                    md5_file(path)})
     z.writestr('__zdiff_info__.json',
                json.dumps(info, indent=2, sort_keys=True))
     z.close()
@@ -69,10 +292,232 @@ def diff(src_path, dst_path, patch_path):
     return count
 
 
-def patch(src_path, dst_path, patch_path):
+def write_raw(y, zinfo, fi):
+    """
+    Write the member zinfo, whose (already compressed) data is read from
+    the file object fi, into the zip-file y (opened for writing).
+    The CRC and sizes of zinfo have to be set already.
+    """
+    zinfo.flag_bits &= ~0x08 # CRC and sizes are written in the header
+    zinfo.extra = ''
+    zinfo.header_offset = y.fp.tell()
+    y._writecheck(zinfo)
+    y._didModify = True
+    y.fp.write(zinfo.FileHeader(zinfo.file_size > zipfile.ZIP64_LIMIT or
+                                zinfo.compress_size > zipfile.ZIP64_LIMIT))
+    n = zinfo.compress_size
+    while n > 0:
+        chunk = fi.read(min(n, 1048576))
+        if not chunk:
+            raise IOError("unexpected end of data: %r" % zinfo.filename)
+        y.fp.write(chunk)
+        n -= len(chunk)
+    y.filelist.append(zinfo)
+    y.NameToInfo[zinfo.filename] = zinfo
+
+
+def seek_raw(x, name):
+    """
+    seek the file object of the zip-file x to the (compressed) data of the
+    member name, and return the file object
+    """
+    x.fp.seek(x.getinfo(name).header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader,
+                            x.fp.read(zipfile.sizeFileHeader))
+    x.fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] +
+              fheader[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    return x.fp
+
+
+def copy_raw(x, y, name):
+    """
+    Copy the member name from zip-file x into zip-file y, without
+    decompressing (and recompressing) the data.
+    """
+    xinfo = x.getinfo(name)
+    if xinfo.flag_bits & 0x01: # encrypted
+        y.writestr(xinfo, x.read(name))
+        return
+    seek_raw(x, name)
+
+    yinfo = zipfile.ZipInfo(name, xinfo.date_time)
+    for attr in ('compress_type', 'comment', 'create_system',
+                 'create_version', 'extract_version', 'flag_bits',
+                 'internal_attr', 'external_attr',
+                 'CRC', 'compress_size', 'file_size'):
+        setattr(yinfo, attr, getattr(xinfo, attr))
+    write_raw(y, yinfo, x.fp)
+
+
+def new_zinfo(name):
+    zinfo = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.external_attr = 0600 << 16
+    return zinfo
+
+
+def deflate_member(name, data):
+    """
+    return a tuple(zinfo, compressed data) for the new member name
+    """
+    zinfo = new_zinfo(name)
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data) & 0xffffffff
+    co = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    data = co.compress(data) + co.flush()
+    zinfo.compress_size = len(data)
+    return zinfo, data
+
+
+def write_deflated(y, name, chunks):
+    """
+    write the data, given by the iterable of chunks, as the (deflated)
+    member name into the zip-file y, using bounded memory
+    """
+    zinfo = new_zinfo(name)
+    f = TemporaryFile()
+    co = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    size = crc = 0
+    for chunk in chunks:
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+        f.write(co.compress(chunk))
+    f.write(co.flush())
+    zinfo.file_size = size
+    zinfo.CRC = crc & 0xffffffff
+    zinfo.compress_size = f.tell()
+    f.seek(0)
+    write_raw(y, zinfo, f)
+    f.close()
+
+
+def df_zinfo(name, header, compress_size):
+    """
+    return the zinfo of the member name, whose raw deflate stream (of
+    size compress_size) follows the DF header
+    """
+    zinfo = new_zinfo(name)
+    zinfo.CRC, zinfo.file_size = struct.unpack('<IQ', header[2:14])
+    zinfo.compress_size = compress_size
+    return zinfo
+
+
+def patch_large(x, y, z, name):
+    """
+    apply the patch for the member name, which is either a block-wise
+    diff or large (compressed) data, using bounded memory
+    """
+    zf = z.open(name)
+    head = zf.read(14)
+    if head.startswith('BLKDIFF'):
+        zf = z.open(name)
+        xf = extract_tmp(x, name)
+        write_deflated(y, name, patch_blocks(xf, zf))
+        xf.close()
+    elif head.startswith('DF'):
+        write_raw(y, df_zinfo(name, head, z.getinfo(name).file_size - 14),
+                  zf)
+    else:
+        write_deflated(y, name, decompress_chunks(z, name))
+
+
+def decompress_chunks(z, name):
+    """
+    yield the chunks of the new data of the BZ, ZL or DF member name (of
+    the .zdiff z), using bounded memory
+    """
+    zf = z.open(name)
+    head = zf.read(2)
+    if head == 'ZL':
+        decomp = zlib.decompressobj()
+    elif head == 'DF':
+        zf.read(12)
+        decomp = zlib.decompressobj(-15)
+    else:
+        zf = z.open(name)
+        decomp = bz2.BZ2Decompressor()
+    for chunk in iter(lambda: zf.read(1048576), ''):
+        yield decomp.decompress(chunk)
+    if head != 'BZ':
+        yield decomp.flush()
+
+
+def is_large(z, name, sizes=None):
+    """
+    return True if the patch of the member name (in the .zdiff z) needs
+    to be applied using patch_large, sizes are the uncompressed sizes of
+    the members of DST (None for patches which do not record them)
+    """
+    head = z.open(name).read(7)
+    if head == 'BLKDIFF':
+        return True
+    if head[:2] not in ('BZ', 'ZL', 'DF'):
+        return False
+    if sizes is None:
+        return True
+    return sizes.get(name, 0) > BLOCK_THRESHOLD
+
+
+def patch_data(xdata, zdata):
+    """
+    apply the patch data zdata to xdata (the data of the member in the
+    source egg, or None), and return the new data (or None, if the member
+    is removed)
+    """
+    if zdata.startswith('BSDIFF4'):
+        return bsdiff4.patch(xdata, zdata)
+    elif zdata.startswith('BZ'):
+        return bz2.decompress(zdata)
+    elif zdata.startswith('ZL'):
+        return zlib.decompress(zdata[2:])
+    elif zdata.startswith('DF'):
+        return zlib.decompress(zdata[14:], -15)
+    elif zdata.startswith('RM'):
+        return None
+    raise Exception("Hmm, didn't expect to get here: %r" % zdata[:16])
+
+
+def patch_member(name, xdata, zdata):
+    """
+    apply the patch data zdata to xdata (the data of the member name in
+    the source egg, or None), and return the tuple(zinfo, compressed data)
+    of the new member (or None, if the member is removed)
+    """
+    if zdata.startswith('DF'):
+        return df_zinfo(name, zdata, len(zdata) - 14), zdata[14:]
+    ydata = patch_data(xdata, zdata)
+    if ydata is None:
+        return None
+    return deflate_member(name, ydata)
+
+
+def open_zdiff(patch_path):
+    """
+    open the .zdiff patch_path, and make sure its version can be applied,
+    return the tuple(zip-file, info)
+    """
+    z = zipfile.ZipFile(patch_path)
+    info = json.loads(z.read('__zdiff_info__.json'))
+    version = info.get('zdiff_version', 1)
+    if version > VERSION:
+        z.close()
+        raise Exception("cannot apply zdiff version %r: %r" %
+                        (version, patch_path))
+    return z, info
+
+
+def patch(src_path, dst_path, patch_path, raw_copy=True, workers=None):
+    """
+    Create the zip-file dst_path by applying the .zdiff patch_path to the
+    zip-file src_path.  Unless raw_copy is False, unchanged members are
+    copied without being decompressed and recompressed.  The patched
+    members are computed using a pool of worker threads (defaults to the
+    number of CPUs).
+    """
+    z, info = open_zdiff(patch_path)
+    sizes = info.get('dst_sizes')
     x = zipfile.ZipFile(src_path)
     y = zipfile.ZipFile(dst_path, 'w', zipfile.ZIP_DEFLATED)
-    z = zipfile.ZipFile(patch_path)
 
     xnames = x.namelist()
     znames = set(z.namelist())
@@ -87,25 +532,59 @@ def patch(src_path, dst_path, patch_path):
 
     for name in xnames:
         if name not in znames:
-             y.writestr(x.getinfo(name), x.read(name))
+            if raw_copy:
+                copy_raw(x, y, name)
+            else:
+                y.writestr(x.getinfo(name), x.read(name))
         n += 1
         getLogger('progress.update').info(n)
 
+    if workers is None:
+        workers = cpu_count()
+
+    # the members are patched in batches, such that the memory used is
+    # bounded by the size of a few members (per worker), large members
+    # are patched one at a time using bounded memory
+    batches = [[]]
     for name in z.namelist():
         if name == '__zdiff_info__.json':
             continue
-        zdata = z.read(name)
-        if zdata.startswith('BSDIFF4'):
-            ydata = bsdiff4.patch(x.read(name), zdata)
-        elif zdata.startswith('BZ'):
-            ydata = bz2.decompress(zdata)
-        elif zdata.startswith('RM'):
-            continue
+        if is_large(z, name, sizes):
+            batches.extend([name, []])
         else:
-            raise Exception("Hmm, didn't expect to get here: %r" % zdata)
+            batches[-1].append(name)
+            if len(batches[-1]) == 2 * workers:
+                batches.append([])
 
-        y.writestr(name, ydata)
-        getLogger('progress.update').info(n)
+    pool = ThreadPool(workers) if workers > 1 else None
+    try:
+        for batch in batches:
+            if isinstance(batch, basestring):
+                patch_large(x, y, z, batch)
+                n += 1
+                getLogger('progress.update').info(n)
+                continue
+            args = []
+            for name in batch:
+                zdata = z.read(name)
+                xdata = x.read(name) if zdata.startswith('BSDIFF4') else None
+                args.append((name, xdata, zdata))
+            if pool:
+                results = pool.map(lambda a: patch_member(*a), args)
+            else:
+                results = [patch_member(*a) for a in args]
+            for res in results:
+                n += 1
+                getLogger('progress.update').info(n)
+                if res is None:
+                    continue
+                zinfo, data = res
+                write_raw(y, zinfo, StringIO(data))
+    finally:
+        # the worker threads are also stopped when patching fails
+        if pool:
+            pool.close()
+            pool.join()
 
     getLogger('progress.stop').info(None)
 
@@ -114,6 +593,108 @@ def patch(src_path, dst_path, patch_path):
     x.close()
 
 
+class PatchedZip(object):
+    """
+    A read-only, zip-file like view of the zip-file DST, given by the
+    zip-file SRC and the .zdiff from SRC to DST, without creating DST.
+    Unchanged members are read from SRC, and only the changed members are
+    patched (when they are read).
+    """
+    def __init__(self, src_path, patch_path):
+        self.x = zipfile.ZipFile(src_path)
+        self.z, info = open_zdiff(patch_path)
+        self.sizes = info.get('dst_sizes')
+        self.changed = set()
+        removed = set()
+        for name in self.z.namelist():
+            if name == '__zdiff_info__.json':
+                continue
+            if self.z.open(name).read(2) == 'RM':
+                removed.add(name)
+            else:
+                self.changed.add(name)
+        self.names = [name for name in self.x.namelist()
+                      if name not in removed]
+        self.names.extend(name for name in self.z.namelist()
+                          if name in self.changed and
+                             name not in self.x.NameToInfo)
+        self._names = set(self.names)
+
+    def namelist(self):
+        return list(self.names)
+
+    def unchanged(self):
+        """
+        return the list of members which are the same in SRC and DST
+        """
+        return [name for name in self.names if name not in self.changed]
+
+    def _size(self, name):
+        if self.sizes is not None and name in self.sizes:
+            return self.sizes[name]
+        head = self.z.open(name).read(32)
+        if head.startswith('BSDIFF4'):
+            # the offtin encoded size of DST in the bsdiff4 header
+            return struct.unpack('<Q', head[24:32])[0] & ~(1 << 63)
+        if head.startswith('BLKDIFF'):
+            return struct.unpack('<QQ', head[7:23])[1]
+        if head.startswith('DF'):
+            return struct.unpack('<IQ', head[2:14])[1]
+        return sum(len(chunk) for chunk in decompress_chunks(self.z, name))
+
+    def getinfo(self, name):
+        if name not in self.changed:
+            return self.x.getinfo(name)
+        zinfo = new_zinfo(name)
+        zinfo.file_size = self._size(name)
+        return zinfo
+
+    def read(self, name):
+        if name not in self._names:
+            raise KeyError("There is no item named %r in the archive" %
+                           name)
+        if name not in self.changed:
+            return self.x.read(name)
+        head = self.z.open(name).read(7)
+        if head == 'BLKDIFF':
+            xf = extract_tmp(self.x, name)
+            data = ''.join(patch_blocks(xf, self.z.open(name)))
+            xf.close()
+            return data
+        if head[:2] in ('BZ', 'ZL', 'DF'):
+            return ''.join(decompress_chunks(self.z, name))
+        zdata = self.z.read(name)
+        xdata = self.x.read(name) if zdata.startswith('BSDIFF4') else None
+        return patch_data(xdata, zdata)
+
+    def open(self, name):
+        """
+        return a file object for reading the member name, large members
+        are patched into a temporary file (using bounded memory)
+        """
+        if name in self._names and name not in self.changed:
+            return self.x.open(name)
+        if name in self.changed and is_large(self.z, name, self.sizes):
+            f = TemporaryFile()
+            if self.z.open(name).read(7) == 'BLKDIFF':
+                xf = extract_tmp(self.x, name)
+                chunks = patch_blocks(xf, self.z.open(name))
+            else:
+                xf = None
+                chunks = decompress_chunks(self.z, name)
+            for data in chunks:
+                f.write(data)
+            if xf:
+                xf.close()
+            f.seek(0)
+            return f
+        return StringIO(self.read(name))
+
+    def close(self):
+        self.z.close()
+        self.x.close()
+
+
 def info(patch_path):
     z = zipfile.ZipFile(patch_path)
     data = z.read('__zdiff_info__.json')
@@ -35,6 +35,8 @@ setup(
              "enpkg = enstaller.main:main",
              "egginst = egginst.main:main",
              "update-patches = enstaller.patch:main",
+             "enpkg-cache = enstaller.cacheserver:main",
+             "patchbench = enstaller.patchbench:main",
         ],
     },
     classifiers = [
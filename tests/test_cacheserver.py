@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import urllib
+from os.path import join
+
+from enstaller.cacheserver import SingleFlight, RepoCache, key_pat
+
+
+class TestCacheServer(unittest.TestCase):
+
+    def test_single_flight(self):
+        flight = SingleFlight()
+        calls = []
+        def func():
+            calls.append(1)
+            time.sleep(0.1)
+        threads = [threading.Thread(target=flight.do, args=('a', func))
+                   for i in xrange(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        # once the call finished, the next one goes through
+        flight.do('a', func)
+        self.assertEqual(len(calls), 2)
+
+    def test_key_pat(self):
+        for path, key in [
+            ('/numpy-1.6.1-1.egg', 'numpy-1.6.1-1.egg'),
+            ('/patches/nose-1.0.0-1--1.1.2-1.zdiff',
+             'nose-1.0.0-1--1.1.2-1.zdiff'),
+            ('/../etc/passwd', None),
+            ('/foo/numpy-1.6.1-1.egg', None),
+            ]:
+            m = key_pat.match(path)
+            self.assertEqual(m and m.group(2), key)
+
+
+class TestRepoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.remote_dir = join(self.dir, 'remote')
+        os.mkdir(self.remote_dir)
+        index = {}
+        for fn, data in [('a-1.0-1.egg', 'a' * 1000),
+                         ('b-1.0-1.egg', 'b' * 1000)]:
+            with open(join(self.remote_dir, fn), 'wb') as fo:
+                fo.write(data)
+            index[fn] = dict(name=fn.split('-')[0], size=len(data),
+                             md5=hashlib.md5(data).hexdigest())
+        with open(join(self.remote_dir, 'index.json'), 'w') as fo:
+            json.dump(index, fo)
+        self.cache_dir = join(self.dir, 'cache')
+        self.cache = RepoCache(
+            'file:' + urllib.pathname2url(self.remote_dir) + '/',
+            self.cache_dir, max_size=1500)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get(self):
+        fi = self.cache.get('a-1.0-1.egg')
+        self.assertEqual(fi.read(), 'a' * 1000)
+        fi.close()
+        self.assertEqual(self.cache.get('c-1.0-1.egg'), None)
+        fi = self.cache.get('index.json')
+        self.assert_('a-1.0-1.egg' in json.load(fi))
+        fi.close()
+        # no temporary files are left behind
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ['a-1.0-1.egg', 'index.json'])
+
+    def test_index_refetched(self):
+        keys = []
+        get_data = self.cache.remote.get_data
+        def counting_get_data(key):
+            keys.append(key)
+            return get_data(key)
+        self.cache.remote.get_data = counting_get_data
+        self.cache.ttl = 0
+        index_path = join(self.remote_dir, 'index.json')
+        index = json.load(open(index_path))
+        index['c-1.0-1.egg'] = dict(name='c', size=0, md5=None)
+        with open(index_path, 'w') as fo:
+            json.dump(index, fo)
+        fi = self.cache.get('index.json')
+        fi.close()
+        # the expired index is fetched once, and the remote index is
+        # refreshed from it
+        self.assertEqual(keys, ['index.json'])
+        self.assert_(self.cache.remote.exists('c-1.0-1.egg'))
+
+    def test_evicted(self):
+        fa = self.cache.get('a-1.0-1.egg')
+        # fetching b evicts a, which is still open
+        fb = self.cache.get('b-1.0-1.egg')
+        self.assertEqual(os.listdir(self.cache_dir), ['b-1.0-1.egg'])
+        self.assertEqual(fa.read(), 'a' * 1000)
+        self.assertEqual(fb.read(), 'b' * 1000)
+        fa.close()
+        fb.close()
+        # a is fetched again
+        fa = self.cache.get('a-1.0-1.egg')
+        self.assertEqual(fa.read(), 'a' * 1000)
+        fa.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
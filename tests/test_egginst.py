@@ -0,0 +1,490 @@
+import os
+import sys
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+from os.path import isdir, isfile, join
+
+from egginst import hookrunner, linkcache, manifest, prefixdb, remover
+from egginst.main import EggInst, get_installed, read_meta, remove_packages
+from egginst.utils import rel_site_packages
+
+
+def create_egg(path, files):
+    z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    for name in sorted(files):
+        z.writestr(name, files[name])
+    z.close()
+
+
+class TestExtract(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = join(self.dir, 'prefix')
+        self.path = join(self.dir, 'bar-1.0-1.egg')
+        self.files = dict(('bar/sub%d/mod%d.py' % (i % 7, i), 'x = %d\n' % i)
+                          for i in xrange(200))
+        self.files['EGG-INFO/usr/bin/bar'] = '#!/bin/sh\n'
+        create_egg(self.path, self.files)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_parallel(self):
+        for workers in 1, 4:
+            ei = EggInst(self.path, self.prefix)
+            ei.workers = workers
+            ei.install()
+            site_packages = join(self.prefix, rel_site_packages)
+            for name, data in self.files.iteritems():
+                if name.startswith('bar/'):
+                    self.assertEqual(open(join(site_packages, name)).read(),
+                                     data)
+            self.assert_(os.access(join(self.prefix, 'bin', 'bar'),
+                                   os.X_OK))
+            self.assertEqual(len(ei.arcinfo), 201)
+            ei.remove()
+
+    def test_compile(self):
+        ei = EggInst(self.path, self.prefix)
+        ei.workers = 2
+        ei.compile = True
+        ei.install()
+        pyc = join(self.prefix, rel_site_packages, 'bar', 'sub3', 'mod3.pyc')
+        self.assert_(isfile(pyc))
+        d = read_meta(join(self.prefix, 'EGG-INFO', 'bar'))
+        self.assertEqual(sum(p.endswith('.pyc') for p in d['files']), 200)
+        ei.remove()
+        self.assertFalse(isfile(pyc))
+
+    def test_namespace(self):
+        ns = "__import__('pkg_resources').declare_namespace(__name__)\n"
+        create_egg(self.path, {'ns/__init__.py': ns,
+                               'ns/__init__.pyc': 'pyc',
+                               'big/__init__.py': ns + 10000 * ' '})
+        EggInst(self.path, self.prefix).install()
+        site_packages = join(self.prefix, rel_site_packages)
+        self.assertEqual(open(join(site_packages, 'ns', '__init__.py'))
+                         .read(), '')
+        self.assertFalse(isfile(join(site_packages, 'ns', '__init__.pyc')))
+        self.assertEqual(os.path.getsize(join(site_packages, 'big',
+                                              '__init__.py')), len(ns) + 10000)
+
+
+class TestRemove(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = join(self.dir, 'prefix')
+        self.site_packages = join(self.prefix, rel_site_packages)
+        self.paths = []
+        for name in 'bar', 'baz':
+            path = join(self.dir, '%s-1.0-1.egg' % name)
+            create_egg(path, dict(('%s/sub%d/mod.py' % (name, i), '')
+                                  for i in xrange(300)))
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_remove_packages(self):
+        for path in self.paths:
+            EggInst(path, self.prefix).install()
+        # a file which was not installed by egginst
+        open(join(self.site_packages, 'baz', 'sub7', 'foreign'), 'w').close()
+        remove_packages([EggInst(path, self.prefix) for path in self.paths])
+        self.assertEqual(os.listdir(self.site_packages), ['baz'])
+        self.assertEqual(os.listdir(join(self.site_packages, 'baz')),
+                         ['sub7'])
+        self.assertFalse(isdir(join(self.prefix, 'EGG-INFO')))
+
+    def test_dir_trie(self):
+        self.assertEqual(remover.dir_trie(['/a/b/c/x', '/a/b/./y', '/a/z',
+                                           '/q/r', '/a/b/d/w'], '/a'),
+                         {'b': {'c': {}, 'd': {}}})
+
+
+@unittest.skipIf(not linkcache.supported(), "hardlinks not supported")
+class TestLinkCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = join(self.dir, 'cache')
+        self.path = join(self.dir, 'bar-1.0-1.egg')
+        self.so = '\x7fELF' + 30 * '/PLACEHOLD' + '\0' + 100 * 'x'
+        create_egg(self.path, {'bar/__init__.py': 'x = 1\n',
+                               'EGG-INFO/usr/lib/libbar.so': self.so})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_link(self):
+        for i in 1, 2:
+            ei = EggInst(self.path, join(self.dir, 'prefix%d' % i))
+            ei.link_cache = self.cache
+            ei.install()
+        prefix = join(self.dir, 'prefix2')
+        init = join(prefix, rel_site_packages, 'bar', '__init__.py')
+        so = join(prefix, 'lib', 'libbar.so')
+        # linked from the cache, and into both prefixes
+        self.assertEqual(os.stat(init).st_nlink, 3)
+        # copied, as the placeholder is fixed per prefix
+        self.assertEqual(os.stat(so).st_nlink, 1)
+        self.assert_('/PLACEHOLD' not in open(so, 'rb').read())
+        d = read_meta(join(prefix, 'EGG-INFO', 'bar'))
+        self.assertEqual(d['hardlinks'],
+                         ['./lib/python%d.%d/site-packages/bar/__init__.py' %
+                          sys.version_info[:2]])
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+
+    def test_cache_unchanged(self):
+        script = '#!/usr/bin/python\nprint 1\n'
+        create_egg(self.path, {'bar/__init__.py': 'x = 1\n',
+                               'EGG-INFO/prefix/bin/bar': script,
+                               'EGG-INFO/usr/lib/libbar.so': 'ELF'})
+        prefixes = [join(self.dir, 'prefix%d' % i) for i in 1, 2]
+        for prefix in prefixes:
+            ei = EggInst(self.path, prefix)
+            ei.link_cache = self.cache
+            ei.install()
+        cache_dir = join(self.cache, os.listdir(self.cache)[0])
+        bar = join(prefixes[0], 'bin', 'bar')
+        self.assertEqual(os.stat(bar).st_nlink, 1)
+        self.assertEqual(open(bar).read(), '#!%s\nprint 1\n' %
+                         sys.executable)
+        cached = join(cache_dir, 'EGG-INFO', 'prefix', 'bin', 'bar')
+        self.assertEqual(open(cached).read(), script)
+        # the library (without placeholders) is linked, and was made
+        # executable in the cache
+        so = join(cache_dir, 'EGG-INFO', 'usr', 'lib', 'libbar.so')
+        self.assertEqual(os.stat(so).st_mode & 0777, 0755)
+        self.assertEqual(os.stat(join(prefixes[0], 'lib',
+                                      'libbar.so')).st_nlink, 3)
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), "fork not supported")
+class TestHookRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.runner = hookrunner.HookRunner()
+
+    def tearDown(self):
+        self.runner.close()
+        shutil.rmtree(self.dir)
+
+    def run_script(self, code):
+        path = join(self.dir, 'hook.py')
+        with open(path, 'w') as fo:
+            fo.write(code)
+        return self.runner.run(path, ['--prefix', '/foo'], self.dir)
+
+    def test_run(self):
+        out = join(self.dir, 'out')
+        self.assertEqual(self.run_script(
+                "import os, sys\n"
+                "open('out', 'w').write('%s %s' % (os.getcwd(), sys.argv))\n"
+                "x = 1\n"), 0)
+        self.assertEqual(open(out).read(),
+                         "%s ['%s', '--prefix', '/foo']" %
+                         (self.dir, join(self.dir, 'hook.py')))
+        # the global state of a previous script is not visible
+        self.assertEqual(self.run_script(
+                "import sys\n"
+                "sys.modules['hookrunner_test'] = 1\n"
+                "x\n"), 1)
+        self.assertEqual(self.run_script(
+                "import sys\n"
+                "sys.exit(3 if 'hookrunner_test' in sys.modules else 0)\n"),
+                0)
+
+    def test_exit_codes(self):
+        self.assertEqual(self.run_script("import sys; sys.exit(5)\n"), 5)
+        self.assertEqual(self.run_script("import sys; sys.exit()\n"), 0)
+        self.assertEqual(self.run_script("import os; os._exit(7)\n"), 7)
+
+    @unittest.skipIf(sys.stdin.closed, "no stdin")
+    def test_stdin(self):
+        # the script uses our stdin (not the requests pipe)
+        st = os.fstat(0)
+        self.assertEqual(self.run_script(
+                "import os, sys\n"
+                "st = os.fstat(0)\n"
+                "sys.exit(0 if (st.st_dev, st.st_ino) == (%d, %d) else 1)\n"
+                % (st.st_dev, st.st_ino)), 0)
+
+    def test_worker_exits(self):
+        # the worker exits while running the script, which is not run again
+        path = join(self.dir, 'hook.py')
+        with open(path, 'w') as fo:
+            fo.write("import os, signal\n"
+                     "open('count', 'a').write('x')\n"
+                     "os.kill(os.getppid(), signal.SIGKILL)\n")
+        self.assertEqual(hookrunner.run(path, self.dir), 1)
+        self.assertEqual(open(join(self.dir, 'count')).read(), 'x')
+        self.assert_(self.dir not in hookrunner._runners)
+
+
+class TestManifest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        files = ['./lib/libbar.so', u'./lib/python/caf\xe9.py', '/abs/x',
+                 './lib/python/bar/__init__.py', './lib/python/bar/a.py']
+        arcinfo = {'bar/__init__.py': [0, 0],
+                   'bar/a.py': [5 * 2 ** 32, 2 ** 32 - 1]}
+        d = manifest.loads(manifest.dumps(files, ['./lib/libbar.so'],
+                                          arcinfo, dict(egg_name='bar.egg')))
+        self.assertEqual(d['files'], sorted(files))
+        self.assertEqual(d['hardlinks'], ['./lib/libbar.so'])
+        self.assertEqual(d['arcinfo'], arcinfo)
+        self.assertEqual(d['egg_name'], 'bar.egg')
+
+    def test_empty(self):
+        self.assertEqual(manifest.loads(manifest.dumps([], [], {})),
+                         dict(files=[], hardlinks=[], arcinfo={}))
+
+    def test_meta(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = join(tmp_dir, 'bar-1.0-1.egg')
+            create_egg(path, {'bar/__init__.py': ''})
+            prefix = join(tmp_dir, 'prefix')
+            EggInst(path, prefix).install()
+            meta_dir = join(prefix, 'EGG-INFO', 'bar')
+            d = read_meta(meta_dir)
+            self.assertEqual(d['arcinfo'], {'bar/__init__.py': [0, 0]})
+            self.assertEqual(len(d['files']), 3)
+            self.assertEqual(read_meta(meta_dir, files=False),
+                             dict(egg_name='bar-1.0-1.egg', prefix=prefix,
+                                  installed_size=0))
+            # older versions only read the file list from egginst.json
+            meta_json = join(meta_dir, 'egginst.json')
+            old = json.load(open(meta_json))
+            self.assertEqual(sorted(old['files']), d['files'])
+            # which is not read when the manifest is not older
+            st = os.stat(meta_json)
+            json.dump(dict(old, files=[]), open(meta_json, 'w'))
+            os.utime(meta_json, (st.st_atime, st.st_mtime))
+            self.assertEqual(read_meta(meta_dir), d)
+            # the package was reinstalled by an older version
+            os.utime(meta_json, (st.st_atime, st.st_mtime + 10))
+            self.assertEqual(read_meta(meta_dir)['files'], [])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+DEPEND = """\
+metadata_version = '1.1'
+name = %r
+version = '1.0'
+build = 1
+
+arch = None
+platform = None
+osdist = None
+python = None
+packages = []
+"""
+
+
+class TestPrefixDB(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = join(self.dir, 'prefix')
+        self.paths = []
+        for name in 'bar', 'baz':
+            path = join(self.dir, '%s-1.0-1.egg' % name)
+            create_egg(path, {'%s/__init__.py' % name: '',
+                              'EGG-INFO/spec/depend': DEPEND % name})
+            EggInst(path, self.prefix).install()
+            self.paths.append(path)
+        self.db = prefixdb.PrefixDB(self.prefix)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.dir)
+
+    def test_query(self):
+        self.assert_(isfile(self.db.path))
+        self.assertEqual(list(get_installed(self.prefix)),
+                         ['bar-1.0-1.egg', 'baz-1.0-1.egg'])
+        info, = self.db.query(False, name='baz')
+        self.assertEqual(info['key'], 'baz-1.0-1.egg')
+        self.assertEqual(info['meta_dir'],
+                         join(self.prefix, 'EGG-INFO', 'baz'))
+        self.assertEqual(list(self.db.query(True)), [])
+        self.assertEqual(self.db.owners(join(self.prefix, rel_site_packages,
+                                             'bar', '__init__.py')),
+                         ['bar-1.0-1.egg'])
+
+    def test_remove(self):
+        EggInst(self.paths[0], self.prefix).remove()
+        self.assertEqual(list(get_installed(self.prefix)), ['baz-1.0-1.egg'])
+        self.assertEqual(list(self.db.query(False, name='bar')), [])
+
+    def test_rebuild(self):
+        # a package removed without updating the database
+        shutil.rmtree(join(self.prefix, 'EGG-INFO', 'bar'))
+        self.assertEqual(list(get_installed(self.prefix)), ['baz-1.0-1.egg'])
+        os.unlink(self.db.path)
+        self.assertEqual([info['key'] for info in self.db.query(False)],
+                         ['baz-1.0-1.egg'])
+
+    def test_collection(self):
+        from enstaller.eggcollect import EggCollection
+
+        ec = EggCollection(self.prefix, False)
+        self.assertEqual(ec.find('bar-1.0-1.egg')['key'], 'bar-1.0-1.egg')
+        self.assertEqual(ec.find('bar-1.1-1.egg'), None)
+        self.assertEqual(ec.db._conn, None)
+        self.assertEqual([key for key, info in ec.query()],
+                         ['bar-1.0-1.egg', 'baz-1.0-1.egg'])
+        # the connection (and validated database) is kept
+        conn = ec.db._conn
+        self.assertEqual([key for key, info in ec.query(name='baz')],
+                         ['baz-1.0-1.egg'])
+        self.assert_(ec.db._conn is conn)
+        # until the collection modifies the prefix
+        ec.remove('bar-1.0-1.egg')
+        self.assertEqual(ec.db._conn, None)
+        self.assertEqual([key for key, info in ec.query()],
+                         ['baz-1.0-1.egg'])
+        self.assertEqual(ec.find('bar-1.0-1.egg'), None)
+        ec.db.close()
+
+    def test_rewritten(self):
+        # info.json rewritten in place by another process, within the
+        # same second as the database was updated
+        prefixdb._recorded.clear()
+        path = join(self.prefix, 'EGG-INFO', 'baz', 'info.json')
+        info = json.load(open(path))
+        info['version'] = '2.0'
+        st = os.stat(path)
+        json.dump(info, open(path, 'w'))
+        os.utime(path, (st.st_atime, st.st_mtime))
+        info, = self.db.query(False, name='baz')
+        self.assertEqual(info['version'], '2.0')
+
+
+class TestUpgrade(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = join(self.dir, 'prefix')
+        self.site_packages = join(self.prefix, rel_site_packages)
+        self.src_path = join(self.dir, 'foo-1.0-1.egg')
+        self.dst_path = join(self.dir, 'foo-1.1-1.egg')
+        create_egg(self.src_path, {
+            'foo/__init__.py': 'version = 1\n',
+            'foo/old.py': 'old = 1\n',
+            'foo/same.txt': 'same\n' * 100})
+        create_egg(self.dst_path, {
+            'foo/__init__.py': 'version = 2\n',
+            'foo/new.py': 'new = 1\n',
+            'foo/same.txt': 'same\n' * 100})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_upgrade(self):
+        EggInst(self.src_path, self.prefix).install()
+        meta_dir = join(self.prefix, 'EGG-INFO', 'foo')
+        self.assertEqual(read_meta(meta_dir)['arcinfo']['foo/old.py'][0], 8)
+        same = join(self.site_packages, 'foo', 'same.txt')
+        os.utime(same, (0, 0))
+
+        EggInst(self.dst_path, self.prefix).upgrade()
+        d = read_meta(meta_dir)
+        self.assertEqual(d['egg_name'], 'foo-1.1-1.egg')
+        self.assertEqual(sorted(d['arcinfo']),
+                         ['foo/__init__.py', 'foo/new.py', 'foo/same.txt'])
+        # the unchanged file was not written again
+        self.assertEqual(os.stat(same).st_mtime, 0)
+        self.assertFalse(isfile(join(self.site_packages, 'foo', 'old.py')))
+        self.assertEqual(
+            open(join(self.site_packages, 'foo', '__init__.py')).read(),
+            'version = 2\n')
+        self.assert_(isfile(join(self.site_packages, 'foo', 'new.py')))
+
+    def test_upgrade_unchanged(self):
+        EggInst(self.src_path, self.prefix).install()
+        same = join(self.site_packages, 'foo', 'same.txt')
+        init = join(self.site_packages, 'foo', '__init__.py')
+        # such that rewritten files get a different mtime
+        os.utime(same, (1000, 1000))
+        os.utime(init, (1000, 1000))
+        ino = os.stat(same).st_ino
+
+        EggInst(self.dst_path, self.prefix).upgrade()
+        # the unchanged member is neither rewritten nor replaced
+        st = os.stat(same)
+        self.assertEqual(st.st_ino, ino)
+        self.assertEqual(st.st_mtime, 1000)
+        self.assertNotEqual(os.stat(init).st_mtime, 1000)
+
+    def test_upgrade_pyc(self):
+        ei = EggInst(self.src_path, self.prefix)
+        ei.compile = True
+        ei.install()
+        foo_dir = join(self.site_packages, 'foo')
+        for fn in 'old.pyc', '__init__.pyc':
+            self.assert_(isfile(join(foo_dir, fn)), fn)
+
+        ei = EggInst(self.dst_path, self.prefix)
+        ei.compile = True
+        ei.upgrade()
+        # the obsolete .py and .pyc files are removed
+        self.assertFalse(isfile(join(foo_dir, 'old.py')))
+        self.assertFalse(isfile(join(foo_dir, 'old.pyc')))
+        self.assert_(isfile(join(foo_dir, 'new.pyc')))
+        files = read_meta(join(self.prefix, 'EGG-INFO', 'foo'))['files']
+        self.assertFalse(any(f.endswith('/old.pyc') for f in files))
+        self.assert_(any(f.endswith('/new.pyc') for f in files))
+
+    def test_upgrade_stray_pyc(self):
+        EggInst(self.src_path, self.prefix).install()
+        # byte-code written by Python (when importing), which is not
+        # listed in the installed files
+        old_pyc = join(self.site_packages, 'foo', 'old.pyc')
+        with open(old_pyc, 'wb') as fo:
+            fo.write('pyc')
+        EggInst(self.dst_path, self.prefix).upgrade()
+        self.assertFalse(isfile(old_pyc))
+
+    def test_upgrade_without_arcinfo(self):
+        EggInst(self.src_path, self.prefix).install()
+        # egginst.json as written by older versions
+        meta_dir = join(self.prefix, 'EGG-INFO', 'foo')
+        d = read_meta(meta_dir)
+        del d['arcinfo']
+        del d['hardlinks']
+        os.unlink(join(meta_dir, 'egginst.manifest'))
+        json.dump(d, open(join(meta_dir, 'egginst.json'), 'w'))
+        same = join(self.site_packages, 'foo', 'same.txt')
+        os.utime(same, (0, 0))
+
+        EggInst(self.dst_path, self.prefix).upgrade()
+        # without arcinfo, everything is installed from scratch
+        self.assertNotEqual(os.stat(same).st_mtime, 0)
+        self.assertEqual(open(same).read(), 'same\n' * 100)
+        self.assertFalse(isfile(join(self.site_packages, 'foo', 'old.py')))
+        self.assert_(isfile(join(self.site_packages, 'foo', 'new.py')))
+        self.assertEqual(
+            open(join(self.site_packages, 'foo', '__init__.py')).read(),
+            'version = 2\n')
+        d = read_meta(meta_dir)
+        self.assertEqual(d['egg_name'], 'foo-1.1-1.egg')
+        self.assertEqual(sorted(d['arcinfo']),
+                         ['foo/__init__.py', 'foo/new.py', 'foo/same.txt'])
+        # the next upgrade can use the recorded arcinfo
+        EggInst(self.src_path, self.prefix).upgrade()
+        self.assert_(isfile(join(self.site_packages, 'foo', 'old.py')))
+        self.assertFalse(isfile(join(self.site_packages, 'foo', 'new.py')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import json
+import shutil
+import zipfile
+import tempfile
+import unittest
+from os.path import isfile, join
+
+from egginst.main import EggInst
+from enstaller.egg_meta import update_index
+from enstaller.enpkg import Enpkg
+
+
+DEPEND = """\
+metadata_version = '1.1'
+name = %r
+version = %r
+build = 1
+
+arch = None
+platform = None
+osdist = None
+python = None
+packages = []
+"""
+
+def create_egg(path, name, version):
+    z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    z.writestr('%s/__init__.py' % name, 'version = %r\n' % version)
+    z.writestr('EGG-INFO/spec/depend', DEPEND % (name, version))
+    z.close()
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.repo = join(self.dir, 'repo')
+        self.prefix = join(self.dir, 'prefix')
+        old_dir = join(self.dir, 'old')
+        for d in self.repo, old_dir:
+            os.mkdir(d)
+        for name in 'bar', 'baz', 'foo':
+            path = join(old_dir, '%s-1.0-1.egg' % name)
+            create_egg(path, name, '1.0')
+            EggInst(path, self.prefix).install()
+            if name != 'foo':
+                create_egg(join(self.repo, '%s-2.0-1.egg' % name),
+                           name, '2.0')
+        update_index(self.repo)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def enpkg(self):
+        return Enpkg([self.repo], prefixes=[self.prefix])
+
+    def test_available_updates(self):
+        self.assertEqual(sorted(self.enpkg().available_updates()),
+                         [('bar-1.0-1.egg', 'bar-2.0-1.egg'),
+                          ('baz-1.0-1.egg', 'baz-2.0-1.egg')])
+
+    def test_prefetch(self):
+        enpkg = self.enpkg()
+        self.assertEqual(sorted(enpkg.prefetch()),
+                         ['bar-2.0-1.egg', 'baz-2.0-1.egg'])
+        for egg in 'bar-2.0-1.egg', 'baz-2.0-1.egg':
+            self.assert_(isfile(join(enpkg.local_dir, egg)))
+
+    def test_prefetch_failure(self):
+        index_path = join(self.repo, 'index.json')
+        index = json.load(open(index_path))
+        index['bar-2.0-1.egg']['md5'] = 32 * '0'
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+        enpkg = self.enpkg()
+        self.assertEqual(enpkg.prefetch(), ['baz-2.0-1.egg'])
+        self.assertFalse(isfile(join(enpkg.local_dir, 'bar-2.0-1.egg')))
+        self.assert_(isfile(join(enpkg.local_dir, 'baz-2.0-1.egg')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from os.path import isfile, join
+from subprocess import Popen
+from multiprocessing import Process
+
+from enstaller.lockfile import LockFile, fcntl
+
+
+def hold_lock(path, holder_path, use_flock=LockFile.use_flock):
+    # exits with 1, when another process holds the lock at the same time
+    lock = LockFile(path, poll_interval=0.01)
+    lock.use_flock = use_flock
+    for i in xrange(20):
+        lock.acquire()
+        try:
+            fd = os.open(holder_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+        except OSError:
+            os._exit(1)
+        os.close(fd)
+        os.unlink(holder_path)
+        lock.release()
+
+
+class TestLockFile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = join(self.dir, 'foo-1.0-1.egg.lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_acquire_release(self):
+        a = LockFile(self.path)
+        b = LockFile(self.path)
+        self.assert_(a.acquire())
+        self.assert_(isfile(self.path))
+        self.assertFalse(b.acquire(blocking=False))
+        a.release()
+        self.assertFalse(isfile(self.path))
+        self.assert_(b.acquire(blocking=False))
+        b.release()
+
+    def test_context(self):
+        with LockFile(self.path):
+            self.assert_(isfile(self.path))
+        self.assertFalse(isfile(self.path))
+
+    @unittest.skipIf(os.name != 'posix', "needs posix")
+    def test_stale(self):
+        # a lock owned by a process which no longer exists
+        p = Popen(['true'])
+        p.wait()
+        with open(self.path, 'w') as fo:
+            fo.write('%d %s' % (p.pid, socket.gethostname()))
+        lock = LockFile(self.path)
+        self.assert_(lock.is_stale())
+        self.assert_(lock.acquire(blocking=False))
+        lock.release()
+
+    @unittest.skipIf(os.name != 'posix', "needs posix")
+    def test_stale_contention(self):
+        # several processes reclaim the same stale lock
+        p = Popen(['true'])
+        p.wait()
+        with open(self.path, 'w') as fo:
+            fo.write('%d %s' % (p.pid, socket.gethostname()))
+        procs = [Process(target=hold_lock,
+                         args=(self.path, join(self.dir, 'holder')))
+                 for i in xrange(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_not_stale(self):
+        a = LockFile(self.path)
+        self.assert_(a.acquire())
+        b = LockFile(self.path)
+        self.assertFalse(b.is_stale())
+        self.assertFalse(b.acquire(blocking=False))
+        a.release()
+
+    def test_not_stale_pid(self):
+        # without flock, a lock owned by an existing process
+        with open(self.path, 'w') as fo:
+            fo.write('%d %s' % (os.getpid(), socket.gethostname()))
+        lock = LockFile(self.path)
+        lock.use_flock = False
+        self.assertFalse(lock.is_stale())
+        self.assertFalse(lock.acquire(blocking=False))
+
+    def test_release_reclaimed(self):
+        # without flock, a lock which was reclaimed (as stale) by another
+        # process is not removed when released
+        a = LockFile(self.path)
+        a.use_flock = False
+        self.assert_(a.acquire())
+        os.unlink(self.path)
+        b = LockFile(self.path)
+        b.use_flock = False
+        self.assert_(b.acquire(blocking=False))
+        a.release()
+        self.assert_(isfile(self.path))
+        b.release()
+        self.assertFalse(isfile(self.path))
+
+    @unittest.skipIf(fcntl is None, "no fcntl")
+    def test_flock_contention(self):
+        procs = [Process(target=hold_lock,
+                         args=(self.path, join(self.dir, 'holder'), True))
+                 for i in xrange(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+        self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from os.path import isfile, join
+
+from enstaller.utils import md5_file
+from enstaller.md5cache import CACHE_FN, MD5Cache
+
+
+class TestMD5Cache(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = join(self.dir, 'foo-1.0-1.egg')
+        self.write('Hello world\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, data):
+        with open(self.path, 'wb') as fo:
+            fo.write(data)
+
+    def test_get(self):
+        cache = MD5Cache(self.dir)
+        self.assertEqual(cache.get(self.path), md5_file(self.path))
+        cache.save()
+        self.assert_(isfile(join(self.dir, CACHE_FN)))
+
+    def test_cached(self):
+        cache = MD5Cache(self.dir)
+        cache.set(self.path, 'a' * 32)
+        cache.save()
+        # the file did not change, so the (wrong) cached value is returned
+        self.assertEqual(MD5Cache(self.dir).get(self.path), 'a' * 32)
+        # unless a verification is requested
+        self.assertEqual(MD5Cache(self.dir, verify=True).get(self.path),
+                         md5_file(self.path))
+
+    def test_changed(self):
+        cache = MD5Cache(self.dir)
+        cache.set(self.path, 'a' * 32)
+        cache.save()
+        self.write('Hello world, again\n')
+        self.assertEqual(MD5Cache(self.dir).get(self.path),
+                         md5_file(self.path))
+
+    def test_removed(self):
+        cache = MD5Cache(self.dir)
+        cache.get(self.path)
+        os.unlink(self.path)
+        cache.save()
+        index = json.load(open(join(self.dir, CACHE_FN)))
+        self.assertEqual(index, {})
+
+    def test_merge(self):
+        # two caches of the same directory (e.g. used by different
+        # processes) do not lose each other's entries when saved
+        path2 = join(self.dir, 'bar-1.0-1.egg')
+        with open(path2, 'wb') as fo:
+            fo.write('Hello bar\n')
+        cache1 = MD5Cache(self.dir)
+        cache2 = MD5Cache(self.dir)
+        cache1.set(self.path, 'a' * 32)
+        cache2.set(path2, 'b' * 32)
+        cache1.save()
+        cache2.save()
+        index = json.load(open(join(self.dir, CACHE_FN)))
+        self.assertEqual(sorted((fn, entry['md5'])
+                                for fn, entry in index.items()),
+                         [('bar-1.0-1.egg', 'b' * 32),
+                          ('foo-1.0-1.egg', 'a' * 32)])
+        # no lock or temporary files are left behind
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         [CACHE_FN, 'bar-1.0-1.egg', 'foo-1.0-1.egg'])
+
+
+if __name__ == '__main__':
+    unittest.main()
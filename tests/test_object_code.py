@@ -0,0 +1,54 @@
+import shutil
+import zipfile
+import tempfile
+import unittest
+from os.path import join
+
+from egginst import object_code
+
+
+PLACEHOLDER = 5 * '/PLACEHOLD'
+DATA = ('\x7fELF' + 100 * '\x01' + PLACEHOLDER + ':/usr/lib\0' +
+        50 * '\x02' + PLACEHOLDER + '\0' + 10 * '\x03')
+
+
+class TestObjectCode(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = join(self.dir, 'libfoo.so')
+        with open(self.path, 'wb') as fo:
+            fo.write(DATA)
+        object_code._targets = ['/opt/lib']
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def check_fixed(self):
+        data = open(self.path, 'rb').read()
+        self.assertEqual(len(data), len(DATA))
+        self.assert_('/PLACEHOLD' not in data)
+        self.assert_('/opt/lib:/usr/lib\0' in data)
+        self.assertEqual(data.count('/opt/lib\0'), 1)
+
+    def test_fix_scan(self):
+        object_code.fix_object_code(self.path)
+        self.check_fixed()
+
+    def test_fix_offsets(self):
+        offsets = [104, 104 + len(PLACEHOLDER) + 10 + 50]
+        object_code.fix_object_code(self.path, offsets)
+        self.check_fixed()
+
+    def test_manifest(self):
+        z = zipfile.ZipFile(join(self.dir, 'foo.egg'), 'w')
+        z.writestr('EGG-INFO/usr/lib/libfoo.so', DATA)
+        z.writestr('foo/data.txt', DATA)
+        z.writestr('foo/plain.bin', PLACEHOLDER + '\0')
+        self.assertEqual(object_code.placeholders_manifest(z),
+                         'EGG-INFO/usr/lib/libfoo.so 104 214\n')
+        z.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
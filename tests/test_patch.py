@@ -0,0 +1,119 @@
+import os
+import json
+import random
+import shutil
+import zipfile
+import tempfile
+import unittest
+from os.path import join
+
+from enstaller.patch import (INDEX_KEYS, PatchPolicy, split, update_index,
+                             update_patches, zdiff)
+
+
+def create_eggs(eggs_dir, versions, data):
+    for version in versions:
+        z = zipfile.ZipFile(join(eggs_dir, 'foo-%s-1.egg' % version), 'w',
+                            zipfile.ZIP_DEFLATED)
+        z.writestr('EGG-INFO/spec/depend',
+                   "name = 'foo'\nversion = '%s'\n" % version)
+        z.writestr('foo/__init__.py', 'version = %r\n' % version)
+        z.writestr('foo/data.bin', data)
+        z.close()
+
+
+class TestPatch(unittest.TestCase):
+
+    def test_split(self):
+        self.assertEqual(split('nose-1.0.0-1--1.1.2-1.zdiff'),
+                         ('nose-1.0.0-1.egg', 'nose-1.1.2-1.egg'))
+        self.assertRaises(Exception, split, 'nose-1.0.0-1.egg')
+
+    def test_select(self):
+        for pairs, k, n, res in [
+            (['all'], 3, 4, [(0, 1), (0, 2), (0, 3), (1, 2), (1, 3), (2, 3)]),
+            (['all'], 3, 1, []),
+            (['adjacent'], 3, 4, [(0, 1), (1, 2), (2, 3)]),
+            (['latest'], 2, 5, [(2, 4), (3, 4)]),
+            (['latest'], 9, 3, [(0, 2), (1, 2)]),
+            (['adjacent', 'latest'], 2, 4, [(0, 1), (1, 2), (1, 3), (2, 3)]),
+            (['ladder'], 3, 6, [(0, 1), (0, 2), (1, 2), (1, 3),
+                                (2, 3), (0, 4), (2, 4), (3, 4), (1, 5),
+                                (3, 5), (4, 5)]),
+            ]:
+            policy = PatchPolicy(pairs, k)
+            self.assertEqual(policy.select(n), sorted(res))
+
+    def test_ladder_size(self):
+        n = 1000
+        self.assert_(len(PatchPolicy(['ladder']).select(n)) < n * 10)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, PatchPolicy, ['foo'])
+
+    def test_keep(self):
+        # the defaults correspond to the old fixed thresholds
+        policy = PatchPolicy()
+        for dst_size, patch_size, res in [
+            (100000, 1000, False),
+            (200000, 99000, True),
+            (200000, 101000, False),
+            ]:
+            self.assertEqual(policy.keep(dst_size, patch_size), res)
+
+        # with many downloads, even small savings justify storing a patch
+        policy = PatchPolicy(downloads=100, cpu_factor=0.1,
+                             storage_factor=1)
+        self.assert_(policy.keep(200000, 150000))
+        self.assertFalse(policy.keep(200000, 190000))
+
+
+@unittest.skipIf(zdiff is None, "bsdiff4 not installed")
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.patches_dir = join(self.dir, 'patches')
+        os.mkdir(self.patches_dir)
+        rnd = random.Random(42)
+        self.data = ''.join(chr(rnd.randrange(256)) for i in xrange(50000))
+        create_eggs(self.dir, ['1.0', '1.1'], self.data)
+        self.policy = PatchPolicy(min_size=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_index(self):
+        update_patches(self.dir, self.patches_dir, workers=1,
+                       policy=self.policy, version=2)
+        update_index(self.dir, self.patches_dir, policy=self.policy)
+        index = json.load(open(join(self.patches_dir, 'index.json')))
+        info = index['foo-1.0-1--1.1-1.zdiff']
+        # the sizes of the members are only in the patch itself
+        self.assertEqual(sorted(info), sorted(INDEX_KEYS))
+        self.assert_('dst_sizes' in
+                     zdiff.info(join(self.patches_dir,
+                                     'foo-1.0-1--1.1-1.zdiff')))
+
+    def test_workers(self):
+        create_eggs(self.dir, ['1.2', '1.3'], self.data)
+        update_patches(self.dir, self.patches_dir, workers=2,
+                       policy=self.policy)
+        self.assertEqual(sorted(os.listdir(self.patches_dir)),
+                         ['foo-1.0-1--1.1-1.zdiff', 'foo-1.0-1--1.2-1.zdiff',
+                          'foo-1.0-1--1.3-1.zdiff', 'foo-1.1-1--1.2-1.zdiff',
+                          'foo-1.1-1--1.3-1.zdiff', 'foo-1.2-1--1.3-1.zdiff'])
+
+    def test_workers_error(self):
+        create_eggs(self.dir, ['1.2'], self.data)
+        # an egg which is not a zip-file makes its patches fail
+        with open(join(self.dir, 'foo-1.1-1.egg'), 'wb') as f:
+            f.write('not a zip-file')
+        self.assertRaises(Exception, update_patches, self.dir,
+                          self.patches_dir, workers=2, policy=self.policy)
+        for fn in os.listdir(self.patches_dir):
+            self.assertFalse(fn.endswith('.part'), fn)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import random
+import shutil
+import zipfile
+import tempfile
+import unittest
+from os.path import join
+
+try:
+    from enstaller.patch import PatchPolicy
+    from enstaller.patchbench import bench, summarize
+except ImportError:
+    summarize = None
+
+
+def result(dst_size, patch_size, memory):
+    m = dict(time=1.0, memory=memory)
+    return dict(dst_size=dst_size,
+                versions={'1': dict(patch_size=patch_size, diff=m,
+                                    raw_copy=m, recompress=m)})
+
+
+@unittest.skipIf(summarize is None, "bsdiff4 not installed")
+class TestPatchBench(unittest.TestCase):
+
+    def test_summarize(self):
+        s = summarize([result(1000, 100, 10), result(3000, 300, 20)])
+        self.assertEqual(s.keys(), ['1'])
+        s = s['1']
+        self.assertEqual(s['dst_size'], 4000)
+        self.assertEqual(s['patch_size'], 400)
+        self.assertEqual(s['ratio'], 0.1)
+        self.assertEqual(s['diff_time'], 2.0)
+        self.assertEqual(s['max_memory'], 20)
+        self.assertEqual(summarize([]), {})
+
+    def test_bench(self):
+        tmp_dir = tempfile.mkdtemp()
+        rnd = random.Random(42)
+        data = ''.join(chr(rnd.randrange(256)) for i in xrange(50000))
+        try:
+            for version in '1.0', '1.1':
+                z = zipfile.ZipFile(join(tmp_dir, 'foo-%s-1.egg' % version),
+                                    'w', zipfile.ZIP_DEFLATED)
+                z.writestr('EGG-INFO/spec/depend',
+                           "name = 'foo'\nversion = '%s'\n" % version)
+                z.writestr('foo/__init__.py', 'version = %r\n' % version)
+                z.writestr('foo/data.bin', data)
+                z.close()
+            report = bench(tmp_dir, PatchPolicy(min_size=0), workers=1)
+            r, = report['results']
+            self.assertEqual(r['patch'], 'foo-1.0-1--1.1-1.zdiff')
+            self.assertEqual(sorted(r['versions']), ['1', '2'])
+            for vr in r['versions'].itervalues():
+                self.assert_(0 < vr['patch_size'] < r['dst_size'])
+                for key in 'diff', 'raw_copy', 'recompress':
+                    self.assert_(vr[key]['time'] >= 0)
+            self.assertEqual(sorted(report['summary']), ['1', '2'])
+            # the benchmarked repository is not modified
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['foo-1.0-1.egg', 'foo-1.1-1.egg'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
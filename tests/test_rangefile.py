@@ -0,0 +1,104 @@
+import json
+import shutil
+import hashlib
+import urllib
+import zipfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+from os.path import join
+
+from enstaller.fetch import MD5Mismatch
+from enstaller.store.indexed import RemoteHTTPIndexedStore
+from enstaller.store.rangefile import RangeFile
+
+
+def create_zip():
+    f = StringIO()
+    z = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+    for i in xrange(20):
+        z.writestr('foo/%d.txt' % i, str(i) * 1000 * i)
+    z.close()
+    return f.getvalue()
+
+
+class TestRangeFile(unittest.TestCase):
+
+    def setUp(self):
+        self.data = create_zip()
+        self.requests = []
+
+    def open_range(self, start, stop):
+        self.requests.append((start, stop))
+        return StringIO(self.data[start:stop])
+
+    def test_read_seek(self):
+        f = RangeFile(self.open_range, len(self.data), block_size=100)
+        self.assertEqual(f.read(250), self.data[:250])
+        f.seek(-10, 2)
+        self.assertEqual(f.read(), self.data[-10:])
+        self.assertEqual(f.read(), '')
+        f.seek(1000)
+        f.seek(5, 1)
+        self.assertEqual(f.tell(), 1005)
+        self.assertEqual(f.read(3), self.data[1005:1008])
+
+    def test_bounded(self):
+        f = RangeFile(self.open_range, len(self.data), block_size=100,
+                      max_blocks=2)
+        self.assertEqual(f.read(), self.data)
+        self.assertEqual(len(f._blocks), 2)
+
+    def test_zipfile(self):
+        f = RangeFile(self.open_range, len(self.data), block_size=1024)
+        z = zipfile.ZipFile(f)
+        for i in xrange(20):
+            self.assertEqual(z.read('foo/%d.txt' % i), str(i) * 1000 * i)
+        z.close()
+
+
+class Limiter(object):
+
+    def __init__(self):
+        self.consumed = 0
+
+    def consume(self, n):
+        self.consumed += n
+
+
+class TestOpenSeekable(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = create_zip()
+        with open(join(self.dir, 'foo-1.0-1.egg'), 'wb') as fo:
+            fo.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, md5):
+        with open(join(self.dir, 'index.json'), 'w') as fo:
+            json.dump({'foo-1.0-1.egg': dict(name='foo', size=len(self.data),
+                                             md5=md5)}, fo)
+        # file: URLs do not support Range requests, so the data is spooled
+        store = RemoteHTTPIndexedStore(
+            'file:' + urllib.pathname2url(self.dir) + '/')
+        store.connect()
+        return store
+
+    def test_spooled(self):
+        store = self.store(hashlib.md5(self.data).hexdigest())
+        limiter = Limiter()
+        f = store.open_seekable('foo-1.0-1.egg', limiter=limiter)
+        self.assertEqual(f.read(), self.data)
+        f.close()
+        self.assertEqual(limiter.consumed, len(self.data))
+
+    def test_md5_mismatch(self):
+        store = self.store('0' * 32)
+        self.assertRaises(MD5Mismatch, store.open_seekable, 'foo-1.0-1.egg')
+
+
+if __name__ == '__main__':
+    unittest.main()
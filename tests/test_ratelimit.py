@@ -0,0 +1,68 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from os.path import join
+
+from enstaller.ratelimit import (TokenBucket, SharedTokenBucket,
+                                 JoinedLimiter, create_limiter, fcntl)
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertRate(self, limiter, rate, n):
+        t0 = time.time()
+        for i in xrange(n / 1000):
+            limiter.consume(1000)
+        dt = time.time() - t0
+        # a full bucket (one second worth of data) is available initially
+        self.assert_(dt > 0.8 * (n - rate) / rate, dt)
+
+    def test_bucket(self):
+        self.assertRate(TokenBucket(1000000), 1000000, 1200000)
+
+    def test_large_consume(self):
+        t0 = time.time()
+        TokenBucket(1000000).consume(1200000)
+        self.assert_(time.time() - t0 > 0.15)
+
+    @unittest.skipIf(fcntl is None, "no fcntl")
+    def test_shared(self):
+        path = join(self.dir, 'bandwidth')
+        a = SharedTokenBucket(1000000, path)
+        b = SharedTokenBucket(1000000, path)
+        # both buckets share the same budget, so the second one has
+        # to wait for the bucket to be refilled
+        t0 = time.time()
+        for limiter in a, b:
+            for i in xrange(600):
+                limiter.consume(1000)
+        self.assert_(time.time() - t0 > 0.15)
+
+    @unittest.skipIf(fcntl is None, "no fcntl")
+    def test_shared_symlink(self):
+        # a symbolic link is not followed, and the rate is limited per
+        # process instead
+        target = join(self.dir, 'target')
+        path = join(self.dir, 'bandwidth')
+        os.symlink(target, path)
+        limiter = SharedTokenBucket(1000000, path)
+        self.assertRate(limiter, 1000000, 1200000)
+        self.assert_(limiter._fallback is not None)
+        self.assert_(not os.path.exists(target))
+
+    def test_create(self):
+        self.assertEqual(create_limiter(), None)
+        self.assert_(isinstance(create_limiter(1000), TokenBucket))
+        self.assert_(isinstance(create_limiter(1000, 2000), JoinedLimiter))
+
+
+if __name__ == '__main__':
+    unittest.main()
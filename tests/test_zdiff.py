@@ -0,0 +1,218 @@
+import random
+import shutil
+import zipfile
+import tempfile
+import threading
+import unittest
+from os.path import join
+
+try:
+    import enstaller.zdiff as zdiff
+except ImportError:
+    zdiff = None
+
+
+def create_egg(path, files):
+    z = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED)
+    for name in sorted(files):
+        z.writestr(name, files[name])
+    z.close()
+
+
+def read_egg(path):
+    z = zipfile.ZipFile(path)
+    res = dict((name, z.read(name)) for name in z.namelist())
+    assert z.testzip() is None
+    z.close()
+    return res
+
+
+@unittest.skipIf(zdiff is None, "bsdiff4 not installed")
+class TestZdiff(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        rnd = random.Random(42)
+        data = ''.join(chr(rnd.randrange(256)) for i in xrange(100000))
+        self.src = {
+            'EGG-INFO/spec/depend': "name = 'foo'\nversion = '1.0'\n",
+            'foo/__init__.py': '',
+            'foo/data.bin': data,
+            'foo/old.py': 'old = 1\n',
+            'foo/same.txt': 'same\n' * 1000,
+        }
+        self.dst = {
+            'EGG-INFO/spec/depend': "name = 'foo'\nversion = '1.1'\n",
+            'foo/__init__.py': '',
+            'foo/data.bin': data[:50000] + 'changed' + data[50000:],
+            'foo/new.py': 'new = 1\n' * 100,
+            'foo/same.txt': 'same\n' * 1000,
+        }
+        self.src_path = join(self.dir, 'foo-1.0-1.egg')
+        self.dst_path = join(self.dir, 'foo-1.1-1.egg')
+        self.patch_path = join(self.dir, 'foo-1.0-1--1.1-1.zdiff')
+        create_egg(self.src_path, self.src)
+        create_egg(self.dst_path, self.dst)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_diff(self):
+        self.assertEqual(zdiff.diff(self.src_path, self.dst_path,
+                                    self.patch_path), 4)
+        info = zdiff.info(self.patch_path)
+        self.assertEqual(info['src'], 'foo-1.0-1.egg')
+        self.assertEqual(info['dst'], 'foo-1.1-1.egg')
+        z = zipfile.ZipFile(self.patch_path)
+        self.assert_(z.read('foo/data.bin').startswith('BSDIFF4'))
+        self.assertEqual(z.read('foo/old.py'), 'RM')
+        self.assertFalse('foo/same.txt' in z.namelist())
+        z.close()
+
+    def test_diff_v2(self):
+        self.assertEqual(zdiff.diff(self.src_path, self.dst_path,
+                                    self.patch_path, version=2), 4)
+        self.assertEqual(zdiff.info(self.patch_path)['zdiff_version'], 2)
+        z = zipfile.ZipFile(self.patch_path)
+        self.assert_(z.read('foo/new.py').startswith('DF'))
+        z.close()
+        out_path = join(self.dir, 'out.egg')
+        zdiff.patch(self.src_path, out_path, self.patch_path)
+        self.assertEqual(read_egg(out_path), self.dst)
+
+        self.dst['foo/new.py'] = 'new = 2\n' * 100
+        z = zipfile.ZipFile(self.dst_path, 'w', zipfile.ZIP_STORED)
+        for name in sorted(self.dst):
+            z.writestr(name, self.dst[name])
+        z.close()
+        zdiff.diff(self.src_path, self.dst_path, self.patch_path, version=2)
+        z = zipfile.ZipFile(self.patch_path)
+        self.assert_(z.read('foo/new.py').startswith('ZL'))
+        z.close()
+        zdiff.patch(self.src_path, out_path, self.patch_path)
+        self.assertEqual(read_egg(out_path), self.dst)
+
+    def test_maybe_smaller_bz2(self):
+        zinfo = zipfile.ZipInfo('foo/data.bin')
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+        zinfo.compress_size = 1000
+        self.assertFalse(zdiff.maybe_smaller_bz2(zinfo, 100))
+        self.assert_(zdiff.maybe_smaller_bz2(zinfo, 800))
+        zinfo.compress_type = zipfile.ZIP_STORED
+        self.assert_(zdiff.maybe_smaller_bz2(zinfo, 100))
+
+    def test_patch(self):
+        zdiff.diff(self.src_path, self.dst_path, self.patch_path)
+        out_path = join(self.dir, 'out.egg')
+        for raw_copy in True, False:
+            for workers in 1, 3:
+                zdiff.patch(self.src_path, out_path, self.patch_path,
+                            raw_copy=raw_copy, workers=workers)
+                self.assertEqual(read_egg(out_path), self.dst)
+
+    def test_patch_error(self):
+        zdiff.diff(self.src_path, self.dst_path, self.patch_path)
+        # replace the bsdiff data of the members by invalid data
+        z = zipfile.ZipFile(self.patch_path)
+        members = [(name, z.read(name)) for name in z.namelist()]
+        z.close()
+        z = zipfile.ZipFile(self.patch_path, 'w')
+        for name, data in members:
+            if data.startswith('BSDIFF4'):
+                data = 'BSDIFF4' + 50 * 'x'
+            z.writestr(name, data)
+        z.close()
+        count = threading.active_count()
+        self.assertRaises(Exception, zdiff.patch, self.src_path,
+                          join(self.dir, 'out.egg'), self.patch_path,
+                          workers=3)
+        # the worker threads are not left running
+        self.assertEqual(threading.active_count(), count)
+
+    def test_blocks(self):
+        threshold, block_size = zdiff.BLOCK_THRESHOLD, zdiff.BLOCK_SIZE
+        zdiff.BLOCK_THRESHOLD, zdiff.BLOCK_SIZE = 20000, 8192
+        try:
+            self.assertEqual(zdiff.diff(self.src_path, self.dst_path,
+                                        self.patch_path), 4)
+            z = zipfile.ZipFile(self.patch_path)
+            self.assert_(z.read('foo/data.bin').startswith('BLKDIFF'))
+            z.close()
+            out_path = join(self.dir, 'out.egg')
+            for workers in 1, 3:
+                zdiff.patch(self.src_path, out_path, self.patch_path,
+                            workers=workers)
+                self.assertEqual(read_egg(out_path), self.dst)
+            # large added members
+            self.dst['foo/big.bin'] = self.src['foo/data.bin'][::-1]
+            create_egg(self.dst_path, self.dst)
+            for version in 1, 2:
+                zdiff.diff(self.src_path, self.dst_path, self.patch_path,
+                           version=version)
+                zdiff.patch(self.src_path, out_path, self.patch_path)
+                self.assertEqual(read_egg(out_path), self.dst)
+        finally:
+            zdiff.BLOCK_THRESHOLD, zdiff.BLOCK_SIZE = threshold, block_size
+
+    def test_dst_sizes(self):
+        # a large member which compresses well is patched using bounded
+        # memory, based on its recorded (uncompressed) size
+        threshold = zdiff.BLOCK_THRESHOLD
+        zdiff.BLOCK_THRESHOLD = 20000
+        try:
+            self.dst['foo/zeros.bin'] = 100000 * '\0'
+            create_egg(self.dst_path, self.dst)
+            for version in 1, 2:
+                zdiff.diff(self.src_path, self.dst_path, self.patch_path,
+                           version=version)
+                z, info = zdiff.open_zdiff(self.patch_path)
+                sizes = info['dst_sizes']
+                self.assertEqual(sizes['foo/zeros.bin'], 100000)
+                self.assert_(z.getinfo('foo/zeros.bin').file_size < 20000)
+                self.assert_(zdiff.is_large(z, 'foo/zeros.bin', sizes))
+                self.assertFalse(zdiff.is_large(z, 'foo/new.py', sizes))
+                # patches without recorded sizes
+                self.assert_(zdiff.is_large(z, 'foo/new.py'))
+                z.close()
+                out_path = join(self.dir, 'out.egg')
+                zdiff.patch(self.src_path, out_path, self.patch_path)
+                self.assertEqual(read_egg(out_path), self.dst)
+                pz = zdiff.PatchedZip(self.src_path, self.patch_path)
+                pz.sizes = None
+                self.assertEqual(pz.getinfo('foo/zeros.bin').file_size,
+                                 100000)
+                self.assertEqual(pz.open('foo/zeros.bin').read(),
+                                 100000 * '\0')
+                pz.close()
+        finally:
+            zdiff.BLOCK_THRESHOLD = threshold
+
+    def test_patched_zip(self):
+        for version in 1, 2:
+            zdiff.diff(self.src_path, self.dst_path, self.patch_path,
+                       version=version)
+            z = zdiff.PatchedZip(self.src_path, self.patch_path)
+            self.assertEqual(sorted(z.namelist()), sorted(self.dst))
+            self.assertEqual(sorted(z.unchanged()),
+                             ['foo/__init__.py', 'foo/same.txt'])
+            for name in self.dst:
+                self.assertEqual(z.read(name), self.dst[name])
+                self.assertEqual(z.open(name).read(), self.dst[name])
+                self.assertEqual(z.getinfo(name).file_size,
+                                 len(self.dst[name]))
+            self.assertRaises(KeyError, z.read, 'foo/old.py')
+            z.close()
+
+    def test_copy_raw(self):
+        out_path = join(self.dir, 'out.egg')
+        x = zipfile.ZipFile(self.src_path)
+        y = zipfile.ZipFile(out_path, 'w')
+        for name in x.namelist():
+            zdiff.copy_raw(x, y, name)
+        y.close()
+        x.close()
+        self.assertEqual(read_egg(out_path), self.src)
+
+
+if __name__ == '__main__':
+    unittest.main()